@@ -0,0 +1,269 @@
+from database import models
+from database.database import AsyncSessionLocal
+from database.runner import run
+from database.survey_cache import SurveyDefinitionCache, survey_definition_cache
+import json
+import numpy as np
+import pandas as pd
+
+# 回答者 × 設問の行列（クロス集計・相関用）
+#
+# アンケートの提出済み回答を1回のクエリ（models.stream_survey_answers）で読み込み、
+# 設問の形式ごとにNumPyの配列にする。
+#   単一選択（radio / select / select_slider）: 選択肢の番号（int32、未回答は-1）
+#   複数選択（multiselect）: 回答者と選択肢の組（疎なone-hot。rows, colsの2つの配列）
+#   スライダー（slider）: 数値（float64、未回答はNaN）
+#   それ以外: 回答の文字列（object、未回答はNone）
+# 選択肢の番号はQuestion.optionsの順。optionsにない回答はその後ろに番号を振る。
+# 行列はアンケートごとにキャッシュし、回答状況・アンケートの変更で作り直す。
+
+NUMERIC_QUESTION_TYPES = ("slider",)
+
+
+class ResponseMatrix:
+    def __init__(self, survey_id, respondents, questions, columns):
+        self.survey_id = survey_id
+        self.respondents = respondents
+        self.questions = questions
+        self.columns = columns
+
+    @property
+    def n_respondents(self):
+        return len(self.respondents)
+
+    # 設問の形式（"categorical", "multiselect", "numeric", "text"）
+    def kind(self, key):
+        return self.columns[key]["kind"]
+
+    def categories(self, key):
+        return self.columns[key].get("categories", [])
+
+    # 単一選択の選択肢の番号、スライダー・文字列の値
+    def values(self, key):
+        column = self.columns[key]
+        return column["codes"] if column["kind"] == "categorical" else column["values"]
+
+    # 選択肢ごとのone-hot（回答者数 × 選択肢数のbool配列）
+    def onehot(self, key):
+        column = self.columns[key]
+        matrix = np.zeros((self.n_respondents, len(column["categories"])), dtype=bool)
+        if column["kind"] == "categorical":
+            answered = np.flatnonzero(column["codes"] >= 0)
+            matrix[answered, column["codes"][answered]] = True
+        elif column["kind"] == "multiselect":
+            matrix[column["rows"], column["cols"]] = True
+        else:
+            raise ValueError(f"{key}は選択式の設問ではありません")
+        return matrix
+
+    # 設問keyの回答がvalueの回答者（複数選択はvalueを選んだ回答者）のbool配列
+    def mask(self, key, value):
+        column = self.columns[key]
+        if column["kind"] == "categorical":
+            if value not in column["categories"]:
+                return np.zeros(self.n_respondents, dtype=bool)
+            return column["codes"] == column["categories"].index(value)
+        if column["kind"] == "multiselect":
+            mask = np.zeros(self.n_respondents, dtype=bool)
+            if value in column["categories"]:
+                index = column["categories"].index(value)
+                mask[column["rows"][column["cols"] == index]] = True
+            return mask
+        return column["values"] == value
+
+    # 2つの選択式の設問のクロス集計（maskで回答者を絞り込める）
+    def crosstab(self, row_key, col_key, mask=None):
+        rows = self.onehot(row_key)
+        cols = self.onehot(col_key)
+        if mask is not None:
+            rows = rows[mask]
+            cols = cols[mask]
+        counts = rows.T.astype(np.int64) @ cols.astype(np.int64)
+        return pd.DataFrame(
+            counts,
+            index=pd.Index([str(c) for c in self.categories(row_key)], name=row_key),
+            columns=pd.Index([str(c) for c in self.categories(col_key)], name=col_key),
+        )
+
+    # 相関などに使う数値の表（スライダーの値と単一選択の番号、未回答はNaN）
+    def numeric_frame(self, mask=None):
+        data = {}
+        for key, column in self.columns.items():
+            if column["kind"] == "numeric":
+                data[key] = column["values"]
+            elif column["kind"] == "categorical":
+                data[key] = np.where(column["codes"] >= 0, column["codes"], np.nan)
+        frame = pd.DataFrame(data, index=pd.Index(self.respondents, name="username"))
+        return frame if mask is None else frame[mask]
+
+    # 行列が使っているメモリ（バイト）
+    def nbytes(self):
+        return sum(
+            array.nbytes
+            for column in self.columns.values()
+            for name, array in column.items()
+            if isinstance(array, np.ndarray)
+        )
+
+
+# 設問ごとの回答（回答者の番号, 回答の文字列）を、設問の形式に応じた列にする
+def _categorical_column(n, users, texts, options):
+    categories = list(options or [])
+    lookup = {str(c): i for i, c in enumerate(categories)}
+    codes = np.full(n, -1, dtype=np.int32)
+    if len(users):
+        # 回答の種類ごとに1回だけ番号を引く
+        uniques, inverse = np.unique(texts, return_inverse=True)
+        unique_codes = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            if value not in lookup:
+                lookup[value] = len(categories)
+                categories.append(value)
+            unique_codes[i] = lookup[value]
+        codes[users] = unique_codes[inverse]
+    return {"kind": "categorical", "codes": codes, "categories": categories}
+
+
+def _multiselect_column(n, users, texts, options):
+    categories = list(options or [])
+    lookup = {str(c): i for i, c in enumerate(categories)}
+    rows = np.empty(0, dtype=np.int32)
+    cols = np.empty(0, dtype=np.int32)
+    if len(users):
+        # 選択の組み合わせごとに1回だけJSONを読み、選択肢の番号のリストにする
+        uniques, inverse = np.unique(texts, return_inverse=True)
+        selected = []
+        for value in uniques:
+            try:
+                items = json.loads(value)
+            except ValueError:
+                items = [value]
+            if not isinstance(items, list):
+                items = [items]
+            codes = []
+            for item in items:
+                item = str(item)
+                if item not in lookup:
+                    lookup[item] = len(categories)
+                    categories.append(item)
+                codes.append(lookup[item])
+            selected.append(np.array(codes, dtype=np.int32))
+        lengths = np.array([len(c) for c in selected], dtype=np.int64)[inverse]
+        offsets = np.concatenate([[0], np.cumsum([len(c) for c in selected])])
+        flat = np.concatenate(selected) if selected else np.empty(0, dtype=np.int32)
+        # 回答ごとに、その組み合わせの選択肢をflatから取り出す
+        rows = np.repeat(users, lengths).astype(np.int32)
+        ends = np.cumsum(lengths)
+        within = np.arange(len(rows)) - np.repeat(ends - lengths, lengths)
+        cols = flat[np.repeat(offsets[inverse], lengths) + within]
+    return {"kind": "multiselect", "rows": rows, "cols": cols, "categories": categories}
+
+
+def _numeric_column(n, users, texts):
+    values = np.full(n, np.nan)
+    numbers = pd.to_numeric(pd.Series(texts, dtype=object), errors="coerce")
+    values[users] = numbers.to_numpy(dtype=float)
+    return {"kind": "numeric", "values": values}
+
+
+def _text_column(n, users, texts):
+    values = np.full(n, None, dtype=object)
+    values[users] = texts
+    return {"kind": "text", "values": values}
+
+
+# アンケートの回答者 × 設問の行列を作る
+async def build_response_matrix(session, survey_id):
+    definition = await models.get_streamlit_survey_format_json(session, survey_id)
+    questions = definition["questions"]
+
+    usernames = []
+    pages = []
+    orders = []
+    texts = []
+    result = await models.stream_survey_answers(session, survey_id, with_status=False)
+    async for partition in result.partitions():
+        names, page_numbers, order_numbers, answer_texts = zip(*partition)
+        usernames.extend(names)
+        pages.extend(page_numbers)
+        orders.extend(order_numbers)
+        texts.extend(answer_texts)
+
+    usernames = np.array(usernames, dtype=object)
+    pages = np.array(pages, dtype=np.int64)
+    orders = np.array(orders, dtype=np.int64)
+    texts = np.array(texts, dtype=object)
+    # 回答はユーザー名順に届くので、ユーザー名が変わる所で回答者の番号を進める
+    first = np.ones(len(usernames), dtype=bool)
+    first[1:] = usernames[1:] != usernames[:-1]
+    respondents = usernames[first]
+    user_ids = np.cumsum(first, dtype=np.int64) - 1
+    # (page, order) から設問の番号を引く表
+    width = int(orders.max(initial=0)) + 1
+    lookup = np.full((int(pages.max(initial=0)) + 1) * width, -1, dtype=np.int64)
+    for i, q in enumerate(questions.values()):
+        order_number = int(q["widget_key"].split("_")[1])
+        if q["page_number"] * width + order_number < len(lookup):
+            lookup[q["page_number"] * width + order_number] = i
+    key_ids = lookup[pages * width + orders] if len(pages) else pages
+    # 定義にない設問・値のない回答は使わない
+    used = (key_ids >= 0) & pd.notna(texts)
+    user_ids, key_ids, texts = user_ids[used], key_ids[used], texts[used]
+
+    n = len(respondents)
+    # 設問ごとの回答の範囲（key_idsで並べ替えて区切る）
+    order = np.argsort(key_ids, kind="stable")
+    bounds = np.searchsorted(key_ids[order], np.arange(len(questions) + 1))
+
+    columns = {}
+    for i, (key, q) in enumerate(questions.items()):
+        rows = order[bounds[i] : bounds[i + 1]]
+        users = user_ids[rows]
+        values = texts[rows]
+        if q["type"] in models.CHOICE_QUESTION_TYPES:
+            columns[key] = _categorical_column(n, users, values, q.get("options"))
+        elif q["type"] == "multiselect":
+            columns[key] = _multiselect_column(n, users, values, q.get("options"))
+        elif q["type"] in NUMERIC_QUESTION_TYPES:
+            columns[key] = _numeric_column(n, users, values)
+        else:
+            columns[key] = _text_column(n, users, values)
+    return ResponseMatrix(survey_id, respondents, questions, columns)
+
+
+# 回答者 × 設問の行列のキャッシュ（配列は大きいのでコピーせずに共有する。書き換えないこと）
+response_matrix_cache = SurveyDefinitionCache(max_size=8, copy_values=False)
+
+
+async def _load_response_stamp(survey_id):
+    async with AsyncSessionLocal() as session:
+        return await models.get_response_stamp(session, survey_id)
+
+
+# 行列と、読み込む前の回答ヘッダーのスタンプ（読み込み中に回答が変わっても次回作り直される）
+async def _load_response_matrix(survey_id):
+    async with AsyncSessionLocal() as session:
+        stamp = await models.get_response_stamp(session, survey_id)
+        return stamp, await build_response_matrix(session, survey_id)
+
+
+def _load_with_version(survey_id):
+    definition_version = survey_definition_cache.version(survey_id)
+    stamp, matrix = run(_load_response_matrix(survey_id))
+    matrix.definition_version = definition_version
+    matrix.response_stamp = stamp
+    return matrix
+
+
+# キャッシュ済みの行列を返す。アンケートの定義か回答ヘッダーのスタンプが変わっていれば作り直す
+# スタンプは毎回DBから読むので、再回答の一時保存や他のプロセスからの書き込みも反映される
+def get_response_matrix(survey_id):
+    stamp = run(_load_response_stamp(survey_id))
+    matrix = response_matrix_cache.get(survey_id, _load_with_version)
+    if (
+        matrix.definition_version != survey_definition_cache.version(survey_id)
+        or matrix.response_stamp != stamp
+    ):
+        response_matrix_cache.invalidate(survey_id)
+        matrix = response_matrix_cache.get(survey_id, _load_with_version)
+    return matrix
@@ -0,0 +1,358 @@
+from database.export import FIXED_COLUMNS
+from database.models import (
+    ANSWERS_TALLY_INSERT_TRIGGER,
+    QUESTION_TALLY_TRIGGERS,
+    Answer,
+    Question,
+    Response,
+    Survey,
+    SurveyStatus,
+    answer_to_text,
+    question_tally_insert_statement,
+)
+from sqlalchemy import func, insert, select
+import csv
+import datetime
+import functools
+import io
+import json
+import pathlib
+import tarfile
+import zipfile
+
+# アンケート定義（streamlit-survey形式のJSON）と過去の回答（CSV/JSONL）の一括取り込み
+#
+# 取り込むファイルはディレクトリかアーカイブ（zip・tar）にまとめる。
+#   <名前>.json           アンケート定義（1ファイルに1アンケート）
+#                         {"title", "description", "created_at", "end_date", "questions": [...]}
+#                         titleを省略した場合はファイル名。設問は作成・編集画面のJSONと同じ形式
+#   <名前>.csv / .jsonl   そのアンケートの回答（任意）。回答者1人が1行で、列はエクスポートと同じ
+#                         username, status（"draft"なら一時保存）, submitted_at, Q{page}_{order}...
+# 先にすべてのファイルを検証し、エラーがなければchunk_sizeアンケートずつ1トランザクションで、
+# executemanyでまとめて書き込む。IDは書き込みロック（BEGIN IMMEDIATE）を取ってから採番する。
+# 回答者1人ごとに回答ヘッダー（responses）を1行作り、回答はそのresponse_idを参照する。
+# 回答1行ごとに集計テーブルを更新するトリガーは同じトランザクション内で外しておき、
+# 取り込んだ設問の集計を最後に1回のINSERT ... SELECTで作ってからトリガーを戻す。
+
+CHUNK_SIZE = 200
+ANSWER_BATCH_SIZE = 5000
+MAX_ERRORS = 100
+# 選択肢（options）が必要な設問の形式
+CHOICE_TYPES = {"radio", "select", "multiselect", "select_slider"}
+# 回答は行数が多いので、SQLAlchemyのパラメーター変換を通さずにexecutemanyする
+RESPONSE_INSERT_SQL = (
+    "INSERT INTO responses"
+    " (response_id, survey_id, username, status, started_at, submitted_at, revision)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+ANSWER_INSERT_SQL = (
+    "INSERT INTO answers"
+    " (username, question_id, response_id, answer_text, submitted_at, is_draft)"
+    " VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+# 取り込むファイル（名前 → バイナリで開く関数）を返す
+# sourceはディレクトリ・アーカイブのパス、またはアーカイブのファイルオブジェクト
+def import_files(source):
+    if isinstance(source, (str, pathlib.Path)) and pathlib.Path(source).is_dir():
+        root = pathlib.Path(source)
+        return {
+            p.relative_to(root).as_posix(): functools.partial(p.open, "rb")
+            for p in sorted(root.rglob("*"))
+            if p.is_file()
+        }
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        return {
+            info.filename: functools.partial(archive.open, info)
+            for info in archive.infolist()
+            if not info.is_dir()
+        }
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        archive = (
+            tarfile.open(fileobj=source)
+            if hasattr(source, "read")
+            else tarfile.open(source)
+        )
+    except tarfile.TarError:
+        raise ValueError("ディレクトリ・zip・tarのいずれかを指定してください")
+    return {
+        member.name: functools.partial(archive.extractfile, member)
+        for member in archive.getmembers()
+        if member.isfile()
+    }
+
+
+# 日時の文字列（ISO形式）をdatetimeにする。空ならNone
+def _parse_datetime(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+
+# アンケート定義のJSONを検証し、取り込む内容（questionsは書き込む行）を返す
+def _parse_definition(name, data):
+    definition = json.loads(data.decode("utf-8-sig"))
+    if not isinstance(definition, dict) or not isinstance(
+        definition.get("questions"), list
+    ):
+        raise ValueError('"questions"（設問のリスト）がありません')
+    questions = []
+    for idx, q in enumerate(definition["questions"]):
+        if not isinstance(q, dict):
+            raise ValueError(f"{idx + 1}問目: 設問がオブジェクトではありません")
+        qtype = q.get("type", "text")
+        options = q.get("options")
+        if options is not None and not isinstance(options, list):
+            raise ValueError(f"{idx + 1}問目: optionsはリストで指定してください")
+        if qtype in CHOICE_TYPES and not options:
+            raise ValueError(f"{idx + 1}問目: {qtype}にはoptionsが必要です")
+        if qtype == "slider" and (
+            not options
+            or len(options) < 2
+            or not all(isinstance(v, (int, float)) for v in options)
+        ):
+            raise ValueError(f"{idx + 1}問目: sliderのoptionsは[最小, 最大]の数値です")
+        page = q.get("page", 1)
+        if not isinstance(page, int) or page < 1:
+            raise ValueError(f"{idx + 1}問目: pageは1以上の整数で指定してください")
+        questions.append(
+            {
+                "question_text": q.get("label", ""),
+                "question_type": qtype,
+                "options": json.dumps(options, ensure_ascii=False) if options else None,
+                "order_number": idx + 1,
+                "page_number": page,
+            }
+        )
+    return {
+        "name": name,
+        "title": definition.get("title") or pathlib.PurePosixPath(name).stem,
+        "description": definition.get("description"),
+        "created_at": _parse_datetime(definition.get("created_at")),
+        "end_date": _parse_datetime(definition.get("end_date")),
+        "questions": questions,
+        "responses": None,
+    }
+
+
+# 回答ファイルの行（行番号, {列名: 値}）を返す
+def _iter_responses(name, open_file):
+    with open_file() as f:
+        text = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        if name.endswith(".csv"):
+            reader = csv.DictReader(text)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_num, line in enumerate(text, start=1):
+                if line.strip():
+                    yield line_num, json.loads(line)
+
+
+# 回答者1人分の行を、書き込む回答ヘッダーの行とanswersの行
+# （RESPONSE_INSERT_SQL・ANSWER_INSERT_SQLのパラメーター）にする。回答がなければ(None, [])
+# 日時はDateTime型と同じ形式の文字列にしておく（to_db_datetimeは型のbind_processor）
+def _response_rows(row, survey_id, response_id, question_ids, to_db_datetime):
+    is_draft = row.get("status") == "draft"
+    submitted_at = to_db_datetime(_parse_datetime(row.get("submitted_at")))
+    answers = [
+        (
+            row["username"],
+            question_ids[key],
+            response_id,
+            answer_to_text(value),
+            submitted_at,
+            is_draft,
+        )
+        for key, value in row.items()
+        if key in question_ids and value not in (None, "")
+    ]
+    if not answers:
+        return None, []
+    status = SurveyStatus.DRAFT if is_draft else SurveyStatus.SUBMITTED
+    response = (
+        response_id,
+        survey_id,
+        row["username"],
+        status.value,
+        submitted_at,
+        submitted_at,
+        0 if is_draft else 1,
+    )
+    return response, answers
+
+
+# 回答ヘッダーと回答を書き込む（回答が参照するヘッダーを先に書き込む）
+def _insert_responses(conn, response_rows, answer_rows):
+    conn.exec_driver_sql(RESPONSE_INSERT_SQL, response_rows)
+    conn.exec_driver_sql(ANSWER_INSERT_SQL, answer_rows)
+
+
+# 回答ファイルを検証する。エラーをerrorsに追加し、回答者数を返す
+def _validate_responses(name, open_file, keys, errors):
+    usernames = set()
+    for line_num, row in _iter_responses(name, open_file):
+        if not isinstance(row, dict):
+            errors.append(f"{name}:{line_num}: 回答がオブジェクトではありません")
+        elif not row.get("username"):
+            errors.append(f"{name}:{line_num}: usernameがありません")
+        elif row["username"] in usernames:
+            errors.append(f"{name}:{line_num}: usernameが重複しています: {row['username']}")
+        else:
+            usernames.add(row["username"])
+            # CSVでヘッダーより列が多い行は、余分な値がキーNoneにまとめられる
+            if None in row:
+                errors.append(f"{name}:{line_num}: ヘッダーより列が多い行です")
+            unknown = set(row) - keys - set(FIXED_COLUMNS) - {None}
+            if unknown:
+                errors.append(f"{name}:{line_num}: 定義にない設問です: {sorted(unknown)}")
+            try:
+                _parse_datetime(row.get("submitted_at"))
+            except ValueError:
+                errors.append(f"{name}:{line_num}: submitted_atが日時ではありません")
+        if len(errors) >= MAX_ERRORS:
+            break
+    return len(usernames)
+
+
+# 取り込むファイルを検証し、(取り込むアンケートのリスト, エラーのリスト)を返す
+# アンケートごとのrespondentsは回答ファイルの回答者数
+def validate_import(files):
+    surveys = {}
+    responses = {}
+    errors = []
+    for name, open_file in files.items():
+        path = pathlib.PurePosixPath(name)
+        # macOSのアーカイブに含まれる管理用ファイルなどは無視する
+        if any(part.startswith((".", "__MACOSX")) for part in path.parts):
+            continue
+        stem = str(path.with_suffix(""))
+        if path.suffix == ".json":
+            try:
+                with open_file() as f:
+                    surveys[stem] = _parse_definition(name, f.read())
+            except (ValueError, UnicodeDecodeError) as e:
+                errors.append(f"{name}: {e}")
+        elif path.suffix in (".csv", ".jsonl"):
+            if stem in responses:
+                errors.append(f"{name}: 同じアンケートの回答ファイルが複数あります")
+            responses[stem] = (name, open_file)
+
+    for stem, (name, open_file) in responses.items():
+        if stem not in surveys:
+            if not any(e.startswith(f"{stem}.json:") for e in errors):
+                errors.append(f"{name}: 対応するアンケート定義（{stem}.json）がありません")
+            continue
+        survey = surveys[stem]
+        keys = {f"Q{q['page_number']}_{q['order_number']}" for q in survey["questions"]}
+        try:
+            survey["respondents"] = _validate_responses(name, open_file, keys, errors)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            errors.append(f"{name}: {e}")
+        survey["responses"] = (name, open_file)
+        if len(errors) >= MAX_ERRORS:
+            break
+    return list(surveys.values()), errors[:MAX_ERRORS]
+
+
+# 検証済みのアンケートと回答を書き込む（connは同期のConnection）
+# chunk_sizeアンケートずつ1トランザクションで書き込み、
+# 件数（surveys, questions, responses, answers）を返す
+def load_surveys(
+    conn, surveys, chunk_size=CHUNK_SIZE, batch_size=ANSWER_BATCH_SIZE, now=None
+):
+    now = now or datetime.datetime.now()
+    to_db_datetime = Answer.submitted_at.type.dialect_impl(conn.dialect).bind_processor(
+        conn.dialect
+    )
+    counts = {"surveys": 0, "questions": 0, "responses": 0, "answers": 0}
+    if conn.in_transaction():
+        conn.commit()
+    for start in range(0, len(surveys), chunk_size):
+        chunk = surveys[start : start + chunk_size]
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            survey_id = conn.execute(select(func.max(Survey.survey_id))).scalar() or 0
+            question_id = (
+                conn.execute(select(func.max(Question.question_id))).scalar() or 0
+            )
+            response_id = (
+                conn.execute(select(func.max(Response.response_id))).scalar() or 0
+            )
+            survey_rows = []
+            question_rows = []
+            for survey in chunk:
+                survey_id += 1
+                survey_rows.append(
+                    {
+                        "survey_id": survey_id,
+                        "title": survey["title"],
+                        "description": survey["description"],
+                        "created_at": survey["created_at"] or now,
+                        "end_date": survey["end_date"],
+                    }
+                )
+                survey["survey_id"] = survey_id
+                survey["question_ids"] = {}
+                for q in survey["questions"]:
+                    question_id += 1
+                    question_rows.append(
+                        {**q, "question_id": question_id, "survey_id": survey_id}
+                    )
+                    key = f"Q{q['page_number']}_{q['order_number']}"
+                    survey["question_ids"][key] = question_id
+            conn.execute(insert(Survey), survey_rows)
+            if question_rows:
+                conn.execute(insert(Question), question_rows)
+
+            conn.exec_driver_sql(f"DROP TRIGGER {ANSWERS_TALLY_INSERT_TRIGGER}")
+            response_rows = []
+            answer_rows = []
+            for survey in chunk:
+                if survey["responses"] is None:
+                    continue
+                name, open_file = survey["responses"]
+                for _, row in _iter_responses(name, open_file):
+                    response, answers = _response_rows(
+                        row,
+                        survey["survey_id"],
+                        response_id + 1,
+                        survey["question_ids"],
+                        to_db_datetime,
+                    )
+                    if response is None:
+                        continue
+                    response_id += 1
+                    response_rows.append(response)
+                    answer_rows.extend(answers)
+                    if len(answer_rows) >= batch_size:
+                        _insert_responses(conn, response_rows, answer_rows)
+                        counts["responses"] += len(response_rows)
+                        counts["answers"] += len(answer_rows)
+                        response_rows = []
+                        answer_rows = []
+            if answer_rows:
+                _insert_responses(conn, response_rows, answer_rows)
+                counts["responses"] += len(response_rows)
+                counts["answers"] += len(answer_rows)
+            if question_rows:
+                conn.execute(
+                    question_tally_insert_statement(
+                        question_rows[0]["question_id"], question_id
+                    )
+                )
+            # QUESTION_TALLY_TRIGGERS[0]が回答追加時のトリガー
+            conn.exec_driver_sql(QUESTION_TALLY_TRIGGERS[0])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        counts["surveys"] += len(survey_rows)
+        counts["questions"] += len(question_rows)
+    return counts
@@ -0,0 +1,205 @@
+from image_store import ImageStore
+import models
+from sqlalchemy import create_engine
+import argparse
+import os
+import pathlib
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+# 最初のリリースのスキーマ（questions.imageあり、responses・集計テーブルなし）のDBに
+# init_db.py を実行し、最後まで移行できることと移行後のデータを確認する
+# 新しく作ったDBへの実行と、2回目の実行（移行済みのDB）も確認する。失敗があれば終了コード1で終了する
+#
+# 使い方:
+#   python app/database/check_init_db.py [-v]
+
+INIT_DB = pathlib.Path(__file__).resolve().parent / "init_db.py"
+
+# 最初のリリースのmodels.pyでcreate_allした時のスキーマ
+BASELINE_SCHEMA = [
+    """
+    CREATE TABLE surveys (
+        survey_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        created_at DATETIME,
+        end_date DATETIME,
+        PRIMARY KEY (survey_id)
+    )
+    """,
+    """
+    CREATE TABLE questions (
+        question_id INTEGER NOT NULL,
+        survey_id INTEGER NOT NULL,
+        question_text TEXT NOT NULL,
+        question_type TEXT NOT NULL,
+        options TEXT,
+        order_number INTEGER,
+        page_number INTEGER,
+        image BLOB,
+        PRIMARY KEY (question_id),
+        FOREIGN KEY(survey_id) REFERENCES surveys (survey_id)
+    )
+    """,
+    """
+    CREATE TABLE answers (
+        answer_id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        question_id INTEGER NOT NULL,
+        answer_text TEXT,
+        submitted_at DATETIME,
+        is_draft BOOLEAN NOT NULL,
+        PRIMARY KEY (answer_id),
+        FOREIGN KEY(question_id) REFERENCES questions (question_id)
+    )
+    """,
+]
+IMAGE = b"\x89PNG\r\n\x1a\n check_init_db"
+# 移行後の回答ヘッダーの状態（mixedは一時保存と提出済みの回答が混ざったユーザー）
+EXPECTED_STATUS = {"submitted": "submitted", "draft": "draft", "mixed": "submitted"}
+
+
+# 最初のリリースのスキーマのDBを作り、確認用のデータを入れる
+def create_baseline(path):
+    conn = sqlite3.connect(path)
+    for ddl in BASELINE_SCHEMA:
+        conn.execute(ddl)
+    conn.execute(
+        "INSERT INTO surveys VALUES"
+        " (1, '確認用', '', '2025-04-01 09:00:00', '2099-12-31 23:59:00')"
+    )
+    conn.executemany(
+        "INSERT INTO questions VALUES (?, 1, ?, ?, ?, ?, 1, ?)",
+        [
+            (1, "radio", "radio", '["A", "B"]', 1, IMAGE),
+            (2, "multiselect", "multiselect", '["A", "B"]', 2, None),
+            (3, "slider", "slider", "[0, 10]", 3, None),
+        ],
+    )
+    answers = {
+        "submitted": [("A", 0), ('["A", "B"]', 0), ("5", 0)],
+        "draft": [("B", 1), ('["B"]', 1), (None, None)],
+        "mixed": [("A", 0), ('["A"]', 1), ("3", 0)],
+    }
+    for username, values in answers.items():
+        for question_id, (answer_text, is_draft) in enumerate(values, start=1):
+            if is_draft is not None:
+                conn.execute(
+                    "INSERT INTO answers (username, question_id, answer_text,"
+                    " submitted_at, is_draft) VALUES (?, ?, ?, '2025-04-02 09:00:00', ?)",
+                    (username, question_id, answer_text, is_draft),
+                )
+    conn.commit()
+    conn.close()
+
+
+# init_db.pyをtmpdirをカレントディレクトリにして実行する
+def run_init_db(tmpdir, verbose):
+    env = dict(os.environ, SURVEY_IMAGE_DIR=os.path.join(tmpdir, "images"))
+    result = subprocess.run(
+        [sys.executable, str(INIT_DB)], cwd=tmpdir, env=env, capture_output=True, text=True
+    )
+    if verbose or result.returncode:
+        print(result.stdout + result.stderr)
+    return result.returncode == 0
+
+
+# 移行後のスキーマ・データの確認。問題の一覧を返す
+def check_migrated(path, tmpdir):
+    problems = []
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    tables = {
+        name: {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+        for name in models.Base.metadata.tables
+    }
+    for name, table in models.Base.metadata.tables.items():
+        missing = {c.name for c in table.columns} - tables[name]
+        if missing:
+            problems.append(f"{name}に列がありません: {sorted(missing)}")
+    if "image" in tables["questions"]:
+        problems.append("questions.imageが削除されていません")
+    triggers = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+    }
+    if "trg_responses_status_update" not in triggers:
+        problems.append("回答ヘッダーの状態のトリガーがありません")
+
+    status = dict(conn.execute("SELECT username, status FROM responses"))
+    if status != EXPECTED_STATUS:
+        problems.append(f"回答ヘッダーの状態が違います: {status}")
+    if conn.execute("SELECT count(*) FROM answers WHERE response_id IS NULL").fetchone()[0]:
+        problems.append("response_idが設定されていない回答があります")
+    if conn.execute("SELECT count(*) FROM answers WHERE NOT is_draft").fetchone()[0] != 5:
+        problems.append("提出済みの回答の件数が変わっています")
+
+    image_hash = conn.execute(
+        "SELECT image_hash FROM questions WHERE question_id = 1"
+    ).fetchone()[0]
+    store = ImageStore(os.path.join(tmpdir, "images"))
+    if not image_hash or not store.exists(image_hash) or store.get(image_hash) != IMAGE:
+        problems.append("設問画像が画像ストアに移されていません")
+
+    # 集計テーブルが回答から作り直した結果と同じか
+    tallies = conn.execute("SELECT * FROM question_tallies ORDER BY 1, 2").fetchall()
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as sa_conn:
+        for stmt in models.question_tally_rebuild_statements():
+            sa_conn.execute(stmt)
+    engine.dispose()
+    if tallies != conn.execute("SELECT * FROM question_tallies ORDER BY 1, 2").fetchall():
+        problems.append("集計テーブルが回答と一致しません")
+
+    # 回答ヘッダーの状態を変えると回答のis_draftがそろう
+    conn.execute("UPDATE responses SET status = 'draft' WHERE username = 'submitted'")
+    if conn.execute(
+        "SELECT count(*) FROM answers WHERE username = 'submitted' AND NOT is_draft"
+    ).fetchone()[0]:
+        problems.append("回答ヘッダーの状態が回答のis_draftに反映されません")
+    conn.rollback()
+    conn.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="init_db.pyによる既存のDBの移行の確認")
+    parser.add_argument("-v", "--verbose", action="store_true", help="init_db.pyの出力を表示する")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "survey_app.db")
+        create_baseline(path)
+        for label in ("最初のリリースのDB", "移行済みのDB（2回目）"):
+            if not run_init_db(tmpdir, args.verbose):
+                print(f"NG {label}: init_db.pyが失敗しました")
+                return 1
+            for problem in check_migrated(path, tmpdir):
+                failed = True
+                print(f"NG {label}: {problem}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if not run_init_db(tmpdir, args.verbose):
+            print("NG 新しいDB: init_db.pyが失敗しました")
+            return 1
+        conn = sqlite3.connect(os.path.join(tmpdir, "survey_app.db"))
+        triggers = {
+            row[0]
+            for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        }
+        conn.close()
+        if "trg_responses_status_update" not in triggers:
+            failed = True
+            print("NG 新しいDB: 回答ヘッダーの状態のトリガーがありません")
+
+    if failed:
+        return 1
+    print("init_db.pyによる移行に問題はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
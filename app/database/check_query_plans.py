@@ -0,0 +1,231 @@
+import models
+from models import Base
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+import argparse
+import asyncio
+import datetime
+import inspect
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+# models.pyのクエリ関数をすべて実行し、発行されたSQLのEXPLAIN QUERY PLANを確認する
+# テーブルの全件走査（SCAN <table> でインデックスを使わないもの）があれば終了コード1で終了する
+#
+# 使い方:
+#   python app/database/check_query_plans.py [-v]
+
+NOW = datetime.datetime(2025, 6, 1, 9, 0)
+USERNAME = "user1"
+
+# 全件走査が仕様上避けられないクエリ関数（関数名: 理由）
+FULL_SCAN_ALLOWED = {
+    "get_survey_titles": "アンケート全件の一覧",
+}
+
+
+# 確認対象のクエリ関数と呼び出し方
+# models.pyにクエリ関数を追加したらここにも追加する
+def query_calls(survey_id):
+    return {
+        "get_open_surveys": lambda s: models.get_open_surveys(s, NOW),
+        "get_open_surveys_with_status": lambda s: models.get_open_surveys_with_status(
+            s, USERNAME, NOW
+        ),
+        "get_answered_survey_ids": lambda s: models.get_answered_survey_ids(
+            s, USERNAME
+        ),
+        "get_draft_survey_ids": lambda s: models.get_draft_survey_ids(s, USERNAME),
+        "get_streamlit_survey_format_json": lambda s: models.get_streamlit_survey_format_json(
+            s, survey_id
+        ),
+        "get_answers_for_survey_and_user": lambda s: models.get_answers_for_survey_and_user(
+            s, survey_id, USERNAME
+        ),
+        "get_answered_survey_history": lambda s: models.get_answered_survey_history(
+            s, USERNAME
+        ),
+        "get_survey_answer_detail": lambda s: models.get_survey_answer_detail(
+            s, survey_id, USERNAME
+        ),
+        "get_survey_page": lambda s: models.get_survey_page(s, "アンケート", NOW.year, 0),
+        "get_survey_count": lambda s: models.get_survey_count(s, "アンケート", NOW.year),
+        "search_surveys": lambda s: models.search_surveys(s, "在宅勤務 アンケート", NOW.year),
+        "get_survey_created_years": lambda s: models.get_survey_created_years(s),
+        "get_survey_response_summaries": lambda s: models.get_survey_response_summaries(
+            s, [survey_id, 0]
+        ),
+        "save_answers": lambda s: models.save_answers(
+            s, survey_id, USERNAME, {"Q1_1": "B", "Q1_2": ["A", "B"]}, False, NOW
+        ),
+        "rebuild_question_tallies": lambda s: models.rebuild_question_tallies(
+            s, survey_id
+        ),
+        "get_question_tallies": lambda s: models.get_question_tallies(s, survey_id),
+        "get_slider_stats": lambda s: models.get_slider_stats(s, survey_id),
+        "get_response_counts": lambda s: models.get_response_counts(s, survey_id),
+        "get_response_stamp": lambda s: models.get_response_stamp(s, survey_id),
+        "stream_survey_answers": lambda s: read_stream(
+            models.stream_survey_answers(s, survey_id, True)
+        ),
+        "get_survey_distributions": lambda s: models.get_survey_distributions(
+            s, survey_id
+        ),
+        "get_survey_titles": lambda s: models.get_survey_titles(s),
+        # 削除系は確認用のデータを消すので最後に実行する
+        "clone_survey": lambda s: models.clone_survey(s, survey_id, now=NOW),
+        "apply_survey_edit": lambda s: models.apply_survey_edit(
+            s, survey_id, "編集後", None, [{"label": "追加", "type": "text"}]
+        ),
+        "delete_questions": lambda s: models.delete_questions(s, [0]),
+        "delete_survey": lambda s: models.delete_survey(s, survey_id),
+    }
+
+
+# サーバー側カーソルの結果を読み切る
+async def read_stream(stream):
+    result = await stream
+    return await result.all()
+
+
+# 確認用のデータを投入する
+def seed(engine):
+    with Session(engine) as session:
+        survey = models.Survey(
+            title="確認用",
+            description="",
+            created_at=NOW,
+            end_date=NOW + datetime.timedelta(days=7),
+        )
+        session.add(survey)
+        session.flush()
+        response = models.Response(
+            survey_id=survey.survey_id,
+            username=USERNAME,
+            status=models.SurveyStatus.SUBMITTED.value,
+            started_at=NOW,
+            submitted_at=NOW,
+            revision=1,
+        )
+        questions = [
+            ("radio", json.dumps(["A", "B"]), "A"),
+            ("multiselect", json.dumps(["A", "B"]), json.dumps(["A"])),
+            ("slider", json.dumps([0, 10]), "5"),
+            ("text", None, "A"),
+        ]
+        for order, (qtype, options, answer) in enumerate(questions, start=1):
+            question = models.Question(
+                survey_id=survey.survey_id,
+                question_text=qtype,
+                question_type=qtype,
+                options=options,
+                order_number=order,
+                page_number=1,
+            )
+            session.add(question)
+            session.flush()
+            session.add(
+                models.Answer(
+                    username=USERNAME,
+                    question_id=question.question_id,
+                    response=response,
+                    answer_text=answer,
+                    submitted_at=NOW,
+                    is_draft=False,
+                )
+            )
+        session.commit()
+        return survey.survey_id
+
+
+# 全件走査している行を返す（json_eachなど仮想テーブルやCTE・サブクエリの結果の走査は対象外）
+def find_table_scans(plan_rows):
+    subqueries = {
+        m.group(1)
+        for row in plan_rows
+        if (m := re.match(r"(?:CO-ROUTINE|MATERIALIZE) (\w+)", row[-1]))
+    }
+    return [
+        row[-1]
+        for row in plan_rows
+        if (m := re.match(r"SCAN (\w+)", row[-1]))
+        and m.group(1) not in subqueries
+        and "USING" not in row[-1]
+        and "VIRTUAL TABLE" not in row[-1]
+    ]
+
+
+async def capture_statements(url, survey_id):
+    engine = create_async_engine(url)
+    AsyncSessionLocal = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        captured[-1][1].append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    for name, call in query_calls(survey_id).items():
+        captured.append((name, []))
+        async with AsyncSessionLocal() as session:
+            await call(session)
+    await engine.dispose()
+    return captured
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クエリプランの確認")
+    parser.add_argument("-v", "--verbose", action="store_true", help="プランを表示する")
+    args = parser.parse_args()
+
+    # 未登録のクエリ関数があればエラーにする
+    query_functions = {
+        name
+        for name, func in inspect.getmembers(models, inspect.iscoroutinefunction)
+        if not name.startswith("_")
+    }
+    missing = query_functions - set(query_calls(None))
+    if missing:
+        print(f"確認対象に登録されていないクエリ関数があります: {sorted(missing)}")
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "check.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        survey_id = seed(engine)
+        engine.dispose()
+        captured = asyncio.run(capture_statements(f"sqlite+aiosqlite:///{path}", survey_id))
+
+        conn = sqlite3.connect(path)
+        failed = False
+        for name, statements in captured:
+            for statement, parameters in statements:
+                if not re.match(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH)", statement, re.I):
+                    continue
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+                scans = find_table_scans(plan)
+                if scans and name not in FULL_SCAN_ALLOWED:
+                    failed = True
+                    print(f"NG {name}: {scans}")
+                    print("   " + " ".join(statement.split()))
+                elif args.verbose:
+                    print(f"OK {name}")
+                    for row in plan:
+                        print(f"   {row[-1]}")
+        conn.close()
+
+    if failed:
+        return 1
+    print("全件走査しているクエリはありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,21 @@
+from contextlib import asynccontextmanager
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from database.query_stats import register_query_stats
+from database.sqlite_profile import register_sqlite_profile
+import os
 
 DATABASE_URL = "sqlite+aiosqlite:///./survey_app.db"
 
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# SQLのログ出力は SURVEY_DB_ECHO=1 の場合だけ（通常は query_stats の計測を使う）
+engine = create_async_engine(
+    DATABASE_URL, echo=os.environ.get("SURVEY_DB_ECHO") == "1", future=True
+)
+# 接続ごとにPRAGMA（WALなど）を設定する
+register_sqlite_profile(engine.sync_engine)
+# SQLごとの実行時間・ページごとのクエリ数を計測する
+register_query_stats(engine.sync_engine)
 
 AsyncSessionLocal = sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False
@@ -14,3 +26,13 @@ AsyncSessionLocal = sessionmaker(
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+
+# 書き込み用の非同期セッション
+# 最初に書き込みロックを取るので、読み取り後の書き込みで他の書き込みとぶつかって
+# "database is locked" になることがない（ロック待ちはbusy_timeoutまで待つ）
+@asynccontextmanager
+async def write_session():
+    async with AsyncSessionLocal() as session:
+        await session.execute(text("BEGIN IMMEDIATE"))
+        yield session
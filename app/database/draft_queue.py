@@ -0,0 +1,163 @@
+from database import models
+from database.database import AsyncSessionLocal
+from database.runner import run
+from sqlalchemy.exc import OperationalError
+import atexit
+import datetime
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 一時保存（下書き）の書き込みを遅らせてまとめるキュー（write-behind）
+#
+# 同じユーザー・アンケートの一時保存はキューに最新の1件だけを残し、
+# バックグラウンドスレッドが interval 秒ごとに複数ユーザー分をまとめて1トランザクションで書き込む。
+# まとめた書き込みが失敗した場合は1件ずつ書き込み直し、書き込めない一時保存だけを特定する。
+#   DBのロックなど時間が経てば解消する失敗（OperationalError）: キューに戻して次回に再度書き込む
+#                                                              （より新しい一時保存があればそちらを優先）
+#   それ以外（アンケートが削除されて外部キー制約に違反するなど）: ログに出して破棄する
+# 提出や回答の読み込みの前には flush() でそのユーザーの一時保存を書き込んでおくこと。
+
+
+class DraftWriteQueue:
+    def __init__(self, interval=2.0, max_batch=200):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # 一時保存をキューに入れる（answersは{"Q{page}_{order}": 値}）
+    def put(self, survey_id, username, answers):
+        key = (int(survey_id), username)
+        with self._lock:
+            self.enqueued += 1
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (dict(answers), datetime.datetime.now())
+            self._start()
+
+    # キューの一時保存を書き込む。survey_id・usernameを指定した場合は該当分だけ書き込む
+    # 例外は送出しない。該当分をすべて書き込めた場合はTrue、キューに戻した・破棄した一時保存が
+    # あればFalseを返す
+    def flush(self, survey_id=None, username=None):
+        written_all = True
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    keys = [
+                        key
+                        for key in self._pending
+                        if (survey_id is None or key[0] == int(survey_id))
+                        and (username is None or key[1] == username)
+                    ][: self.max_batch]
+                    batch = {key: self._pending.pop(key) for key in keys}
+                if not batch:
+                    return written_all
+                try:
+                    run(self._write(batch))
+                except OperationalError:
+                    self._requeue(batch)
+                    return False
+                except Exception:
+                    # 書き込めない一時保存を特定するため1件ずつ書き込み直す
+                    for i, (key, item) in enumerate(batch.items()):
+                        try:
+                            run(self._write({key: item}))
+                        except OperationalError:
+                            self._requeue(dict(list(batch.items())[i:]))
+                            return False
+                        except Exception:
+                            logger.exception(
+                                "一時保存を書き込めないため破棄します: survey_id=%s, username=%s",
+                                *key,
+                            )
+                            written_all = False
+                            with self._lock:
+                                self.dropped += 1
+                        else:
+                            with self._lock:
+                                self.written += 1
+                                self.batches += 1
+                    continue
+                with self._lock:
+                    self.written += len(batch)
+                    self.batches += 1
+
+    # 書き込めなかった一時保存をキューに戻す（その間に入った新しい一時保存を優先する）
+    def _requeue(self, batch):
+        logger.warning(
+            "一時保存の書き込みに失敗しました（%d件、次回に再試行します）",
+            len(batch),
+            exc_info=True,
+        )
+        with self._lock:
+            self.failures += 1
+            for key, item in batch.items():
+                self._pending.setdefault(key, item)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "interval": self.interval,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "written": self.written,
+                "batches": self.batches,
+                "failures": self.failures,
+                "dropped": self.dropped,
+            }
+
+    # バックグラウンドのフラッシュを止め、残りの一時保存を書き込む
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+        self.flush()
+
+    async def _write(self, batch):
+        async with AsyncSessionLocal() as session:
+            for (survey_id, username), (answers, saved_at) in batch.items():
+                await models.save_answers(
+                    session, survey_id, username, answers, True, saved_at
+                )
+            await session.commit()
+
+    # フラッシュ用のスレッドを（未起動なら）起動する。self._lockを取得した状態で呼ぶ
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._loop, name="draft-flush", daemon=True
+            )
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+# サーバープロセス全体で共有するキュー
+draft_queue = DraftWriteQueue()
+
+
+# プロセス終了時に書き込まれていない一時保存を書き込む
+@atexit.register
+def _flush_on_exit():
+    if not draft_queue.flush():
+        logger.error("終了時に書き込めなかった一時保存があります")
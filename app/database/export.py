@@ -0,0 +1,124 @@
+from database import models
+import codecs
+import csv
+import io
+
+# アンケートの回答を横持ち（回答者1人が1行、設問ごとに Q{page}_{order} の列）で書き出す
+#
+# 回答は models.stream_survey_answers でサーバー側カーソルから chunk_size 行ずつ読み込み、
+# 回答者1人分がそろうたびに1行にして書き出すので、回答者数が増えてもメモリ使用量は変わらない。
+# Parquetの書き出しには pyarrow を使う
+
+CHUNK_SIZE = 5000
+# 書き出し先にまとめて書き込む単位（CSVは文字数、Parquetは行グループの行数）
+CSV_BUFFER_CHARS = 1024 * 1024
+PARQUET_ROW_GROUP = 10000
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+FIXED_COLUMNS = ["username", "status", "submitted_at"]
+# 集計画面からエクスポートできる回答者数の上限
+# 画面のダウンロードはファイル全体をサーバーのメモリに読み込んでブラウザに送るので、
+# これより多い場合は export_responses.py でファイルに書き出す
+UI_EXPORT_MAX_RESPONDENTS = 5000
+
+
+# 書き出す列（固定列のあとに設問を page, order の順に並べる）
+async def survey_export_columns(session, survey_id):
+    survey = await models.get_streamlit_survey_format_json(session, survey_id)
+    return FIXED_COLUMNS + list(survey["questions"])
+
+
+# 回答者ごとの行（列はsurvey_export_columnsの順）を返す
+# status, submitted_atは回答ヘッダー（responses）の回答状況と最終保存日時
+async def iter_response_rows(
+    session, survey_id, columns, include_drafts=False, chunk_size=CHUNK_SIZE
+):
+    index = {name: i for i, name in enumerate(columns)}
+    result = await models.stream_survey_answers(
+        session, survey_id, include_drafts, chunk_size
+    )
+    row = None
+    async for partition in result.partitions():
+        for username, page, order, answer_text, submitted_at, status in partition:
+            if row is None or row[0] != username:
+                if row is not None:
+                    yield row
+                row = [None] * len(columns)
+                row[0] = username
+                row[1] = status
+                row[2] = submitted_at
+            key = f"Q{page}_{order}"
+            if key in index:
+                row[index[key]] = answer_text
+    if row is not None:
+        yield row
+
+
+# CSV（UTF-8 BOM付き、Excelでそのまま開ける）でバイナリファイルoutに書き出す。回答者数を返す
+async def write_responses_csv(
+    session, survey_id, out, include_drafts=False, chunk_size=CHUNK_SIZE
+):
+    columns = await survey_export_columns(session, survey_id)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    out.write(codecs.BOM_UTF8)
+    count = 0
+    async for row in iter_response_rows(
+        session, survey_id, columns, include_drafts, chunk_size
+    ):
+        writer.writerow(row)
+        count += 1
+        if buf.tell() >= CSV_BUFFER_CHARS:
+            out.write(buf.getvalue().encode("utf-8"))
+            buf.seek(0)
+            buf.truncate()
+    out.write(buf.getvalue().encode("utf-8"))
+    return count
+
+
+# Parquetでバイナリファイルoutに書き出す。回答者数を返す
+# 回答は文字列（複数選択はJSON）のまま、submitted_atはタイムスタンプの列にする
+async def write_responses_parquet(
+    session, survey_id, out, include_drafts=False, chunk_size=CHUNK_SIZE
+):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = await survey_export_columns(session, survey_id)
+    schema = pa.schema(
+        [
+            pa.field(name, pa.timestamp("us") if name == "submitted_at" else pa.string())
+            for name in columns
+        ]
+    )
+    count = 0
+    rows = []
+    with pq.ParquetWriter(out, schema) as writer:
+        async for row in iter_response_rows(
+            session, survey_id, columns, include_drafts, chunk_size
+        ):
+            rows.append(row)
+            count += 1
+            if len(rows) >= PARQUET_ROW_GROUP:
+                writer.write_table(pa.Table.from_pylist(_as_dicts(columns, rows), schema))
+                rows = []
+        if rows or count == 0:
+            writer.write_table(pa.Table.from_pylist(_as_dicts(columns, rows), schema))
+    return count
+
+
+def _as_dicts(columns, rows):
+    return [dict(zip(columns, row)) for row in rows]
+
+
+# fmt（"csv" または "parquet"）でアンケートの回答を書き出す。回答者数を返す
+async def export_survey_responses(
+    session, survey_id, out, fmt="csv", include_drafts=False, chunk_size=CHUNK_SIZE
+):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未対応の形式です: {fmt}")
+    write = write_responses_csv if fmt == "csv" else write_responses_parquet
+    return await write(session, survey_id, out, include_drafts, chunk_size)
@@ -0,0 +1,56 @@
+import argparse
+import asyncio
+import pathlib
+import sys
+
+# アンケートの回答をファイルに書き出す（回答者1人が1行の横持ち形式）
+#
+# 使い方:
+#   python app/database/export_responses.py SURVEY_ID responses.csv
+#   python app/database/export_responses.py SURVEY_ID responses.parquet --include-drafts
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+
+async def export(survey_id, path, fmt, include_drafts, chunk_size):
+    from database.database import AsyncSessionLocal, engine
+    from database.export import export_survey_responses
+
+    # SQLのログ出力は大量になるので止める
+    engine.echo = False
+    try:
+        async with AsyncSessionLocal() as session:
+            with open(path, "wb") as out:
+                return await export_survey_responses(
+                    session, survey_id, out, fmt, include_drafts, chunk_size
+                )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    # スクリプトのディレクトリ（database.pyがあり、databaseパッケージと名前がぶつかる）の代わりにappを使う
+    sys.path[0] = str(APP_DIR)
+    from database.export import CHUNK_SIZE, EXPORT_FORMATS
+
+    parser = argparse.ArgumentParser(description="アンケート回答のエクスポート")
+    parser.add_argument("survey_id", type=int, help="アンケートID")
+    parser.add_argument("path", help="書き出すファイル")
+    parser.add_argument(
+        "--format",
+        choices=list(EXPORT_FORMATS),
+        help="書き出す形式（省略時はファイルの拡張子で判断）",
+    )
+    parser.add_argument(
+        "--include-drafts", action="store_true", help="一時保存の回答も書き出す"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE, help="一度に読み込む回答の行数"
+    )
+    args = parser.parse_args()
+
+    fmt = args.format or ("parquet" if args.path.endswith(".parquet") else "csv")
+    count = asyncio.run(
+        export(args.survey_id, args.path, fmt, args.include_drafts, args.chunk_size)
+    )
+    print(f"{count}人分の回答を書き出しました: {args.path}")
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from PIL import Image
+import hashlib
+import io
+import os
+import pathlib
+import tempfile
+import threading
+
+# 設問画像の保存先（内容のSHA-256をキーにしたファイル）
+#
+# questionsには画像のハッシュ（image_hash）だけを持ち、画像本体はディレクトリに保存する。
+# 同じ画像は1つのファイルになるので、アンケートを複製しても画像はコピーされない。
+# 保存時に横幅を縮小した画像も作っておき、表示時は必要な大きさの画像だけを読み込む。
+# 読み込んだ画像はプロセス内でmax_cache_bytesまでキャッシュする。
+#
+# 保存先は環境変数 SURVEY_IMAGE_DIR で変更できる（既定: ./images）
+
+VARIANT_WIDTHS = (320, 800)
+
+
+class ImageStore:
+    def __init__(self, root, max_cache_bytes=64 * 1024 * 1024):
+        self.root = pathlib.Path(root)
+        self.max_cache_bytes = max_cache_bytes
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    # 画像ファイルのパス（widthを指定すると縮小画像）
+    def path(self, image_hash, width=None):
+        name = image_hash if width is None else f"{image_hash}_w{width}"
+        return self.root / image_hash[:2] / name
+
+    def exists(self, image_hash):
+        return self.path(image_hash).exists()
+
+    # 画像を保存してハッシュを返す（保存済みの画像なら書き込まない）
+    # 元の画像は縮小画像の後に書き込むので、元の画像があれば縮小画像もそろっている
+    def put(self, data):
+        image_hash = hashlib.sha256(data).hexdigest()
+        if not self.exists(image_hash):
+            for width, variant in self._variants(data):
+                self._write(self.path(image_hash, width), variant)
+            self._write(self.path(image_hash), data)
+        return image_hash
+
+    # 画像を読み込む。max_widthを指定すると、その幅以下の縮小画像のうち最大のものを返す
+    def get(self, image_hash, max_width=None):
+        width = None
+        if max_width is not None:
+            widths = [w for w in VARIANT_WIDTHS if w <= max_width]
+            if widths and self.path(image_hash, widths[-1]).exists():
+                width = widths[-1]
+        key = (image_hash, width)
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        data = self.path(image_hash, width).read_bytes()
+        with self._lock:
+            self.misses += 1
+            if key not in self._cache and len(data) <= self.max_cache_bytes:
+                self._cache[key] = data
+                self._cache_bytes += len(data)
+                while self._cache_bytes > self.max_cache_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return data
+
+    # 保存されている画像のハッシュ
+    def hashes(self):
+        if not self.root.exists():
+            return set()
+        return {p.name for p in self.root.glob("*/*") if len(p.name) == 64}
+
+    # 画像（縮小画像も含む）を削除する
+    def remove(self, image_hash):
+        for path in self.path(image_hash).parent.glob(f"{image_hash}*"):
+            path.unlink()
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == image_hash]:
+                self._cache_bytes -= len(self._cache.pop(key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": self._cache_bytes,
+                "max_bytes": self.max_cache_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # 一時ファイルに書いてから置き換える（書き込み途中のファイルを読まないように）
+    def _write(self, path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    # 縮小画像（元の幅より小さいものだけ）を作る。画像として読めないデータなら作らない
+    def _variants(self, data):
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception:
+            return []
+        variants = []
+        for width in VARIANT_WIDTHS:
+            if image.width <= width:
+                continue
+            resized = image.copy()
+            resized.thumbnail((width, image.height * width // image.width + 1))
+            buf = io.BytesIO()
+            if resized.mode in ("RGBA", "LA", "P"):
+                resized.save(buf, format="PNG", optimize=True)
+            else:
+                resized.convert("RGB").save(buf, format="JPEG", quality=85)
+            variants.append((width, buf.getvalue()))
+        return variants
+
+
+# サーバープロセス全体で共有する画像ストア
+image_store = ImageStore(os.environ.get("SURVEY_IMAGE_DIR", "./images"))
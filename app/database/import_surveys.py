@@ -0,0 +1,48 @@
+from sqlalchemy import create_engine
+import argparse
+import pathlib
+import sys
+import time
+
+# アンケート定義と過去の回答をまとめて取り込む（形式は database/bulk_import.py を参照）
+#
+# 使い方:
+#   python app/database/import_surveys.py legacy_surveys/
+#   python app/database/import_surveys.py legacy_surveys.zip --dry-run
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent
+
+if __name__ == "__main__":
+    # スクリプトのディレクトリ（database.pyがあり、databaseパッケージと名前がぶつかる）の代わりにappを使う
+    sys.path[0] = str(APP_DIR)
+    from database.bulk_import import CHUNK_SIZE, import_files, load_surveys, validate_import
+    from database.sqlite_profile import register_sqlite_profile
+
+    parser = argparse.ArgumentParser(description="アンケートの一括取り込み")
+    parser.add_argument("source", help="取り込むディレクトリ・zip・tar")
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE, help="1トランザクションで書き込むアンケート数"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="検証だけ行い、書き込まない")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    surveys, errors = validate_import(import_files(args.source))
+    if errors:
+        for error in errors:
+            print(error, file=sys.stderr)
+        sys.exit(f"{len(errors)}件のエラーがあるため取り込みを中止しました")
+    respondents = sum(s.get("respondents", 0) for s in surveys)
+    print(f"検証OK: アンケート{len(surveys)}件、回答者{respondents}人")
+    if args.dry_run:
+        sys.exit(0)
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    register_sqlite_profile(engine)
+    with engine.connect() as conn:
+        counts = load_surveys(conn, surveys, args.chunk_size)
+    engine.dispose()
+    print(
+        f"取り込み完了: アンケート{counts['surveys']}件、設問{counts['questions']}件、"
+        f"回答{counts['answers']}件（{time.perf_counter() - start:.1f}秒）"
+    )
@@ -1,7 +1,26 @@
+from migrate_images import migrate_question_images
+from migrate_responses import migrate_responses
 from models import Base
 from sqlalchemy import create_engine
+from sqlite_profile import register_sqlite_profile
 
 if __name__ == "__main__":
     engine = create_engine("sqlite:///./survey_app.db")
+    # アプリと同じPRAGMAを設定する（journal_mode=WALはDBファイルに記録される）
+    register_sqlite_profile(engine)
     Base.metadata.create_all(bind=engine)
+    # 回答の一意インデックス（username, question_id）を作る前に、重複した回答は最新の1件だけ残す
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "DELETE FROM answers WHERE answer_id NOT IN "
+            "(SELECT max(answer_id) FROM answers GROUP BY username, question_id)"
+        )
+    # 既存のDBの設問画像（questions.image）を画像ストアに移す
+    migrate_question_images(engine)
+    # 既存のDBの回答から回答ヘッダー（responses）を作り、answers.response_idを設定する
+    migrate_responses(engine)
+    # 既存のテーブルには create_all でインデックスが追加されないので個別に作成する
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     print("DB初期化完了")
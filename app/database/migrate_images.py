@@ -0,0 +1,74 @@
+from image_store import image_store
+from sqlalchemy import create_engine
+from sqlite_profile import register_sqlite_profile
+import argparse
+
+
+# questions.image（BLOB）の画像を画像ストアに移し、questions.image_hashにハッシュを設定する
+# 移し終えたらimage列を削除する。移した画像の件数を返す
+def migrate_question_images(engine, store=image_store, batch_size=100):
+    with engine.begin() as conn:
+        columns = {
+            row[1] for row in conn.exec_driver_sql("PRAGMA table_info(questions)")
+        }
+        if "image_hash" not in columns:
+            conn.exec_driver_sql("ALTER TABLE questions ADD COLUMN image_hash TEXT")
+        if "image" not in columns:
+            return 0
+
+    moved = 0
+    last_id = 0
+    while True:
+        # 画像は大きいので少しずつ読み込む
+        with engine.begin() as conn:
+            rows = conn.exec_driver_sql(
+                "SELECT question_id, image FROM questions"
+                " WHERE image IS NOT NULL AND question_id > ?"
+                " ORDER BY question_id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            conn.exec_driver_sql(
+                "UPDATE questions SET image_hash = ?, image = NULL WHERE question_id = ?",
+                [(store.put(bytes(image)), question_id) for question_id, image in rows],
+            )
+        moved += len(rows)
+        last_id = rows[-1][0]
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE questions DROP COLUMN image")
+    return moved
+
+
+# どの設問からも参照されていない画像を削除する。削除した件数を返す
+def remove_unreferenced_images(engine, store=image_store):
+    with engine.connect() as conn:
+        referenced = {
+            row[0]
+            for row in conn.exec_driver_sql(
+                "SELECT DISTINCT image_hash FROM questions WHERE image_hash IS NOT NULL"
+            )
+        }
+    unreferenced = store.hashes() - referenced
+    for image_hash in unreferenced:
+        store.remove(image_hash)
+    return len(unreferenced)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="設問画像の画像ストアへの移行")
+    parser.add_argument(
+        "--gc", action="store_true", help="参照されていない画像を画像ストアから削除する"
+    )
+    parser.add_argument("--vacuum", action="store_true", help="移行後にDBを縮小する")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    register_sqlite_profile(engine)
+    print(f"画像ストアに移した画像: {migrate_question_images(engine)}件")
+    if args.gc:
+        print(f"削除した画像: {remove_unreferenced_images(engine)}件")
+    if args.vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
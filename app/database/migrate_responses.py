@@ -0,0 +1,78 @@
+from models import RESPONSE_STATUS_TRIGGER, Response
+from sqlalchemy import create_engine
+from sqlite_profile import register_sqlite_profile
+import argparse
+
+# 回答ヘッダー（responses）を作る前の回答（answers.response_idがNULL）から、
+# アンケート × ユーザーごとのヘッダーを作る
+#   status:       提出済みの回答が1つでもあれば"submitted"、すべて一時保存なら"draft"
+#                 （一時保存と提出済みが混ざったユーザーの回答は書き換えない。提出済みの回答は
+#                 そのまま集計に残り、一時保存の回答は次に保存するまで集計・分析から除かれる）
+#   started_at:   最も古い回答の保存日時、submitted_at: 最も新しい回答の保存日時
+#   revision:     提出済みの回答があれば1
+RESPONSE_BACKFILL_SQL = """
+    INSERT INTO responses (survey_id, username, status, started_at, submitted_at, revision)
+    SELECT q.survey_id, a.username,
+        CASE WHEN min(a.is_draft) THEN 'draft' ELSE 'submitted' END,
+        min(a.submitted_at), max(a.submitted_at), max(NOT a.is_draft)
+    FROM answers AS a JOIN questions AS q ON q.question_id = a.question_id
+    WHERE a.response_id IS NULL
+    GROUP BY q.survey_id, a.username
+    ON CONFLICT (survey_id, username) DO NOTHING
+"""
+# answer_idの範囲の回答にヘッダーのresponse_idを設定する
+ANSWER_RESPONSE_ID_SQL = """
+    UPDATE answers SET response_id = (
+        SELECT r.response_id
+        FROM questions AS q
+            JOIN responses AS r ON r.survey_id = q.survey_id
+        WHERE q.question_id = answers.question_id AND r.username = answers.username
+    )
+    WHERE answer_id > ? AND answer_id <= ? AND response_id IS NULL
+"""
+
+
+# 既存のDBにanswers.response_idを追加し、回答ヘッダーを作って回答と結びつける
+# 回答（is_draftを含む）は書き換えない。作成したヘッダーの件数を返す
+def migrate_responses(engine, batch_size=100000):
+    with engine.begin() as conn:
+        Response.__table__.create(conn, checkfirst=True)
+        columns = {
+            row[1] for row in conn.exec_driver_sql("PRAGMA table_info(answers)")
+        }
+        if "response_id" not in columns:
+            conn.exec_driver_sql(
+                "ALTER TABLE answers ADD COLUMN response_id INTEGER"
+                " REFERENCES responses (response_id) ON DELETE CASCADE"
+            )
+        # 状態の更新のトリガーはanswers.response_idを参照するので、列を追加してから作る
+        conn.exec_driver_sql(RESPONSE_STATUS_TRIGGER)
+        created = conn.exec_driver_sql(RESPONSE_BACKFILL_SQL).rowcount
+
+    # 回答は件数が多いので、answer_idの範囲ごとにトランザクションを分ける
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            end_id = conn.exec_driver_sql(
+                "SELECT max(answer_id) FROM ("
+                " SELECT answer_id FROM answers WHERE answer_id > ?"
+                " ORDER BY answer_id LIMIT ?)",
+                (last_id, batch_size),
+            ).scalar()
+            if end_id is None:
+                break
+            conn.exec_driver_sql(ANSWER_RESPONSE_ID_SQL, (last_id, end_id))
+        last_id = end_id
+    return created
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回答ヘッダー（responses）の作成")
+    parser.add_argument(
+        "--batch-size", type=int, default=100000, help="1トランザクションで更新する回答数"
+    )
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    register_sqlite_profile(engine)
+    print(f"作成した回答ヘッダー: {migrate_responses(engine, args.batch_size)}件")
@@ -5,10 +5,29 @@ from sqlalchemy import (
     DateTime,
     Boolean,
     ForeignKey,
-    BLOB,
+    Index,
+    Float,
+    and_,
+    or_,
+    cast,
+    column,
+    exists,
+    literal,
+    literal_column,
+    event,
+    delete,
+    func,
+    insert,
+    table,
+    update,
+    text,
+    union_all,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.future import select
+from enum import Enum
+import datetime
 import json
 
 Base = declarative_base()
@@ -25,32 +44,365 @@ class Survey(Base):
         "Question", back_populates="survey", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # 公開中アンケートの検索（end_date > now）用
+        Index("ix_surveys_end_date", "end_date"),
+        # 管理画面の作成年フィルタ・作成年一覧用
+        Index("ix_surveys_created_at", "created_at"),
+    )
+
 
 class Question(Base):
     __tablename__ = "questions"
     question_id = Column(Integer, primary_key=True, autoincrement=True)
-    survey_id = Column(Integer, ForeignKey("surveys.survey_id"), nullable=False)
+    survey_id = Column(
+        Integer, ForeignKey("surveys.survey_id", ondelete="CASCADE"), nullable=False
+    )
     question_text = Column(Text, nullable=False)
     question_type = Column(Text, nullable=False)
     options = Column(Text, nullable=True)  # JSON形式の選択肢
     order_number = Column(Integer, nullable=True)
     page_number = Column(Integer, nullable=True)
-    image = Column(BLOB, nullable=True)
+    image_hash = Column(Text, nullable=True)  # 設問画像（image_storeのハッシュ）
     survey = relationship("Survey", back_populates="questions")
     answers = relationship(
         "Answer", back_populates="question", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # アンケート単位の設問取得（表示順）用
+        Index(
+            "ix_questions_survey_id_page_order",
+            "survey_id",
+            "page_number",
+            "order_number",
+        ),
+    )
+
+
+# 回答ヘッダー（アンケート × ユーザーごとに1行）
+# 回答状況（一時保存中・提出済み）はこの行だけで決まる。answers.is_draftは集計テーブルの
+# トリガーのためにこの行のstatusと同じ値にそろえておく（statusの更新時にトリガーで更新する）
+# ただし移行前に一時保存と提出済みの回答が混ざっていたユーザーは、提出済みのヘッダーの下に
+# 一時保存の回答が残る（次に保存した時にそろう）。提出済みの回答だけを読む場合はis_draftも見る
+class Response(Base):
+    __tablename__ = "responses"
+    response_id = Column(Integer, primary_key=True, autoincrement=True)
+    survey_id = Column(
+        Integer, ForeignKey("surveys.survey_id", ondelete="CASCADE"), nullable=False
+    )
+    username = Column(Text, nullable=False)
+    status = Column(Text, nullable=False)  # SurveyStatusの"draft"または"submitted"
+    started_at = Column(DateTime, nullable=True)  # 最初に保存した日時
+    submitted_at = Column(DateTime, nullable=True)  # 最後に保存した日時（一時保存も含む）
+    revision = Column(Integer, nullable=False, default=0)  # 提出した回数
+    answers = relationship("Answer", back_populates="response")
+
+    __table_args__ = (
+        # 1アンケート1ユーザー1行（ヘッダー保存のUPSERTの競合判定、アンケート単位の回答者の
+        # ユーザー名順の読み込みに使う）
+        Index("ux_responses_survey_id_username", "survey_id", "username", unique=True),
+        # ユーザー単位の回答状況用
+        Index("ix_responses_username_status", "username", "status"),
+        # 管理画面のアンケート単位の回答者数・最終提出日時用（表を読まずにインデックスだけで集計する）
+        Index(
+            "ix_responses_survey_id_status_submitted_at",
+            "survey_id",
+            "status",
+            "submitted_at",
+        ),
+    )
+
 
 class Answer(Base):
     __tablename__ = "answers"
     answer_id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(Text, nullable=False)
-    question_id = Column(Integer, ForeignKey("questions.question_id"), nullable=False)
+    question_id = Column(
+        Integer, ForeignKey("questions.question_id", ondelete="CASCADE"), nullable=False
+    )
+    # 既存のDBではmigrate_responses.pyで設定するまでNULL
+    response_id = Column(
+        Integer, ForeignKey("responses.response_id", ondelete="CASCADE"), nullable=True
+    )
     answer_text = Column(Text, nullable=True)
     submitted_at = Column(DateTime, nullable=True)
     is_draft = Column(Boolean, nullable=False, default=True)
     question = relationship("Question", back_populates="answers")
+    response = relationship("Response", back_populates="answers")
+
+    __table_args__ = (
+        # 回答ヘッダー単位の回答取得・状態の更新用
+        Index("ix_answers_response_id_question_id", "response_id", "question_id"),
+        # 設問単位の集計（GROUP BY question_id）用
+        Index("ix_answers_question_id_is_draft", "question_id", "is_draft"),
+        # ユーザー単位の回答状況・回答取得用
+        Index(
+            "ix_answers_username_is_draft_question_id",
+            "username",
+            "is_draft",
+            "question_id",
+        ),
+        # 1ユーザー1設問1回答（回答保存のUPSERTの競合判定に使う）
+        Index("ux_answers_username_question_id", "username", "question_id", unique=True),
+    )
+
+
+# 設問・選択肢ごとの回答数（提出済み回答のみ）
+# answersのトリガーで回答の保存と同じトランザクション内で増減させる
+class QuestionTally(Base):
+    __tablename__ = "question_tallies"
+    question_id = Column(
+        Integer,
+        ForeignKey("questions.question_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    option_value = Column(Text, primary_key=True)
+    answer_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+
+# 集計で選択肢ごとの回答数を数える設問形式
+CHOICE_QUESTION_TYPES = ("radio", "select", "select_slider")
+# 回答そのものを1件として集計テーブルに積み上げる設問形式
+SINGLE_VALUE_QUESTION_TYPES = CHOICE_QUESTION_TYPES + ("slider",)
+
+_SINGLE_VALUE_TYPES_SQL = ", ".join(f"'{t}'" for t in SINGLE_VALUE_QUESTION_TYPES)
+
+
+# 回答1行（NEW / OLD）が集計テーブルに寄与する値
+# 単一選択・スライダーは回答そのもの、複数選択はJSON配列の要素ごとに1件
+def _tally_values_sql(row):
+    return f"""
+        SELECT j.value AS option_value
+        FROM questions AS q,
+            json_each(CASE WHEN json_valid({row}.answer_text) THEN {row}.answer_text ELSE '[]' END) AS j
+        WHERE q.question_id = {row}.question_id AND q.question_type = 'multiselect'
+        UNION ALL
+        SELECT {row}.answer_text
+        FROM questions AS q
+        WHERE q.question_id = {row}.question_id AND q.question_type IN ({_SINGLE_VALUE_TYPES_SQL})
+    """
+
+
+# 回答1行分を集計テーブルに加算（delta=1）または減算（delta=-1）する
+def _tally_apply_sql(row, delta):
+    sql = f"""
+        INSERT INTO question_tallies (question_id, option_value, answer_count)
+        SELECT {row}.question_id, t.option_value, {delta}
+        FROM ({_tally_values_sql(row)}) AS t
+        WHERE t.option_value IS NOT NULL AND NOT {row}.is_draft
+        ON CONFLICT (question_id, option_value)
+        DO UPDATE SET answer_count = answer_count + {delta};
+    """
+    if delta < 0:
+        sql += f"""
+        DELETE FROM question_tallies
+        WHERE question_id = {row}.question_id AND answer_count <= 0;
+        """
+    return sql
+
+
+# answersから集計テーブルを作り直すINSERT ... SELECT
+# conditionでアンケート・設問を絞り込む（q: questions, a: answers）
+def _tally_rebuild_sql(condition="1 = 1"):
+    return f"""
+        INSERT INTO question_tallies (question_id, option_value, answer_count)
+        SELECT a.question_id, j.value, count(*)
+        FROM answers AS a
+            JOIN questions AS q ON q.question_id = a.question_id,
+            json_each(CASE WHEN json_valid(a.answer_text) THEN a.answer_text ELSE '[]' END) AS j
+        WHERE q.question_type = 'multiselect' AND NOT a.is_draft
+            AND j.value IS NOT NULL AND {condition}
+        GROUP BY a.question_id, j.value
+        UNION ALL
+        SELECT a.question_id, a.answer_text, count(*)
+        FROM answers AS a
+            JOIN questions AS q ON q.question_id = a.question_id
+        WHERE q.question_type IN ({_SINGLE_VALUE_TYPES_SQL}) AND NOT a.is_draft
+            AND a.answer_text IS NOT NULL AND {condition}
+        GROUP BY a.question_id, a.answer_text
+    """
+
+
+# 回答追加時のトリガー（一括取り込みでは一時的に外し、取り込んだ設問の集計をまとめて作る）
+ANSWERS_TALLY_INSERT_TRIGGER = "trg_answers_tally_insert"
+
+QUESTION_TALLY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {ANSWERS_TALLY_INSERT_TRIGGER}
+    AFTER INSERT ON answers
+    BEGIN
+        {_tally_apply_sql("NEW", 1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_answers_tally_delete
+    AFTER DELETE ON answers
+    BEGIN
+        {_tally_apply_sql("OLD", -1)}
+    END
+    """,
+    # 再回答・一時保存からの提出・提出済み回答の一時保存はすべてUPDATEになる
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_answers_tally_update
+    AFTER UPDATE OF question_id, answer_text, is_draft ON answers
+    BEGIN
+        {_tally_apply_sql("OLD", -1)}
+        {_tally_apply_sql("NEW", 1)}
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_questions_tally_delete
+    AFTER DELETE ON questions
+    BEGIN
+        DELETE FROM question_tallies WHERE question_id = OLD.question_id;
+    END
+    """,
+    # 設問形式が変わると集計方法も変わるので、その設問だけ作り直す
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_questions_tally_retype
+    AFTER UPDATE OF question_type ON questions
+    BEGIN
+        DELETE FROM question_tallies WHERE question_id = NEW.question_id;
+        {_tally_rebuild_sql("q.question_id = NEW.question_id")};
+    END
+    """,
+]
+
+
+# 集計テーブルの作り直しに使うSQL（survey_id指定時はそのアンケートだけ）
+def question_tally_rebuild_statements(survey_id=None):
+    if survey_id is None:
+        return [
+            text("DELETE FROM question_tallies"),
+            text(_tally_rebuild_sql()),
+        ]
+    return [
+        text(
+            """
+            DELETE FROM question_tallies WHERE question_id IN (
+                SELECT question_id FROM questions WHERE survey_id = :survey_id
+            )
+            """
+        ).bindparams(survey_id=survey_id),
+        text(_tally_rebuild_sql("q.survey_id = :survey_id")).bindparams(
+            survey_id=survey_id
+        ),
+    ]
+
+
+# question_idの範囲（新しく追加した、集計がまだない設問）の集計を回答から作るSQL
+def question_tally_insert_statement(first_question_id, last_question_id):
+    return text(
+        _tally_rebuild_sql("a.question_id BETWEEN :first_id AND :last_id")
+    ).bindparams(first_id=first_question_id, last_id=last_question_id)
+
+
+# 集計テーブル作成時にトリガーを作成し、既存の回答から初期値を作る
+@event.listens_for(QuestionTally.__table__, "after_create")
+def _create_question_tally_triggers(target, connection, **kw):
+    for trigger in QUESTION_TALLY_TRIGGERS:
+        connection.exec_driver_sql(trigger)
+    for stmt in question_tally_rebuild_statements():
+        connection.execute(stmt)
+
+
+# 回答ヘッダーの状態が変わったら、そのヘッダーの回答のis_draftもそろえる
+# （is_draftの更新で集計テーブルのトリガーが動き、提出済みの回答だけが集計に残る）
+RESPONSE_STATUS_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS trg_responses_status_update
+    AFTER UPDATE OF status ON responses
+    BEGIN
+        UPDATE answers SET is_draft = (NEW.status = 'draft')
+        WHERE response_id = NEW.response_id AND is_draft != (NEW.status = 'draft');
+    END
+"""
+
+
+# トリガーはanswers.response_idを参照するので、answersを作った時（responsesは外部キーの順で先に
+# 作られる）に作る。既存のanswersにresponse_idを追加するDBでは migrate_responses.py が列の追加後に作る
+# （列がないうちにトリガーがあると、ALTER TABLEでのスキーマの再確認がエラーになる）
+@event.listens_for(Answer.__table__, "after_create")
+def _create_response_status_trigger(target, connection, **kw):
+    connection.exec_driver_sql(RESPONSE_STATUS_TRIGGER)
+
+
+# アンケート検索用の全文検索インデックス（FTS5、日本語も部分一致で引けるようtrigramで分割）
+# surveys・questionsを参照する外部コンテンツテーブルで、本文はインデックスにだけ持つ
+# survey_fts: rowid = survey_id（title, description）
+# question_fts: rowid = question_id（question_text, survey_idは検索対象外）
+SEARCH_INDEX_TABLES = {
+    "survey_fts": """
+    CREATE VIRTUAL TABLE IF NOT EXISTS survey_fts USING fts5(
+        title, description,
+        content='surveys', content_rowid='survey_id', tokenize='trigram'
+    )
+    """,
+    "question_fts": """
+    CREATE VIRTUAL TABLE IF NOT EXISTS question_fts USING fts5(
+        question_text, survey_id UNINDEXED,
+        content='questions', content_rowid='question_id', tokenize='trigram'
+    )
+    """,
+}
+
+
+# 外部コンテンツテーブルの同期トリガー（削除は'delete'コマンドに削除前の値を渡す）
+def _search_index_triggers(fts, source, key, columns):
+    values = ", ".join(columns)
+    old = ", ".join(f"OLD.{c}" for c in columns)
+    new = ", ".join(f"NEW.{c}" for c in columns)
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {source}
+        BEGIN
+            INSERT INTO {fts} (rowid, {values}) VALUES (NEW.{key}, {new});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {source}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {values}) VALUES ('delete', OLD.{key}, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {values} ON {source}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {values}) VALUES ('delete', OLD.{key}, {old});
+            INSERT INTO {fts} (rowid, {values}) VALUES (NEW.{key}, {new});
+        END
+        """,
+    ]
+
+
+SEARCH_INDEX_TRIGGERS = _search_index_triggers(
+    "survey_fts", "surveys", "survey_id", ["title", "description"]
+) + _search_index_triggers(
+    "question_fts", "questions", "question_id", ["question_text", "survey_id"]
+)
+
+
+# create_all のたびに全文検索インデックスとトリガーを作成する（既存のDBにも追加される）
+# インデックスを新しく作った場合は既存のアンケート・設問から作り直す
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_index(target, connection, **kw):
+    for name, ddl in SEARCH_INDEX_TABLES.items():
+        created = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).first()
+        connection.exec_driver_sql(ddl)
+        if created is None:
+            connection.exec_driver_sql(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+    for trigger in SEARCH_INDEX_TRIGGERS:
+        connection.exec_driver_sql(trigger)
+
+
+survey_fts = table("survey_fts", column("rowid"), column("survey_fts"))
+question_fts = table(
+    "question_fts", column("rowid"), column("survey_id"), column("question_fts")
+)
 
 
 # 公開中アンケート一覧を取得するクエリ
@@ -60,30 +412,65 @@ async def get_open_surveys(session, now):
     return result.scalars().all()
 
 
-# 回答済みアンケートIDリスト（is_draft=False）
-async def get_answered_survey_ids(session, username):
-    from sqlalchemy import and_
+# ユーザーから見たアンケートの回答状況
+class SurveyStatus(Enum):
+    UNANSWERED = "unanswered"  # 未回答
+    DRAFT = "draft"  # 一時保存中
+    SUBMITTED = "submitted"  # 回答済み
+
 
+# 公開中アンケート一覧とユーザーの回答状況・最終回答日時を1クエリで取得する
+# 回答状況は回答ヘッダー（responses）の1行から読む（再回答の途中は一時保存中）
+# 並びは回答期限の近い順
+async def get_open_surveys_with_status(session, username, now):
     stmt = (
-        select(Question.survey_id)
-        .join(Answer, Question.question_id == Answer.question_id)
-        .where(and_(Answer.username == username, ~Answer.is_draft))
+        select(
+            Survey.survey_id,
+            Survey.title,
+            Survey.end_date,
+            func.coalesce(Response.status, SurveyStatus.UNANSWERED.value).label(
+                "status"
+            ),
+            Response.submitted_at.label("last_activity"),
+        )
+        .outerjoin(
+            Response,
+            and_(Response.survey_id == Survey.survey_id, Response.username == username),
+        )
+        .where(Survey.end_date > now)
+        .order_by(Survey.end_date, Survey.survey_id)
     )
     result = await session.execute(stmt)
-    return set(row[0] for row in result.fetchall())
+    return [
+        {
+            "survey_id": row.survey_id,
+            "title": row.title,
+            "end_date": row.end_date,
+            "status": SurveyStatus(row.status),
+            "last_activity": row.last_activity,
+        }
+        for row in result.fetchall()
+    ]
 
 
-# 一時保存中アンケートIDリスト（is_draft=True）
-async def get_draft_survey_ids(session, username):
-    from sqlalchemy import and_
+# 回答済みアンケートIDリスト（回答ヘッダーが提出済み）
+async def get_answered_survey_ids(session, username):
+    stmt = select(Response.survey_id).where(
+        Response.username == username,
+        Response.status == SurveyStatus.SUBMITTED.value,
+    )
+    result = await session.execute(stmt)
+    return set(result.scalars().all())
 
-    stmt = (
-        select(Question.survey_id)
-        .join(Answer, Question.question_id == Answer.question_id)
-        .where(and_(Answer.username == username, Answer.is_draft))
+
+# 一時保存中アンケートIDリスト（回答ヘッダーが一時保存中）
+async def get_draft_survey_ids(session, username):
+    stmt = select(Response.survey_id).where(
+        Response.username == username,
+        Response.status == SurveyStatus.DRAFT.value,
     )
     result = await session.execute(stmt)
-    return set(row[0] for row in result.fetchall())
+    return set(result.scalars().all())
 
 
 # streamlit-survey形式のアンケートデータ
@@ -106,6 +493,9 @@ async def get_streamlit_survey_format_json(session, survey_id):
             "type": q.question_type,
             "page_number": q.page_number,
         }
+        # 画像はハッシュだけを持ち、表示時にimage_storeから読み込む
+        if q.image_hash:
+            qdata["image"] = q.image_hash
         # 選択肢がある場合はoptionsを追加
         if q.options:
             try:
@@ -131,4 +521,626 @@ async def get_answers_for_survey_and_user(session, survey_id, username):
         .where(and_(Question.survey_id == survey_id, Answer.username == username))
     )
     result = await session.execute(stmt)
-    return result.fetchall()
\ No newline at end of file
+    return result.fetchall()
+
+
+
+# 回答をDBに保存する文字列に変換する（複数選択などはJSON）
+def answer_to_text(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+# 回答ヘッダーを作成・更新し、response_idを返す
+# 状態と最終保存日時を書き換え、提出の場合はrevisionを1増やす（started_atは最初の保存のまま）
+async def _save_response(session, survey_id, username, is_draft, now):
+    stmt = sqlite_insert(Response.__table__).values(
+        survey_id=survey_id,
+        username=username,
+        status=SurveyStatus.DRAFT.value if is_draft else SurveyStatus.SUBMITTED.value,
+        started_at=now,
+        submitted_at=now,
+        revision=0 if is_draft else 1,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Response.survey_id, Response.username],
+        set_={
+            "status": stmt.excluded.status,
+            "submitted_at": stmt.excluded.submitted_at,
+            "revision": Response.revision + stmt.excluded.revision,
+        },
+    ).returning(Response.response_id)
+    result = await session.execute(stmt)
+    return result.scalar_one()
+
+
+# アンケートの回答（{"Q{page}_{order}": 値}）を保存する
+# 回答ヘッダーのUPSERTのあと、回答を1つのINSERT ... ON CONFLICT DO UPDATEで保存する
+# （今回送られなかった設問の回答のis_draftは、ヘッダーのトリガーで状態にそろえられる）
+# 値がNoneの設問は保存しない。一時保存・提出のどちらもsubmitted_atに保存日時を記録する
+# コミットは呼び出し側で行う
+async def save_answers(session, survey_id, username, answers, is_draft, now=None):
+    rows = []
+    for widget_key, value in answers.items():
+        if value is None:
+            continue
+        page_number, order_number = widget_key[1:].split("_")
+        rows.append([int(page_number), int(order_number), answer_to_text(value)])
+    if not rows:
+        return 0
+
+    now = now or datetime.datetime.now()
+    response_id = await _save_response(session, survey_id, username, is_draft, now)
+    # 回答はJSON配列1つのパラメータで渡し、json_eachで行に展開して設問と突き合わせる
+    items = func.json_each(json.dumps(rows, ensure_ascii=False)).table_valued("value")
+    source = (
+        select(
+            literal(username),
+            Question.question_id,
+            literal(response_id, Integer),
+            func.json_extract(items.c.value, "$[2]"),
+            literal(now, DateTime),
+            literal(is_draft, Boolean),
+        )
+        .select_from(items)
+        .join(
+            Question,
+            and_(
+                Question.page_number == func.json_extract(items.c.value, "$[0]"),
+                Question.order_number == func.json_extract(items.c.value, "$[1]"),
+            ),
+        )
+        .where(Question.survey_id == survey_id)
+    )
+    stmt = sqlite_insert(Answer).from_select(
+        [
+            "username",
+            "question_id",
+            "response_id",
+            "answer_text",
+            "submitted_at",
+            "is_draft",
+        ],
+        source,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Answer.username, Answer.question_id],
+        set_={
+            "response_id": stmt.excluded.response_id,
+            "answer_text": stmt.excluded.answer_text,
+            "submitted_at": stmt.excluded.submitted_at,
+            "is_draft": stmt.excluded.is_draft,
+        },
+    )
+    result = await session.execute(stmt)
+    return result.rowcount
+
+
+# 回答済みアンケートの一覧（アンケートID・タイトル・最新の回答日時）を1クエリで取得
+async def get_answered_survey_history(session, username):
+    stmt = (
+        select(
+            Survey.survey_id,
+            Survey.title,
+            Response.submitted_at.label("answered_at"),
+        )
+        .join(Response, Response.survey_id == Survey.survey_id)
+        .where(
+            Response.username == username,
+            Response.status == SurveyStatus.SUBMITTED.value,
+        )
+        .order_by(Survey.survey_id)
+    )
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+
+# アンケートの設問（表示順）と指定ユーザーの回答を1クエリで取得
+# 回答のない設問はanswer_textがNoneになる
+async def get_survey_answer_detail(session, survey_id, username):
+    stmt = (
+        select(
+            Question.question_id,
+            Question.question_text,
+            Question.page_number,
+            Question.order_number,
+            Answer.answer_text,
+        )
+        .outerjoin(
+            Answer,
+            and_(
+                Answer.question_id == Question.question_id,
+                Answer.username == username,
+            ),
+        )
+        .where(Question.survey_id == survey_id)
+        .order_by(Question.page_number, Question.order_number)
+    )
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+# 設問を削除する（回答も削除する）
+# 外部キー制約（foreign_keys=ON）の下でも、ON DELETE CASCADEのない既存のDBで
+# 削除できるよう、子テーブルから順に削除する
+async def delete_questions(session, question_ids):
+    await session.execute(delete(Answer).where(Answer.question_id.in_(question_ids)))
+    await session.execute(delete(Question).where(Question.question_id.in_(question_ids)))
+
+
+# アンケートを設問・回答・回答ヘッダーごと削除する
+async def delete_survey(session, survey_id):
+    question_ids = (
+        select(Question.question_id)
+        .where(Question.survey_id == survey_id)
+        .scalar_subquery()
+    )
+    await delete_questions(session, question_ids)
+    await session.execute(delete(Response).where(Response.survey_id == survey_id))
+    await session.execute(delete(Survey).where(Survey.survey_id == survey_id))
+    await session.commit()
+
+
+# アンケートを設問ごと複製し、新しいアンケートIDを返す（元のアンケートがなければNone）
+# 複製はDB内のINSERT ... SELECTだけで行い、設問（画像のハッシュも含む）をPythonに読み込まない
+async def clone_survey(session, survey_id, title_suffix=" (複製)", now=None):
+    result = await session.execute(
+        insert(Survey)
+        .from_select(
+            ["title", "description", "created_at", "end_date"],
+            select(
+                Survey.title + title_suffix,
+                Survey.description,
+                literal(now or datetime.datetime.now(), DateTime),
+                Survey.end_date,
+            ).where(Survey.survey_id == survey_id),
+        )
+        .returning(Survey.survey_id)
+    )
+    new_survey_id = result.scalar_one_or_none()
+    if new_survey_id is None:
+        await session.rollback()
+        return None
+    columns = [
+        "question_text",
+        "question_type",
+        "options",
+        "order_number",
+        "page_number",
+        "image_hash",
+    ]
+    await session.execute(
+        insert(Question).from_select(
+            ["survey_id"] + columns,
+            select(
+                literal(new_survey_id, Integer),
+                *[getattr(Question, c) for c in columns],
+            )
+            .where(Question.survey_id == survey_id)
+            .order_by(Question.page_number, Question.order_number),
+        )
+    )
+    await session.commit()
+    return new_survey_id
+
+
+# 保存されているoptions（JSON文字列）を比較用に読み込む
+def _loads_options(options):
+    if not options:
+        return None
+    try:
+        return json.loads(options)
+    except Exception:
+        return options
+
+
+# 編集したアンケートを現在の内容と比較し、変わった所だけを更新する（1トランザクション）
+# questionsは編集画面のJSONの設問リストで、既存の設問は"id"（question_id）で対応づける
+# "id"のない設問は追加、リストにない既存の設問は回答ごと削除し、並び順はリストの順にする
+# 変更内容（updated_survey, inserted, updated, deleted）を返す
+# 読んでから書き込むので、write_session()のセッションで呼ぶこと
+async def apply_survey_edit(session, survey_id, title, description, questions):
+    survey = (
+        await session.execute(
+            select(Survey.title, Survey.description).where(Survey.survey_id == survey_id)
+        )
+    ).one_or_none()
+    if survey is None:
+        raise ValueError(f"アンケートが見つかりません: {survey_id}")
+    current = {
+        row.question_id: row
+        for row in await session.execute(
+            select(
+                Question.question_id,
+                Question.question_text,
+                Question.question_type,
+                Question.options,
+                Question.order_number,
+                Question.page_number,
+            ).where(Question.survey_id == survey_id)
+        )
+    }
+
+    report = {"updated_survey": False, "inserted": [], "updated": [], "deleted": []}
+    if (survey.title, survey.description) != (title, description):
+        await session.execute(
+            update(Survey)
+            .where(Survey.survey_id == survey_id)
+            .values(title=title, description=description)
+        )
+        report["updated_survey"] = True
+
+    new_rows = []
+    changed_rows = []
+    kept = set()
+    for idx, q in enumerate(questions):
+        values = {
+            "question_text": q.get("label", ""),
+            "question_type": q.get("type", "text"),
+            "options": q.get("options") or None,
+            "order_number": idx + 1,
+            "page_number": q.get("page", 1),
+        }
+        if q.get("id") is None:
+            new_rows.append(values)
+            continue
+        try:
+            question_id = int(q["id"])
+        except (TypeError, ValueError):
+            raise ValueError(f"設問IDが不正です: {q['id']}")
+        row = current.get(question_id)
+        if row is None or question_id in kept:
+            raise ValueError(f"設問IDが不正です: {question_id}")
+        kept.add(question_id)
+        changes = {
+            key: value
+            for key, value in values.items()
+            if (_loads_options(row.options) if key == "options" else getattr(row, key))
+            != value
+        }
+        if "options" in changes and changes["options"] is not None:
+            changes["options"] = json.dumps(changes["options"], ensure_ascii=False)
+        if changes:
+            changed_rows.append({"question_id": question_id, **changes})
+            report["updated"].append(question_id)
+
+    # 主キー指定の一括UPDATE（変更した列が同じ行はまとめて1回のexecutemanyになる）
+    if changed_rows:
+        await session.execute(update(Question), changed_rows)
+    deleted = sorted(set(current) - kept)
+    if deleted:
+        await delete_questions(session, deleted)
+        report["deleted"] = deleted
+    if new_rows:
+        for values in new_rows:
+            if values["options"] is not None:
+                values["options"] = json.dumps(values["options"], ensure_ascii=False)
+        result = await session.execute(
+            insert(Question).returning(
+                Question.question_id, sort_by_parameter_order=True
+            ),
+            [{"survey_id": survey_id, **values} for values in new_rows],
+        )
+        report["inserted"] = list(result.scalars().all())
+    await session.commit()
+    return report
+
+
+# 集計テーブルをanswersから作り直す
+async def rebuild_question_tallies(session, survey_id=None):
+    for stmt in question_tally_rebuild_statements(survey_id):
+        await session.execute(stmt)
+    await session.commit()
+
+
+# 選択式・複数選択・スライダー設問の選択肢（値）ごとの回答数
+async def get_question_tallies(session, survey_id):
+    stmt = (
+        select(
+            QuestionTally.question_id,
+            QuestionTally.option_value,
+            QuestionTally.answer_count,
+        )
+        .join(Question, QuestionTally.question_id == Question.question_id)
+        .where(Question.survey_id == survey_id)
+    )
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+
+# スライダー設問の最小値・最大値・平均値（集計テーブルの値ごとの件数から計算）
+async def get_slider_stats(session, survey_id):
+    value = cast(QuestionTally.option_value, Float)
+    stmt = (
+        select(
+            QuestionTally.question_id,
+            func.min(value),
+            func.max(value),
+            func.sum(value * QuestionTally.answer_count)
+            / func.sum(QuestionTally.answer_count),
+        )
+        .join(Question, QuestionTally.question_id == Question.question_id)
+        .where(Question.survey_id == survey_id, Question.question_type == "slider")
+        .group_by(QuestionTally.question_id)
+    )
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+
+# 設問ごとの回答者数（回答ヘッダーが提出済みの回答のみ）
+# 提出済みのヘッダーでも一時保存の回答（移行前のデータ）は数えない（集計テーブルと同じ）
+async def get_response_counts(session, survey_id):
+    stmt = (
+        select(Answer.question_id, func.count())
+        .select_from(Response)
+        .join(Answer, Answer.response_id == Response.response_id)
+        .where(
+            Response.survey_id == survey_id,
+            Response.status == SurveyStatus.SUBMITTED.value,
+            Answer.is_draft.is_(False),
+        )
+        .group_by(Answer.question_id)
+    )
+    result = await session.execute(stmt)
+    return dict(result.fetchall())
+
+
+# アンケートの回答ヘッダーのスタンプ（件数、最終保存日時、提出回数の合計）
+# 提出・再回答の一時保存のどちらでも最終保存日時が進むので、回答状況が変わったかどうかの判定に使う
+async def get_response_stamp(session, survey_id):
+    stmt = select(
+        func.count(), func.max(Response.submitted_at), func.sum(Response.revision)
+    ).where(Response.survey_id == survey_id)
+    result = await session.execute(stmt)
+    return tuple(result.one())
+
+
+# アンケートの回答をユーザー名順にサーバー側カーソルで返す（エクスポート用）
+# 戻り値のAsyncResultからchunk_size行ずつ読み込むので、回答数が多くてもメモリに全件を載せない
+# 回答ヘッダーを(survey_id, username)のインデックス順に読み、回答者ごとの回答を引くので
+# ORDER BYのための一時的なソートは不要。回答状況（statusで絞り込む）もヘッダーの値を使う
+# 提出済みのみの場合は、提出済みのヘッダーに残った一時保存の回答（移行前のデータ）も除く
+# with_status=Falseの場合はsubmitted_at, statusを返さない（日時の変換がないぶん速い）
+async def stream_survey_answers(
+    session, survey_id, include_drafts=False, chunk_size=5000, with_status=True
+):
+    columns = [
+        Response.username,
+        Question.page_number,
+        Question.order_number,
+        Answer.answer_text,
+    ]
+    if with_status:
+        columns += [Response.submitted_at, Response.status]
+    stmt = (
+        select(*columns)
+        .select_from(Response)
+        .join(Answer, Answer.response_id == Response.response_id)
+        .join(Question, Question.question_id == Answer.question_id)
+        .where(Response.survey_id == survey_id)
+        .order_by(Response.username)
+        .execution_options(yield_per=chunk_size)
+    )
+    if not include_drafts:
+        stmt = stmt.where(
+            Response.status == SurveyStatus.SUBMITTED.value, Answer.is_draft.is_(False)
+        )
+    # 行数が多いのでORMの結果処理を通さず、セッションの接続で直接実行する
+    connection = await session.connection()
+    return await connection.stream(stmt)
+
+
+# 数値として解釈できる値は数値順、それ以外はその後ろに文字列順で並べる
+def _numeric_sort_key(value):
+    try:
+        return (0, float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(value))
+
+
+# アンケートの設問ごとの回答分布
+# 回答数は集計テーブル（question_tallies）から読むので、answers全体は走査しない
+async def get_survey_distributions(session, survey_id):
+    result = await session.execute(
+        select(
+            Question.question_id,
+            Question.question_text,
+            Question.question_type,
+            Question.options,
+            Question.page_number,
+            Question.order_number,
+        )
+        .where(Question.survey_id == survey_id)
+        .order_by(Question.page_number, Question.order_number)
+    )
+    distributions = {}
+    for q in result.fetchall():
+        try:
+            options = json.loads(q.options) if q.options else []
+        except Exception:
+            options = []
+        distributions[q.question_id] = {
+            "question_id": q.question_id,
+            "widget_key": f"Q{q.page_number}_{q.order_number}",
+            "label": q.question_text,
+            "type": q.question_type,
+            "page_number": q.page_number,
+            "options": options,
+            "responses": 0,
+            # 回答のない選択肢も0件として並べておく
+            "counts": {str(o): 0 for o in options}
+            if q.question_type in CHOICE_QUESTION_TYPES + ("multiselect",)
+            else {},
+            "stats": None,
+        }
+
+    for question_id, count in (await get_response_counts(session, survey_id)).items():
+        if question_id in distributions:
+            distributions[question_id]["responses"] = count
+    for question_id, option, count in await get_question_tallies(session, survey_id):
+        if question_id in distributions:
+            distributions[question_id]["counts"][option] = count
+    for question_id, min_value, max_value, mean in await get_slider_stats(
+        session, survey_id
+    ):
+        if question_id in distributions:
+            d = distributions[question_id]
+            d["stats"] = {"min": min_value, "max": max_value, "mean": mean}
+            # スライダーは値の小さい順に並べる
+            d["counts"] = dict(
+                sorted(d["counts"].items(), key=lambda kv: _numeric_sort_key(kv[0]))
+            )
+    return list(distributions.values())
+
+
+# アンケートID・タイトルの一覧（新しい順）
+async def get_survey_titles(session):
+    stmt = select(Survey.survey_id, Survey.title).order_by(Survey.survey_id.desc())
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+
+# キーワードに一致するアンケートIDと関連度（小さいほど上位）のSELECT
+# アンケート名・説明・設問文を全文検索インデックスで検索する。空白区切りのキーワードはAND
+# trigramは3文字未満の語を検索できないので、その場合だけ部分一致で全件を調べる
+def _survey_keyword_matches(keyword):
+    terms = keyword.split()
+    if all(len(term) >= 3 for term in terms):
+        query = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        return (
+            union_all(
+                select(
+                    survey_fts.c.rowid.label("survey_id"),
+                    func.bm25(literal_column("survey_fts"), 10.0, 2.0).label("rank"),
+                ).where(survey_fts.c.survey_fts.match(query)),
+                select(
+                    question_fts.c.survey_id,
+                    func.bm25(literal_column("question_fts"), 1.0).label("rank"),
+                ).where(question_fts.c.question_fts.match(query)),
+            )
+            .subquery()
+            .select()
+        )
+    conditions = [
+        or_(
+            func.instr(Survey.title, term) > 0,
+            func.instr(Survey.description, term) > 0,
+            exists().where(
+                Question.survey_id == Survey.survey_id,
+                func.instr(Question.question_text, term) > 0,
+            ),
+        )
+        for term in terms
+    ]
+    return select(Survey.survey_id, literal(0.0).label("rank")).where(*conditions)
+
+
+# 管理画面のアンケート一覧の絞り込み条件（keyword: アンケート名・説明・設問文の検索、year: 作成年）
+def _survey_list_conditions(keyword=None, year=None):
+    conditions = []
+    if keyword and keyword.split():
+        matches = _survey_keyword_matches(keyword).subquery()
+        conditions.append(Survey.survey_id.in_(select(matches.c.survey_id)))
+    if year:
+        conditions.append(Survey.created_at >= datetime.datetime(int(year), 1, 1))
+        conditions.append(Survey.created_at < datetime.datetime(int(year) + 1, 1, 1))
+    return conditions
+
+
+# 管理画面のアンケート一覧の1ページ分（survey_id順）
+# after_idに前のページの最後のsurvey_idを渡すと、その次から取得する（キーセットページング）
+async def get_survey_page(session, keyword=None, year=None, after_id=None, limit=20):
+    stmt = select(Survey.__table__).where(*_survey_list_conditions(keyword, year))
+    if after_id is not None:
+        stmt = stmt.where(Survey.survey_id > after_id)
+    stmt = stmt.order_by(Survey.survey_id).limit(limit)
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+
+# 管理画面のアンケート一覧の絞り込み後の件数
+async def get_survey_count(session, keyword=None, year=None):
+    stmt = select(func.count()).select_from(Survey).where(
+        *_survey_list_conditions(keyword, year)
+    )
+    result = await session.execute(stmt)
+    return result.scalar_one()
+
+
+# 管理画面のアンケート一覧の回答状況（アンケートごとの提出済み・一時保存中の回答者数と最終提出日時）
+# 表示中のページのsurvey_idだけを回答ヘッダーから1クエリで集計する（answersは読まない）
+# 回答ヘッダーのないアンケートは0人・最終提出日時None
+async def get_survey_response_summaries(session, survey_ids):
+    summaries = {
+        survey_id: {"submitted": 0, "draft": 0, "last_submitted_at": None}
+        for survey_id in survey_ids
+    }
+    if not summaries:
+        return summaries
+    submitted = Response.status == SurveyStatus.SUBMITTED.value
+    stmt = (
+        select(
+            Response.survey_id,
+            func.count().filter(submitted).label("submitted"),
+            func.count().filter(Response.status == SurveyStatus.DRAFT.value).label(
+                "draft"
+            ),
+            func.max(Response.submitted_at).filter(submitted).label("last_submitted_at"),
+        )
+        .where(Response.survey_id.in_(survey_ids))
+        .group_by(Response.survey_id)
+    )
+    result = await session.execute(stmt)
+    for row in result.fetchall():
+        summaries[row.survey_id] = {
+            "submitted": row.submitted,
+            "draft": row.draft,
+            "last_submitted_at": row.last_submitted_at,
+        }
+    return summaries
+
+
+# キーワードに一致するアンケートを関連度順に取得（アンケート名の一致を設問文の一致より重く扱う）
+# 行はsurveysの列にrankを加えたもの。ページングはoffsetで行う
+async def search_surveys(session, keyword, year=None, limit=20, offset=0):
+    matches = _survey_keyword_matches(keyword).subquery()
+    ranks = (
+        select(matches.c.survey_id, func.min(matches.c.rank).label("rank"))
+        .group_by(matches.c.survey_id)
+        .subquery()
+    )
+    stmt = (
+        select(Survey.__table__, ranks.c.rank)
+        .join(ranks, ranks.c.survey_id == Survey.survey_id)
+        .where(*_survey_list_conditions(year=year))
+        .order_by(ranks.c.rank, Survey.survey_id)
+        .limit(limit)
+        .offset(offset)
+    )
+    result = await session.execute(stmt)
+    return result.fetchall()
+
+
+# アンケートの作成年の一覧（昇順）
+# 「翌年以降で最小のcreated_at」をインデックスで1件ずつ引いて次の年へ進む（全件は読まない）
+async def get_survey_created_years(session):
+    firsts = select(func.min(Survey.created_at).label("first")).cte(
+        "years", recursive=True
+    )
+    next_first = (
+        select(func.min(Survey.created_at))
+        .where(
+            Survey.created_at
+            >= func.printf(
+                "%04d-01-01",
+                cast(func.strftime("%Y", firsts.c.first), Integer) + 1,
+            )
+        )
+        .scalar_subquery()
+    )
+    firsts = firsts.union_all(select(next_first).where(firsts.c.first.is_not(None)))
+    stmt = select(func.strftime("%Y", firsts.c.first)).where(
+        firsts.c.first.is_not(None)
+    )
+    result = await session.execute(stmt)
+    return [int(y) for y in result.scalars().all()]
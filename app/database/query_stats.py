@@ -0,0 +1,311 @@
+from collections import Counter, deque
+from contextlib import contextmanager
+from sqlalchemy import event
+import bisect
+import contextvars
+import datetime
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+# SQLの実行時間の計測（SQLのエコー出力の代わり）
+#
+# エンジンのカーソル実行イベント（before/after_cursor_execute）で1文ごとの実行時間を計り、
+#   文ごと:       正規化したSQL（値・空白・IN句の長さの違いをまとめる）ごとの回数・時間・ヒストグラム
+#   ページごと:   リラン1回あたりのクエリ数・DB時間・描画時間（リラン全体からDB時間を引いた時間）
+#   リランごと:   直近のリランのクエリ数と、同じSQLを2回以上実行した回数（重複クエリ）
+#   遅いクエリ:   SURVEY_SLOW_QUERY_MS（既定100ms）以上かかった文。ロガー "database.slow_query" に
+#                 警告を出し、SURVEY_SLOW_QUERY_LOG が指定されていればそのファイルにも書き込む
+# を集める。リランは main.py で rerun() の範囲にする。フラグメント（@st.fragment）だけの再実行は
+# main.py を通らないので、フラグメントの関数に fragment() を付けて "{ページ名}:{関数名}" のリランにする。
+# DBアクセスはdatabase.runnerのイベントループで実行されるが、run() の呼び出し元の
+# コンテキスト変数が引き継がれるので、どのリランのクエリかが分かる。
+
+# ヒストグラムの区切り（ms）。最後の区間は最後の区切り以上
+HISTOGRAM_BOUNDS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+DEFAULT_SLOW_QUERY_MS = 100
+MAX_RERUNS = 200
+MAX_SLOW_QUERIES = 100
+MAX_PARAMS_CHARS = 200
+
+slow_query_logger = logging.getLogger("database.slow_query")
+
+_current_rerun = contextvars.ContextVar("query_stats_rerun", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\?(?:, \?)+\)")
+_REPEATED_GROUP = re.compile(r"(\(\?(?:, \?)*\))(?:, \1)+")
+
+
+# 値・空白の違いをまとめたSQL（IN句やVALUESの行数が違っても同じになる）
+def normalize_sql(statement):
+    sql = _WHITESPACE.sub(" ", statement).strip()
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _REPEATED_GROUP.sub(r"\1, ...", sql)
+    return _PLACEHOLDER_LIST.sub("(?, ...)", sql)
+
+
+# ヒストグラムから近似のパーセンタイル（その区間の上限、最後の区間は最大値）
+def _percentile(buckets, count, max_ms, p):
+    if not count:
+        return 0.0
+    target = count * p
+    seen = 0
+    for bound, n in zip(HISTOGRAM_BOUNDS_MS, buckets):
+        seen += n
+        if seen >= target:
+            return round(min(float(bound), max_ms), 3)
+    return round(max_ms, 3)
+
+
+class QueryStats:
+    def __init__(self, slow_query_ms=None, max_reruns=MAX_RERUNS):
+        if slow_query_ms is None:
+            slow_query_ms = float(
+                os.environ.get("SURVEY_SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)
+            )
+        self.slow_query_ms = slow_query_ms
+        self.started_at = datetime.datetime.now()
+        self._statements = {}
+        self._pages = {}
+        self._reruns = deque(maxlen=max_reruns)
+        self._slow_queries = deque(maxlen=MAX_SLOW_QUERIES)
+        self._lock = threading.Lock()
+
+    # 1文の実行を記録する（after_cursor_executeから呼ばれる）
+    def record(self, statement, parameters, elapsed_ms):
+        sql = normalize_sql(statement)
+        rerun = _current_rerun.get()
+        with self._lock:
+            stats = self._statements.get(sql)
+            if stats is None:
+                stats = self._statements[sql] = {
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "buckets": [0] * (len(HISTOGRAM_BOUNDS_MS) + 1),
+                }
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["buckets"][bisect.bisect_right(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+            if rerun is not None:
+                rerun["queries"] += 1
+                rerun["db_ms"] += elapsed_ms
+                rerun["statements"][sql] += 1
+        if elapsed_ms >= self.slow_query_ms:
+            self._record_slow(sql, statement, parameters, elapsed_ms, rerun)
+
+    def _record_slow(self, sql, statement, parameters, elapsed_ms, rerun):
+        params = repr(parameters)
+        if len(params) > MAX_PARAMS_CHARS:
+            params = params[:MAX_PARAMS_CHARS] + "..."
+        entry = {
+            "at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "elapsed_ms": round(elapsed_ms, 3),
+            "page": rerun["page"] if rerun else None,
+            "sql": sql,
+            "statement": statement,
+            "parameters": params,
+        }
+        with self._lock:
+            self._slow_queries.append(entry)
+        slow_query_logger.warning(
+            "slow query %.1fms page=%s sql=%s params=%s",
+            elapsed_ms,
+            entry["page"],
+            sql,
+            params,
+        )
+
+    # withの範囲を1回のリランとして記録する（pageはページ名）
+    @contextmanager
+    def rerun(self, page):
+        rerun = {
+            "page": page,
+            "queries": 0,
+            "db_ms": 0.0,
+            "statements": Counter(),
+        }
+        token = _current_rerun.set(rerun)
+        started_at = datetime.datetime.now()
+        start = time.perf_counter()
+        try:
+            yield rerun
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            _current_rerun.reset(token)
+            self._finish_rerun(rerun, started_at, total_ms)
+
+    # フラグメントの関数に付けるデコレータ（@st.fragment の下に付ける）
+    # フラグメントだけの再実行を "{ページ名}:{関数名}" のリランとして記録する
+    # ページ全体のリラン中に実行された場合は、そのリランに含める（二重に数えない）
+    # ページ名は関数を定義した時（ページ全体のリラン中）のリランから取る
+    def fragment(self, func):
+        rerun = _current_rerun.get()
+        name = f"{rerun['page']}:{func.__name__}" if rerun else func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_rerun.get() is not None:
+                return func(*args, **kwargs)
+            with self.rerun(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def _finish_rerun(self, rerun, started_at, total_ms):
+        with self._lock:
+            render_ms = max(total_ms - rerun["db_ms"], 0.0)
+            duplicates = sum(n - 1 for n in rerun["statements"].values() if n > 1)
+            self._reruns.append(
+                {
+                    "at": started_at.isoformat(timespec="seconds"),
+                    "page": rerun["page"],
+                    "queries": rerun["queries"],
+                    "duplicate_queries": duplicates,
+                    "db_ms": round(rerun["db_ms"], 3),
+                    "render_ms": round(render_ms, 3),
+                    "total_ms": round(total_ms, 3),
+                    "duplicated_sql": [
+                        sql for sql, n in rerun["statements"].items() if n > 1
+                    ],
+                }
+            )
+            page = self._pages.get(rerun["page"])
+            if page is None:
+                page = self._pages[rerun["page"]] = {
+                    "reruns": 0,
+                    "queries": 0,
+                    "max_queries": 0,
+                    "duplicate_queries": 0,
+                    "db_ms": 0.0,
+                    "render_ms": 0.0,
+                    "total_ms": 0.0,
+                    "max_total_ms": 0.0,
+                }
+            page["reruns"] += 1
+            page["queries"] += rerun["queries"]
+            page["max_queries"] = max(page["max_queries"], rerun["queries"])
+            page["duplicate_queries"] += duplicates
+            page["db_ms"] += rerun["db_ms"]
+            page["render_ms"] += render_ms
+            page["total_ms"] += total_ms
+            page["max_total_ms"] = max(page["max_total_ms"], total_ms)
+
+    # 文ごとの集計（合計時間の長い順）
+    def statements(self):
+        with self._lock:
+            items = [
+                (sql, dict(s, buckets=list(s["buckets"])))
+                for sql, s in self._statements.items()
+            ]
+        rows = []
+        for sql, s in items:
+            rows.append(
+                {
+                    "sql": sql,
+                    "count": s["count"],
+                    "total_ms": round(s["total_ms"], 3),
+                    "mean_ms": round(s["total_ms"] / s["count"], 3),
+                    "p50_ms": _percentile(s["buckets"], s["count"], s["max_ms"], 0.5),
+                    "p95_ms": _percentile(s["buckets"], s["count"], s["max_ms"], 0.95),
+                    "max_ms": round(s["max_ms"], 3),
+                    "histogram": s["buckets"],
+                }
+            )
+        return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+    # ページごとの集計（リラン1回あたりの平均を含む）
+    def pages(self):
+        with self._lock:
+            items = [(name, dict(p)) for name, p in self._pages.items()]
+        rows = []
+        for name, p in items:
+            n = p["reruns"]
+            rows.append(
+                {
+                    "page": name,
+                    "reruns": n,
+                    "queries_per_rerun": round(p["queries"] / n, 2),
+                    "max_queries": p["max_queries"],
+                    "duplicate_queries": p["duplicate_queries"],
+                    "db_ms_per_rerun": round(p["db_ms"] / n, 3),
+                    "render_ms_per_rerun": round(p["render_ms"] / n, 3),
+                    "total_ms_per_rerun": round(p["total_ms"] / n, 3),
+                    "max_total_ms": round(p["max_total_ms"], 3),
+                }
+            )
+        return sorted(rows, key=lambda r: r["db_ms_per_rerun"], reverse=True)
+
+    # 直近のリラン（新しい順）
+    def reruns(self):
+        with self._lock:
+            return list(reversed(self._reruns))
+
+    # 直近の遅いクエリ（新しい順）
+    def slow_queries(self):
+        with self._lock:
+            return list(reversed(self._slow_queries))
+
+    # JSONに書き出せる形の全集計
+    def snapshot(self):
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "slow_query_ms": self.slow_query_ms,
+            "histogram_bounds_ms": list(HISTOGRAM_BOUNDS_MS),
+            "statements": self.statements(),
+            "pages": self.pages(),
+            "reruns": self.reruns(),
+            "slow_queries": self.slow_queries(),
+        }
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.datetime.now()
+            self._statements.clear()
+            self._pages.clear()
+            self._reruns.clear()
+            self._slow_queries.clear()
+
+
+# サーバープロセス全体で共有する集計
+query_stats = QueryStats()
+
+
+# エンジン（同期エンジン、非同期エンジンはsync_engine）のSQLの実行時間を計測する
+def register_query_stats(sync_engine, stats=None):
+    stats = stats or query_stats
+    log_path = os.environ.get("SURVEY_SLOW_QUERY_LOG")
+    if log_path and not any(
+        getattr(h, "baseFilename", None) == os.path.abspath(log_path)
+        for h in slow_query_logger.handlers
+    ):
+        handler = logging.FileHandler(log_path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_query_logger.addHandler(handler)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        stats.record(statement, parameters, (time.perf_counter() - start) * 1000)
+
+    # 失敗した文は計測しない（開始時刻だけ捨てる）
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+    return stats
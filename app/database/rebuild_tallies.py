@@ -0,0 +1,20 @@
+from models import question_tally_rebuild_statements
+from sqlalchemy import create_engine
+from sqlite_profile import register_sqlite_profile
+import argparse
+
+# 回答集計テーブル（question_tallies）をanswersから作り直す
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回答集計テーブルの再作成")
+    parser.add_argument(
+        "--survey-id", type=int, default=None, help="対象アンケートID（省略時は全件）"
+    )
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    # アプリと同じPRAGMAを設定する（実行中のアプリの書き込みはbusy_timeoutまで待つ）
+    register_sqlite_profile(engine)
+    with engine.begin() as conn:
+        for stmt in question_tally_rebuild_statements(args.survey_id):
+            conn.execute(stmt)
+    print("回答集計テーブル再作成完了")
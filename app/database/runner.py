@@ -0,0 +1,69 @@
+from database.database import engine
+import asyncio
+import threading
+
+# ページからDBアクセスのコルーチンを実行するためのランナー
+#
+# asyncio.run() は呼び出しのたびにイベントループを作って破棄するため、
+# エンジンのプールにあるaiosqlite接続が存在しないループに紐づいたままになる。
+# サーバープロセスで1つだけバックグラウンドスレッドでイベントループを動かし続け、
+# すべてのページ・セッションのコルーチンをそのループで実行することで、
+# プールの接続をリラン・セッションをまたいで使い回す。
+#
+# コルーチンは別スレッドで実行されるので、コルーチン内ではst.*を呼ばないこと。
+
+
+class AsyncRunner:
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # イベントループのスレッドを（未起動なら）起動してループを返す
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="db-event-loop", daemon=True
+                )
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    # コルーチンをイベントループで実行し、結果を返す（呼び出し元スレッドはブロックする）
+    def run(self, coro, timeout=None):
+        loop = self._get_loop()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("イベントループのスレッドからrun()は呼び出せません")
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+    def stop(self):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+            self._loop, self._thread = None, None
+
+
+# サーバープロセス全体で共有するランナー
+runner = AsyncRunner()
+
+
+# asyncio.run() の代わりにページから呼び出す
+def run(coro, timeout=None):
+    return runner.run(coro, timeout)
+
+
+# コネクションプールの状態
+def pool_stats():
+    pool = engine.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "status": pool.status(),
+    }
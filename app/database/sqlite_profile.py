@@ -0,0 +1,52 @@
+from sqlalchemy import event
+import os
+
+# SQLiteの接続ごとに設定するPRAGMAのプロファイル
+# 使用するプロファイルは環境変数 SURVEY_DB_PROFILE で切り替える（既定は "wal"）
+SQLITE_PROFILES = {
+    # SQLiteの既定値のまま（ロールバックジャーナル）
+    "default": {},
+    # 読み取りと書き込みを並行させる設定
+    "wal": {
+        # 書き込み中も他の接続から読み取れる
+        "journal_mode": "WAL",
+        # WALではNORMALでもコミット済みのデータは壊れない（電源断時に直前のコミットが失われうる）
+        "synchronous": "NORMAL",
+        # ロック中の接続はエラーにせず最大5秒待つ
+        "busy_timeout": 5000,
+        # ページキャッシュ約20MB（負の値はKiB単位）
+        "cache_size": -20000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+}
+
+DEFAULT_PROFILE = "wal"
+
+
+# 環境変数で指定されたプロファイル名
+def profile_name():
+    return os.environ.get("SURVEY_DB_PROFILE", DEFAULT_PROFILE)
+
+
+# DB-APIの接続にプロファイルのPRAGMAを設定する
+def apply_sqlite_profile(dbapi_connection, profile=None):
+    pragmas = SQLITE_PROFILES[profile or profile_name()]
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+# エンジン（同期エンジン、非同期エンジンはsync_engine）の接続時にプロファイルを設定する
+def register_sqlite_profile(sync_engine, profile=None):
+    profile = profile or profile_name()
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"未定義のSQLiteプロファイルです: {profile}")
+
+    @event.listens_for(sync_engine, "connect")
+    def _apply(dbapi_connection, connection_record):
+        apply_sqlite_profile(dbapi_connection, profile)
+
+    return profile
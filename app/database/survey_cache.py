@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import copy
+import threading
+
+# アンケート定義（models.get_streamlit_survey_format_jsonの結果）のプロセス内キャッシュ
+#
+# キーは (survey_id, version)。versionはアンケートを更新・削除した時に
+# invalidate() で進めるプロセス内のカウンタで、古い定義は二度と参照されない。
+# 同じアンケートを同時に開いた場合も、DBから読み込むのは最初の1回だけになる。
+# 呼び出し側で値を書き換えても共有の定義に影響しないよう、常にコピーを返す
+# （copy_values=Falseの場合は、呼び出し側で書き換えない前提でそのまま返す）。
+
+
+class SurveyDefinitionCache:
+    def __init__(self, max_size=256, copy_values=True):
+        self.max_size = max_size
+        self.copy_values = copy_values
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    # アンケートの現在のバージョン
+    def version(self, survey_id):
+        with self._lock:
+            return self._versions.get(int(survey_id), 0)
+
+    # キャッシュ済みの定義を返す。なければloader(survey_id)で読み込んでキャッシュする
+    def get(self, survey_id, loader):
+        survey_id = int(survey_id)
+        with self._lock:
+            key = (survey_id, self._versions.get(survey_id, 0))
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._copy(self._entries[key])
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        # 同じキーの読み込みは1スレッドだけが行い、他はその結果を待つ
+        with load_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._copy(self._entries[key])
+            try:
+                definition = loader(survey_id)
+                with self._lock:
+                    self.misses += 1
+                    # 読み込み中にinvalidateされた定義はキャッシュしない
+                    if self._versions.get(survey_id, 0) == key[1]:
+                        self._entries[key] = definition
+                        self._entries.move_to_end(key)
+                        while len(self._entries) > self.max_size:
+                            self._entries.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return self._copy(definition)
+
+    # アンケートの定義を破棄する（作成・更新・複製・削除・公開期限変更の後に呼ぶ）
+    def invalidate(self, survey_id):
+        survey_id = int(survey_id)
+        with self._lock:
+            self._versions[survey_id] = self._versions.get(survey_id, 0) + 1
+            for key in [k for k in self._entries if k[0] == survey_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            for survey_id, _ in self._entries:
+                self._versions[survey_id] = self._versions.get(survey_id, 0) + 1
+            self._entries.clear()
+
+    def _copy(self, value):
+        return copy.deepcopy(value) if self.copy_values else value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# サーバープロセス全体で共有するキャッシュ
+survey_definition_cache = SurveyDefinitionCache()
@@ -1,3 +1,4 @@
+from database.query_stats import query_stats
 import streamlit as st
 
 
@@ -63,6 +64,13 @@ def get_admin_pages():
             icon=":material/add:",
             url_path="/admin_survey_admin_create",
         ),
+        # アンケートの一括取り込みページ
+        st.Page(
+            "pages/admin/survey_import.py",
+            title="アンケート一括取り込み",
+            icon=":material/upload_file:",
+            url_path="/admin_survey_import",
+        ),
         # アンケートの編集ページ
         st.Page(
             "pages/admin/survey_edit.py",
@@ -77,6 +85,13 @@ def get_admin_pages():
             icon=":material/query_stats:",
             url_path="/admin_survey_analysis",
         ),
+        # DBアクセスの診断ページ（クエリの実行時間・遅いクエリ）
+        st.Page(
+            "pages/admin/diagnostics.py",
+            title="DB診断",
+            icon=":material/monitor_heart:",
+            url_path="/admin_diagnostics",
+        ),
     ]
 
 
@@ -108,7 +123,9 @@ def page_routing():
     #     st.session_state["last_url_path"] = pg.url_path
     # st.write(pg.url_path)
     # st.write(st.session_state)
-    pg.run()
+    # リラン1回分のクエリ数・DB時間・描画時間をページごとに記録する
+    with query_stats.rerun(pg.title):
+        pg.run()
 
 
 def main():
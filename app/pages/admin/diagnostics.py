@@ -0,0 +1,123 @@
+# StreamlitによるDBアクセスの診断ページ
+from database.draft_queue import draft_queue
+from database.query_stats import HISTOGRAM_BOUNDS_MS, query_stats
+from database.runner import pool_stats
+from database.survey_cache import survey_definition_cache
+import json
+import pandas as pd
+import streamlit as st
+
+st.title("DB診断")
+st.caption(
+    f"{query_stats.started_at:%Y/%m/%d %H:%M:%S} からの集計（このサーバープロセスの分）。"
+    f"{query_stats.slow_query_ms:g}ms以上かかったクエリを遅いクエリとして記録します。"
+)
+
+snapshot = query_stats.snapshot()
+
+col1, col2, col3 = st.columns([2, 2, 1])
+col1.download_button(
+    "JSONでエクスポート",
+    data=json.dumps(snapshot, ensure_ascii=False, indent=2),
+    file_name="query_stats.json",
+    mime="application/json",
+)
+if col3.button("リセット"):
+    query_stats.reset()
+    st.rerun()
+
+statements = snapshot["statements"]
+cols = st.columns(4)
+cols[0].metric("SQLの種類", len(statements))
+cols[1].metric("実行回数", sum(s["count"] for s in statements))
+cols[2].metric("DB時間 (ms)", f"{sum(s['total_ms'] for s in statements):,.1f}")
+cols[3].metric("遅いクエリ", len(snapshot["slow_queries"]))
+
+# ページごとのリラン1回あたりのクエリ数・時間
+st.subheader("ページごと（リラン1回あたり）")
+st.caption("「ページ名:関数名」の行は、フラグメント（一覧の行・回答ページの設問など）だけの再実行です。")
+if snapshot["pages"]:
+    st.dataframe(
+        pd.DataFrame(snapshot["pages"]).rename(
+            columns={
+                "page": "ページ",
+                "reruns": "リラン数",
+                "queries_per_rerun": "クエリ数",
+                "max_queries": "最大クエリ数",
+                "duplicate_queries": "重複クエリ（累計）",
+                "db_ms_per_rerun": "DB時間 (ms)",
+                "render_ms_per_rerun": "描画時間 (ms)",
+                "total_ms_per_rerun": "合計 (ms)",
+                "max_total_ms": "最大 (ms)",
+            }
+        ),
+        hide_index=True,
+    )
+else:
+    st.write("まだ記録がありません")
+
+# SQLごとの実行時間（正規化したSQLごと、合計時間の長い順）
+st.subheader("SQLごと")
+if statements:
+    frame = pd.DataFrame(statements).drop(columns=["histogram"])
+    st.dataframe(
+        frame.rename(
+            columns={
+                "count": "回数",
+                "total_ms": "合計 (ms)",
+                "mean_ms": "平均 (ms)",
+                "p50_ms": "p50 (ms)",
+                "p95_ms": "p95 (ms)",
+                "max_ms": "最大 (ms)",
+            }
+        ),
+        hide_index=True,
+    )
+    # 選んだSQLの実行時間の分布
+    index = st.selectbox(
+        "実行時間の分布を表示するSQL",
+        options=range(len(statements)),
+        format_func=lambda i: statements[i]["sql"][:120],
+    )
+    labels = [f"<{b:g}ms" for b in HISTOGRAM_BOUNDS_MS] + [
+        f"≥{HISTOGRAM_BOUNDS_MS[-1]:g}ms"
+    ]
+    st.bar_chart(
+        pd.DataFrame(
+            {"回数": statements[index]["histogram"]},
+            index=pd.CategoricalIndex(labels, categories=labels, ordered=True),
+        )
+    )
+    st.code(statements[index]["sql"], language="sql")
+else:
+    st.write("まだ記録がありません")
+
+# 直近のリラン（同じSQLを2回以上実行したリランは重複クエリの数を表示）
+st.subheader("直近のリラン")
+reruns = snapshot["reruns"]
+if reruns:
+    only_duplicates = st.checkbox("重複クエリのあるリランだけ表示")
+    rows = [r for r in reruns if r["duplicate_queries"]] if only_duplicates else reruns
+    st.dataframe(pd.DataFrame(rows), hide_index=True)
+else:
+    st.write("まだ記録がありません")
+
+# 遅いクエリ
+st.subheader("遅いクエリ")
+if snapshot["slow_queries"]:
+    st.dataframe(
+        pd.DataFrame(snapshot["slow_queries"]).drop(columns=["statement"]),
+        hide_index=True,
+    )
+else:
+    st.write("遅いクエリはありません")
+
+# そのほかのDBアクセスの状態
+with st.expander("コネクションプール・キャッシュ・一時保存キュー"):
+    st.json(
+        {
+            "pool": pool_stats(),
+            "survey_definition_cache": survey_definition_cache.stats(),
+            "draft_queue": draft_queue.stats(),
+        }
+    )
@@ -1,8 +1,10 @@
 from database import models
 from database.database import AsyncSessionLocal
+from database.query_stats import query_stats
+from database.runner import run
+from database.survey_cache import survey_definition_cache
 from sqlalchemy import update
 import streamlit as st
-import asyncio
 import time
 import datetime
 
@@ -47,12 +49,15 @@ def update_end_date(survey):
                 )
                 await session.execute(stmt)
                 await session.commit()
-            st.success("アンケートの公開期限を更新しました")
-            # 少し待ってリロード
-            time.sleep(2)
-            st.rerun()
 
-        asyncio.run(update_survey_end_date())
+        run(update_survey_end_date())
+        survey_definition_cache.invalidate(
+            survey.survey_id if hasattr(survey, "survey_id") else survey[0]
+        )
+        st.success("アンケートの公開期限を更新しました")
+        # 少し待ってリロード
+        time.sleep(2)
+        st.rerun()
 
 
 # アンケート複製ダイアログ
@@ -62,62 +67,23 @@ def copy_survey(survey):
         f"アンケートID: {survey.survey_id if hasattr(survey, 'survey_id') else survey[0]}"
     )
     if st.button("複製"):
-        # 非同期で複製処理
+        # 非同期で複製処理（設問の複製はDB内で行う）
         async def copy_survey_to_new_situation(survey):
             async with AsyncSessionLocal() as session:
-                # 新しいアンケートを作成
-                new_survey = models.Survey(
-                    title=f"{survey.title if hasattr(survey, 'title') else survey[1]} (複製)",
-                    description=survey.description
-                    if hasattr(survey, "description")
-                    else survey[2],
-                    created_at=datetime.datetime.now(),
-                    end_date=survey.end_date
-                    if hasattr(survey, "end_date")
-                    else survey[4],
-                )
-                session.add(new_survey)
-                await session.commit()
-                await session.refresh(new_survey)
-
-                # 元のアンケートの質問をDBから取得し複製
-                orig_survey_id = (
-                    survey.survey_id if hasattr(survey, "survey_id") else survey[0]
-                )
-                result = await session.execute(
-                    models.Question.__table__.select().where(
-                        models.Question.survey_id == orig_survey_id
-                    )
+                return await models.clone_survey(
+                    session,
+                    survey.survey_id if hasattr(survey, "survey_id") else survey[0],
                 )
-                questions = result.fetchall()
-                for q in questions:
-                    session.add(
-                        models.Question(
-                            survey_id=new_survey.survey_id,
-                            question_text=q.question_text
-                            if hasattr(q, "question_text")
-                            else q[2],
-                            question_type=q.question_type
-                            if hasattr(q, "question_type")
-                            else q[3],
-                            options=q.options if hasattr(q, "options") else q[4],
-                            order_number=q.order_number
-                            if hasattr(q, "order_number")
-                            else q[5],
-                            page_number=q.page_number
-                            if hasattr(q, "page_number")
-                            else q[6],
-                            image=q.image if hasattr(q, "image") else q[7],
-                        )
-                    )
-                await session.commit()
-
-            st.success(f"アンケートID( {new_survey.survey_id} )として複製しました")
-            # 少し待ってリロード
-            time.sleep(3)
-            st.rerun()
 
-        asyncio.run(copy_survey_to_new_situation(survey))
+        new_survey_id = run(copy_survey_to_new_situation(survey))
+        if new_survey_id is None:
+            st.error("複製元のアンケートが見つかりません")
+            st.stop()
+        survey_definition_cache.invalidate(new_survey_id)
+        st.success(f"アンケートID( {new_survey_id} )として複製しました")
+        # 少し待ってリロード
+        time.sleep(3)
+        st.rerun()
 
 
 # アンケート削除ダイアログ
@@ -130,122 +96,149 @@ def confirm_delete_survey(survey):
         # 非同期で削除処理
         async def delete_survey(survey):
             async with AsyncSessionLocal() as session:
-                stmt = models.Survey.__table__.delete().where(
-                    models.Survey.survey_id
-                    == (survey.survey_id if hasattr(survey, "survey_id") else survey[0])
+                await models.delete_survey(
+                    session,
+                    survey.survey_id if hasattr(survey, "survey_id") else survey[0],
                 )
-                await session.execute(stmt)
-                await session.commit()
-            st.success("アンケートを削除しました")
-            # 少し待ってリロード
-            time.sleep(2)
-            st.rerun()
 
-        asyncio.run(delete_survey(survey))
+        run(delete_survey(survey))
+        survey_definition_cache.invalidate(
+            survey.survey_id if hasattr(survey, "survey_id") else survey[0]
+        )
+        st.success("アンケートを削除しました")
+        # 少し待ってリロード
+        time.sleep(2)
+        st.rerun()
 
 
 # アンケート管理ページ本体
 st.title("アンケート管理")
 
 
-# アンケート一覧をDBから取得
-async def fetch_surveys():
+# 作成年の一覧をDBから取得
+async def fetch_created_years():
     async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            models.Survey.__table__.select().order_by(models.Survey.survey_id)
-        )
-        return result.fetchall()
+        return await models.get_survey_created_years(session)
 
 
-surveys = asyncio.run(fetch_surveys())
+# 絞り込み後の件数と1ページ分のアンケート、そのページのアンケートの回答状況をDBから取得
+# キーワード指定時は関連度順（cursorは読み飛ばす件数）、それ以外はID順（cursorは直前のsurvey_id）
+async def fetch_surveys(keyword, year, cursor, limit):
+    async with AsyncSessionLocal() as session:
+        total = await models.get_survey_count(session, keyword, year)
+        if keyword:
+            rows = await models.search_surveys(session, keyword, year, limit, cursor or 0)
+        else:
+            rows = await models.get_survey_page(session, None, year, cursor, limit)
+        summaries = await models.get_survey_response_summaries(
+            session, [row.survey_id for row in rows]
+        )
+        return total, rows, summaries
+
 
 # st.subheader("アンケート一覧")
 
 # フィルタUI
 with st.expander("フィルタ", expanded=True):
-    filter_title = st.text_input("アンケート名でフィルタ（部分一致）", value="")
-    years = sorted({s.created_at.year for s in surveys if hasattr(s, "created_at") and s.created_at} | {s[3].year for s in surveys if not hasattr(s, "created_at") and s[3]})
+    filter_keyword = st.text_input("キーワードで検索（アンケート名・説明・設問文）", value="").strip()
+    years = run(fetch_created_years())
     filter_year = st.selectbox("作成年でフィルタ", options=["すべて"] + [str(y) for y in years], index=0)
     per_page = st.selectbox("1ページの表示件数", options=[20, 50, 100], index=0)
 
-# フィルタ処理
-filtered_surveys = []
-for survey in surveys:
-    survey_id = survey.survey_id if hasattr(survey, "survey_id") else survey[0]
-    title = survey.title if hasattr(survey, "title") else survey[1]
-    created_at = survey.created_at if hasattr(survey, "created_at") else survey[3]
-    # アンケート名フィルタ
-    if filter_title and filter_title not in title:
-        continue
-    # 作成年フィルタ
-    if filter_year != "すべて":
-        if not created_at or str(created_at.year) != filter_year:
-            continue
-    filtered_surveys.append(survey)
-
 # ページング用セッション管理
-if "survey_admin_page" not in st.session_state:
-    st.session_state["survey_admin_page"] = 0
-
-max_page = max(1, (len(filtered_surveys) - 1) // per_page + 1)
-current_page = st.session_state["survey_admin_page"]
+# survey_admin_cursorsは各ページのcursor（1ページ目はNone）。フィルタが変わったら先頭に戻す
+filters = (filter_keyword, filter_year, per_page)
+if st.session_state.get("survey_admin_filters") != filters:
+    st.session_state["survey_admin_filters"] = filters
+    st.session_state["survey_admin_cursors"] = [None]
+cursors = st.session_state["survey_admin_cursors"]
+
+total, paged_surveys, response_summaries = run(
+    fetch_surveys(
+        filter_keyword or None,
+        None if filter_year == "すべて" else int(filter_year),
+        cursors[-1],
+        per_page,
+    )
+)
+# 削除などで表示中のページが空になったら前のページに戻る
+if not paged_surveys and len(cursors) > 1:
+    cursors.pop()
+    st.rerun()
+max_page = max(1, (total - 1) // per_page + 1)
+current_page = len(cursors) - 1
 
 # ページ切り替えUI
 col1, col2, col3 = st.columns([1, 2, 1])
 with col1:
     if st.button("前のページ", disabled=current_page == 0, key="prev_page"):
-        st.session_state["survey_admin_page"] = max(0, current_page - 1)
+        cursors.pop()
+        st.rerun()
 with col3:
     if st.button("次のページ", disabled=current_page >= max_page - 1, key="next_page"):
-        st.session_state["survey_admin_page"] = min(max_page - 1, current_page + 1)
+        if filter_keyword:
+            cursors.append((cursors[-1] or 0) + len(paged_surveys))
+        else:
+            cursors.append(paged_surveys[-1].survey_id)
+        st.rerun()
 col2.write(f"ページ {current_page + 1} / {max_page}")
 
-# 表示範囲をスライス
-start_idx = current_page * per_page
-end_idx = start_idx + per_page
-paged_surveys = filtered_surveys[start_idx:end_idx]
-
 # 一覧ヘッダー
-cols = st.columns([1, 7, 3, 3, 4])
+cols = st.columns([1, 6, 3, 3, 3, 4])
 cols[0].write("###### ID")
 cols[1].write("###### アンケート名")
 cols[2].write("###### 作成日")
 cols[3].write("###### 公開期限")
-cols[4].write("###### ")
-
-# 各アンケート行を表示
-for survey in paged_surveys:
+cols[4].write("###### 回答状況")
+cols[5].write("###### ")
+
+# アンケート1行分。行ごとのフラグメントにして、ボタン（ダイアログを開くなど）を押しても
+# その行だけを再実行する。ダイアログで変更した後はst.rerun()でページ全体を再実行し、一覧を取り直す
+@st.fragment
+@query_stats.fragment
+def show_survey_row(survey, summary):
     # surveyはRow型またはORM型のどちらか
     survey_id = survey.survey_id if hasattr(survey, "survey_id") else survey[0]
     title = survey.title if hasattr(survey, "title") else survey[1]
     created_at = survey.created_at if hasattr(survey, "created_at") else survey[3]
     end_date = survey.end_date if hasattr(survey, "end_date") else survey[4]
-    cols = st.columns([1, 7, 3, 3, 1, 1, 1, 1])
+    cols = st.columns([1, 6, 3, 3, 3, 1, 1, 1, 1])
     cols[0].write(survey_id)  # アンケートID
     cols[1].write(title)  # アンケート名
     cols[2].write(
         created_at.strftime("%Y/%m/%d %H:%M") if created_at else "--"
     )  # 作成日
     cols[3].write(end_date.strftime("%Y/%m/%d %H:%M") if end_date else "--")  # 公開期限
+    # 回答状況（提出済み・一時保存中の人数と最終提出日時）
+    last_submitted_at = summary["last_submitted_at"]
+    cols[4].write(
+        f"提出 {summary['submitted']} / 一時保存 {summary['draft']}  \n"
+        + (last_submitted_at.strftime("%Y/%m/%d %H:%M") if last_submitted_at else "--")
+    )
     # 公開ボタン
-    if cols[4].button(
+    if cols[5].button(
         ":material/publish:", key=f"publish_{survey_id}", help="アンケートを公開"
     ):
         update_end_date(survey)
     # 編集ボタン
-    if cols[5].button(
+    if cols[6].button(
         ":material/edit:", key=f"edit_{survey_id}", help="アンケートを編集"
     ):
         # 編集対象のアンケートデータをsession_stateに格納し、編集ページへ遷移
         st.session_state.survey_data = survey
         st.switch_page("pages/admin/survey_edit.py")
     # 複製ボタン
-    if cols[6].button(
+    if cols[7].button(
         ":material/content_copy:", key=f"copy_{survey_id}", help="アンケートを複製"
     ):
         copy_survey(survey)
     # 削除ボタン
-    if cols[7].button(
+    if cols[8].button(
         ":material/delete:", key=f"delete_{survey_id}", help="アンケートを削除"
     ):
         confirm_delete_survey(survey)
+
+
+# 各アンケート行を表示
+for survey in paged_surveys:
+    show_survey_row(survey, response_summaries[survey.survey_id])
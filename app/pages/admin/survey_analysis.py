@@ -1,4 +1,151 @@
+from database import models
+from database.analysis import get_response_matrix, response_matrix_cache
+from database.database import AsyncSessionLocal
+from database.export import (
+    EXPORT_FORMATS,
+    UI_EXPORT_MAX_RESPONDENTS,
+    export_survey_responses,
+)
+from database.runner import run
 import streamlit as st
+import pandas as pd
+import os
+import tempfile
 
+st.title("アンケート回答集計")
 
-st.write(__file__)
+
+# 集計対象のアンケート一覧を取得
+async def fetch_survey_titles():
+    async with AsyncSessionLocal() as session:
+        return await models.get_survey_titles(session)
+
+
+# 設問ごとの回答分布を取得（集計はDB側で実施）
+async def fetch_distributions(survey_id):
+    async with AsyncSessionLocal() as session:
+        return await models.get_survey_distributions(session, survey_id)
+
+
+surveys = run(fetch_survey_titles())
+if not surveys:
+    st.write("アンケートがありません")
+    st.stop()
+
+survey_titles = {s.survey_id: s.title for s in surveys}
+survey_id = st.selectbox(
+    "集計するアンケート",
+    options=list(survey_titles.keys()),
+    format_func=lambda sid: f"{sid} : {survey_titles[sid]}",
+)
+
+
+# 集計テーブルをanswersから作り直す
+async def rebuild_tallies(survey_id):
+    async with AsyncSessionLocal() as session:
+        await models.rebuild_question_tallies(session, survey_id)
+
+
+if st.button("集計を再計算", help="回答テーブルから集計をやり直します"):
+    run(rebuild_tallies(survey_id))
+    # クロス集計・相関の行列も読み込み直す
+    response_matrix_cache.invalidate(survey_id)
+    st.success("集計を再計算しました")
+
+
+# エクスポート対象の回答者数（回答ヘッダーの件数）
+async def count_export_respondents(survey_id, include_drafts):
+    async with AsyncSessionLocal() as session:
+        summaries = await models.get_survey_response_summaries(session, [survey_id])
+    summary = summaries[survey_id]
+    return summary["submitted"] + (summary["draft"] if include_drafts else 0)
+
+
+# 回答を横持ち（回答者1人が1行）でファイルに書き出す（回答者数を返す）
+async def export_responses(survey_id, out, fmt, include_drafts):
+    async with AsyncSessionLocal() as session:
+        return await export_survey_responses(session, survey_id, out, fmt, include_drafts)
+
+
+with st.expander("回答のエクスポート"):
+    export_format = st.radio(
+        "形式", list(EXPORT_FORMATS), format_func=str.upper, horizontal=True
+    )
+    include_drafts = st.checkbox("一時保存の回答も含める")
+    # ダウンロードはファイル全体をメモリに読み込むので、回答者が多い場合はコマンドで書き出してもらう
+    n_respondents = run(count_export_respondents(survey_id, include_drafts))
+    too_many = n_respondents > UI_EXPORT_MAX_RESPONDENTS
+    if too_many:
+        command = f"python app/database/export_responses.py {survey_id} responses.{export_format}"
+        if include_drafts:
+            command += " --include-drafts"
+        st.warning(
+            f"回答者が{n_respondents}人で、画面からエクスポートできる上限"
+            f"（{UI_EXPORT_MAX_RESPONDENTS}人）を超えています。"
+            "ダウンロードはファイル全体をサーバーのメモリに読み込むため、"
+            "サーバーで次のコマンドを実行してファイルに書き出してください。"
+        )
+        st.code(command, language="bash")
+    if st.button("エクスポートファイルを作成", disabled=too_many):
+        mime, ext = EXPORT_FORMATS[export_format]
+        file_name = f"survey_{survey_id}_responses.{ext}"
+        # 回答は少しずつ一時ファイルに書き出し、できたファイルをダウンロードさせる
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, file_name)
+            with open(path, "wb") as out:
+                count = run(export_responses(survey_id, out, export_format, include_drafts))
+            with open(path, "rb") as f:
+                st.download_button(
+                    f"ダウンロード（{count}人分）", data=f, file_name=file_name, mime=mime
+                )
+
+distributions = run(fetch_distributions(survey_id))
+if not distributions:
+    st.write("設問がありません")
+    st.stop()
+
+# 各設問の集計結果を表示
+for d in distributions:
+    st.subheader(f"{d['widget_key']} : {d['label']}")
+    st.caption(f"回答数: {d['responses']}")
+    if d["type"] == "slider" and d["stats"]:
+        cols = st.columns(3)
+        cols[0].metric("最小", d["stats"]["min"])
+        cols[1].metric("最大", d["stats"]["max"])
+        cols[2].metric("平均", f"{d['stats']['mean']:.2f}")
+    if d["counts"]:
+        df = pd.DataFrame(
+            {"選択肢": [str(k) for k in d["counts"]], "回答数": list(d["counts"].values())}
+        )
+        st.bar_chart(df, x="選択肢", y="回答数")
+
+
+# 回答者 × 設問の行列（キャッシュ済み）からクロス集計・相関を求める
+matrix = get_response_matrix(survey_id)
+choice_keys = [k for k in matrix.columns if matrix.kind(k) in ("categorical", "multiselect")]
+labels = {k: f"{k} : {matrix.questions[k]['label']}" for k in matrix.columns}
+
+if len(choice_keys) >= 2:
+    st.header("クロス集計")
+    st.caption(f"回答者数: {matrix.n_respondents}")
+    cols = st.columns(2)
+    row_key = cols[0].selectbox("行の設問", choice_keys, format_func=labels.get)
+    col_key = cols[1].selectbox(
+        "列の設問", choice_keys, index=1, format_func=labels.get
+    )
+    # 選択式の設問の回答で回答者を絞り込む
+    filter_key = st.selectbox(
+        "回答者の絞り込み", [None] + choice_keys, format_func=lambda k: labels.get(k, "なし")
+    )
+    mask = None
+    if filter_key:
+        filter_value = st.selectbox("絞り込む回答", matrix.categories(filter_key))
+        mask = matrix.mask(filter_key, filter_value)
+        st.caption(f"対象の回答者数: {int(mask.sum())}")
+    st.dataframe(matrix.crosstab(row_key, col_key, mask))
+
+numeric = matrix.numeric_frame()
+if numeric.shape[1] >= 2:
+    st.header("相関")
+    st.caption("スライダーの値と単一選択の選択肢の番号の相関係数")
+    st.dataframe(numeric.corr().rename(index=labels, columns=labels))
@@ -21,7 +21,8 @@ if submit:
     import json
     from database import models
     from database.database import AsyncSessionLocal
-    import asyncio
+    from database.runner import run
+    from database.survey_cache import survey_definition_cache
 
     # 入力バリデーション: アンケート名必須
     if not title:
@@ -57,6 +58,9 @@ if submit:
                 )
                 session.add(question)
             await session.commit()
-        st.success("アンケートを作成しました")
+            return survey.survey_id
 
-    asyncio.run(save_survey())
+    new_survey_id = run(save_survey())
+    # 同じIDの古い定義がキャッシュに残らないよう破棄
+    survey_definition_cache.invalidate(new_survey_id)
+    st.success("アンケートを作成しました")
@@ -1,8 +1,9 @@
 from database import models
-from database.database import AsyncSessionLocal
+from database.database import AsyncSessionLocal, write_session
+from database.runner import run
+from database.survey_cache import survey_definition_cache
 import streamlit as st
 import json
-import asyncio
 import time
 
 # survey_admin.pyの編集ボタンからsurveyを受け取る想定
@@ -23,43 +24,37 @@ new_description = st.session_state.pop("new_description", None)
 survey_json = st.session_state.pop("survey_json", None)
 # 設問を編集したか？
 if survey_id and new_title and new_description and survey_json:
-    # アンケート更新処理
+    try:
+        survey_json = json.loads(survey_json)
+    except Exception as e:
+        st.error(f"JSONデータが不正です: {e}")
+        st.stop()
+
+    # アンケート更新処理（現在の内容との差分だけを更新する）
     async def update(survey_id, new_title, new_description, survey_json):
-        try:
-            survey_json = json.loads(survey_json)
-        except Exception as e:
-            st.error(f"JSONデータが不正です: {e}")
-            st.stop()
-        async with AsyncSessionLocal() as session:
-            # アンケート本体を更新
-            await session.execute(
-                models.Survey.__table__.update()
-                .where(models.Survey.survey_id == survey_id)
-                .values(title=new_title, description=new_description)
-            )
-            # 既存の質問を削除
-            await session.execute(
-                models.Question.__table__.delete().where(
-                    models.Question.survey_id == survey_id
-                )
+        async with write_session() as session:
+            return await models.apply_survey_edit(
+                session,
+                int(survey_id),
+                new_title,
+                new_description,
+                survey_json.get("questions", []),
             )
-            # 新しい質問を追加
-            for idx, q in enumerate(survey_json.get("questions", [])):
-                question = models.Question(
-                    survey_id=survey_id,
-                    question_text=q.get("label", ""),
-                    question_type=q.get("type", "text"),
-                    options=json.dumps(q.get("options")) if q.get("options") else None,
-                    order_number=idx + 1,
-                    page_number=q.get("page", 1),
-                )
-                session.add(question)
-            await session.commit()
-        st.success("アンケートを更新しました")
-        time.sleep(2)  # 少し待ってからページを更新
-        st.switch_page("pages/admin/survey_admin.py")
-
-    asyncio.run(update(survey_id, new_title, new_description, survey_json))
+
+    try:
+        report = run(update(survey_id, new_title, new_description, survey_json))
+    except ValueError as e:
+        st.error(f"アンケートを更新できません: {e}")
+        st.stop()
+    # キャッシュ済みのアンケート定義を破棄
+    survey_definition_cache.invalidate(survey_id)
+    st.success(
+        "アンケートを更新しました"
+        f"（設問の追加 {len(report['inserted'])}件、変更 {len(report['updated'])}件、"
+        f"削除 {len(report['deleted'])}件）"
+    )
+    time.sleep(2)  # 少し待ってからページを更新
+    st.switch_page("pages/admin/survey_admin.py")
 
 # 設問を編集していないし、設問管理から遷移してきていなければエラー
 if survey is None:
@@ -80,14 +75,14 @@ description = survey.description if hasattr(survey, "description") else survey[2
 async def fetch_questions():
     async with AsyncSessionLocal() as session:
         result = await session.execute(
-            models.Question.__table__.select().where(
-                models.Question.survey_id == survey_id
-            )
+            models.Question.__table__.select()
+            .where(models.Question.survey_id == survey_id)
+            .order_by(models.Question.page_number, models.Question.order_number)
         )
         return result.fetchall()
 
 
-questions = asyncio.run(fetch_questions())
+questions = run(fetch_questions())
 
 
 # JSON形式に変換
@@ -96,6 +91,8 @@ def questions_to_json(questions):
     for q in questions:
         qlist.append(
             {
+                # 更新時に既存の設問と対応づけるキー（新しい設問には付けない）
+                "id": q.question_id if hasattr(q, "question_id") else q[0],
                 "type": q.question_type if hasattr(q, "question_type") else q[3],
                 "name": f"Q{q.order_number if hasattr(q, 'order_number') else q[5]}",
                 "label": q.question_text if hasattr(q, "question_text") else q[2],
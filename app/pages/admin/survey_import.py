@@ -0,0 +1,66 @@
+# Streamlitによるアンケート一括取り込みページ
+from database.bulk_import import import_files, load_surveys, validate_import
+from database.database import engine
+from database.runner import run
+from database.survey_cache import survey_definition_cache
+import functools
+import io
+import streamlit as st
+
+st.title("アンケート一括取り込み")
+st.markdown(
+    """
+    アンケート定義（`<名前>.json`）と、必要なら過去の回答（`<名前>.csv` / `<名前>.jsonl`）を
+    まとめたzip・tar、または個別のファイルをアップロードしてください。
+    回答の列はエクスポートと同じ（username, status, submitted_at, Q{page}_{order}...）です。
+    """
+)
+
+uploaded_files = st.file_uploader(
+    "取り込むファイル",
+    type=["zip", "tar", "gz", "tgz", "json", "csv", "jsonl"],
+    accept_multiple_files=True,
+)
+if not uploaded_files:
+    st.stop()
+
+# アップロードされたファイル（アーカイブは展開したファイル）を名前 → 開く関数にまとめる
+files = {}
+try:
+    for uploaded in uploaded_files:
+        data = uploaded.getvalue()
+        if uploaded.name.endswith((".json", ".csv", ".jsonl")):
+            files[uploaded.name] = functools.partial(io.BytesIO, data)
+        else:
+            files.update(import_files(io.BytesIO(data)))
+except ValueError as e:
+    st.error(f"{uploaded.name}: {e}")
+    st.stop()
+
+surveys, errors = validate_import(files)
+if errors:
+    st.error(f"{len(errors)}件のエラーがあります。修正してからアップロードし直してください。")
+    st.code("\n".join(errors))
+    st.stop()
+if not surveys:
+    st.warning("取り込むアンケート定義（.json）がありません")
+    st.stop()
+
+respondents = sum(s.get("respondents", 0) for s in surveys)
+st.write(f"アンケート{len(surveys)}件、回答者{respondents}人分を取り込みます")
+
+
+# 検証済みのアンケートをまとめて書き込む
+async def import_surveys(surveys):
+    async with engine.connect() as conn:
+        return await conn.run_sync(load_surveys, surveys)
+
+
+if st.button("取り込む", type="primary"):
+    counts = run(import_surveys(surveys))
+    # 削除済みアンケートのIDが再利用されても古い定義を使わないよう破棄
+    survey_definition_cache.clear()
+    st.success(
+        f"アンケート{counts['surveys']}件、設問{counts['questions']}件、"
+        f"回答{counts['answers']}件を取り込みました"
+    )
@@ -1,7 +1,7 @@
 import streamlit as st
-import asyncio
 from database import models
 from database.database import AsyncSessionLocal
+from database.runner import run
 import datetime
 import json
 
@@ -9,47 +9,36 @@ username = getattr(st.user, "name", None)
 
 st.title("回答履歴")
 
+# 回答済みアンケートの一覧（タイトル・最新の回答日時）を1クエリで取得
 async def fetch_answered_surveys():
     async with AsyncSessionLocal() as session:
-        # 回答済みアンケートID取得
-        answered_ids = await models.get_answered_survey_ids(session, username)
-        # アンケート本体取得
-        surveys = []
-        for sid in answered_ids:
-            survey_data = await models.get_streamlit_survey_format_json(session, sid)
-            # 最新の回答日取得
-            answers = await models.get_answers_for_survey_and_user(session, sid, username)
-            if answers:
-                latest = max([a.submitted_at for a, _ in answers if a.submitted_at])
-            else:
-                latest = None
-            surveys.append({
-                "survey_id": sid,
-                "title": survey_data["title"],
-                "answered_at": latest,
-            })
-        return surveys
+        rows = await models.get_answered_survey_history(session, username)
+        return [
+            {
+                "survey_id": row.survey_id,
+                "title": row.title,
+                "answered_at": row.answered_at,
+            }
+            for row in rows
+        ]
 
-answered_surveys = asyncio.run(fetch_answered_surveys())
+answered_surveys = run(fetch_answered_surveys())
 
+# 設問と回答を設問順に1クエリで取得
 async def fetch_survey_detail(survey_id, username):
     async with AsyncSessionLocal() as session:
-        survey_data = await models.get_streamlit_survey_format_json(session, survey_id)
-        answers = await models.get_answers_for_survey_and_user(session, survey_id, username)
-        # 設問順に並べる
-        questions = survey_data["questions"]
+        rows = await models.get_survey_answer_detail(session, survey_id, username)
         detail = []
-        for qid, q in questions.items():
-            # 回答を探す
+        for row in rows:
             answer_val = None
-            for a, question in answers:
-                if f"Q{question.page_number}_{question.order_number}" == qid:
-                    try:
-                        answer_val = json.loads(a.answer_text)
-                    except Exception:
-                        answer_val = a.answer_text
+            if row.answer_text is not None:
+                # answer_textがJSONの場合（複数選択肢など）も考慮
+                try:
+                    answer_val = json.loads(row.answer_text)
+                except Exception:
+                    answer_val = row.answer_text
             detail.append({
-                "label": q["label"],
+                "label": row.question_text,
                 "value": answer_val
             })
         return detail
@@ -64,7 +53,7 @@ def show_survey_detail_dialog():
         return
     st.write(f"アンケートID: {survey_id}")
     st.write(f"アンケート名: {survey_title}")
-    details = asyncio.run(fetch_survey_detail(survey_id, username))
+    details = run(fetch_survey_detail(survey_id, username))
     for d in details:
         st.write(f"- {d['label']}")
         st.write(f"  回答: {d['value'] if d['value'] is not None else '-'}")
@@ -0,0 +1,43 @@
+# 回答ページの表示計画（アンケート定義から1回だけ作り、リランのたびに定義全体を走査しない）
+#
+#   pages:         表示するページごとの設問キー（"Q{page}_{order}"）のリスト（表示順）
+#                  設問のあるpage_numberを昇順に詰めて並べる（pages[0]が1ページ目）
+#   order_numbers: 設問キー → 設問番号（order_number）
+#   option_index:  設問キー → {選択肢: 位置}（値がどの選択肢かをリストを走査せずに引く）
+#   required:      pagesの各ページで回答必須（radio）の設問キー
+#   page_count:    ページ数（設問がなくても1）
+
+
+# questionsはmodels.get_streamlit_survey_format_jsonの"questions"
+def compile_survey_plan(questions):
+    by_page = {}
+    order_numbers = {}
+    option_index = {}
+    for key, q in questions.items():
+        by_page.setdefault(q.get("page_number") or 1, []).append(key)
+        order_numbers[key] = int(key.split("_")[1])
+        index = {}
+        for i, option in enumerate(q.get("options") or []):
+            try:
+                index.setdefault(option, i)
+            except TypeError:
+                # 辞書のキーにできない選択肢は位置を引けないものとして扱う
+                pass
+        option_index[key] = index
+    pages = [by_page[page] for page in sorted(by_page)] or [[]]
+    required = [[key for key in keys if questions[key].get("type") == "radio"] for keys in pages]
+    return {
+        "pages": pages,
+        "order_numbers": order_numbers,
+        "option_index": option_index,
+        "required": required,
+        "page_count": len(pages),
+    }
+
+
+# 値が設問の何番目の選択肢か（選択肢にない値はNone）
+def option_position(plan, key, value):
+    try:
+        return plan["option_index"][key].get(value)
+    except TypeError:
+        return None
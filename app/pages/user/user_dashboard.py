@@ -1,7 +1,9 @@
 import streamlit as st
-import asyncio
 from database import models
 from database.database import AsyncSessionLocal
+from database.draft_queue import draft_queue
+from database.query_stats import query_stats
+from database.runner import run
 import datetime
 from pages.user.answer_mode import AnswerMode
 
@@ -12,100 +14,109 @@ username = getattr(st.user, "name", None)
 st.title("ダッシュボード")
 
 
-# 公開中アンケート・回答済み・一時保存アンケート取得をmodels.pyの関数で呼び出す
-async def fetch_open_surveys():
+# 公開中アンケートとユーザーの回答状況をmodels.pyの関数で1クエリで取得する
+async def fetch_open_surveys_with_status():
     async with AsyncSessionLocal() as session:
         now = datetime.datetime.now()
-        all_surveys = await models.get_open_surveys(session, now)
-        # 回答済み・一時保存済みIDを取得
-        answered = await models.get_answered_survey_ids(session, username)
-        draft = await models.get_draft_survey_ids(session, username)
-        # 未回答のみ返す
-        return [
-            s
-            for s in all_surveys
-            if (s.survey_id if hasattr(s, "survey_id") else s[0]) not in answered
-            and (s.survey_id if hasattr(s, "survey_id") else s[0]) not in draft
-        ], draft, all_surveys
-
-
-async def fetch_answered_open_surveys():
-    async with AsyncSessionLocal() as session:
-        now = datetime.datetime.now()
-        all_surveys = await models.get_open_surveys(session, now)
-        answered = await models.get_answered_survey_ids(session, username)
-        # 回答済みかつ公開中
-        return [
-            s
-            for s in all_surveys
-            if (s.survey_id if hasattr(s, "survey_id") else s[0]) in answered
-        ]
+        return await models.get_open_surveys_with_status(session, username, now)
+
+
+# 回答状況に反映されるよう、キューに残っている一時保存を先に書き込む
+draft_queue.flush(username=username)
+surveys = run(fetch_open_surveys_with_status())
+open_surveys = [s for s in surveys if s["status"] == models.SurveyStatus.UNANSWERED]
+draft_surveys = [s for s in surveys if s["status"] == models.SurveyStatus.DRAFT]
+answered_open_surveys = [
+    s for s in surveys if s["status"] == models.SurveyStatus.SUBMITTED
+]
 
+# 各一覧はフラグメントにする。ボタンを押しても押した一覧だけが再実行され、
+# 一時保存の書き込みや回答状況のクエリを含むページ全体は再実行されない
+# （フラグメントの再実行では、直前にページ全体を実行した時の一覧がそのまま渡される）
 
-open_surveys, draft_ids, all_surveys = asyncio.run(fetch_open_surveys())
-answered_open_surveys = asyncio.run(fetch_answered_open_surveys())
 
 # 未回答アンケート一覧
-st.subheader("未回答のアンケート")
-if open_surveys:
-    cols = st.columns([2, 8, 2])
-    cols[0].write("###### ID")
-    cols[1].write("###### アンケート名")
-    cols[2].write("###### ")
-    for survey in open_surveys:
-        survey_id = survey.survey_id if hasattr(survey, "survey_id") else survey[0]
-        title = survey.title if hasattr(survey, "title") else survey[1]
-        row = st.columns([2, 8, 2])
-        row[0].write(survey_id)
-        row[1].write(title)
-        if row[2].button("回答", key=f"answer_{survey_id}"):
-            st.session_state["answer_survey_id"] = survey_id
-            st.session_state["answer_mode"] = AnswerMode.NEW
-            st.switch_page("pages/user/survey_answer.py")
-else:
-    st.write("未回答のアンケートはありません")
+@st.fragment
+@query_stats.fragment
+def show_open_surveys(open_surveys):
+    st.subheader("未回答のアンケート")
+    if open_surveys:
+        cols = st.columns([2, 8, 2])
+        cols[0].write("###### ID")
+        cols[1].write("###### アンケート名")
+        cols[2].write("###### ")
+        for survey in open_surveys:
+            survey_id = survey["survey_id"]
+            title = survey["title"]
+            row = st.columns([2, 8, 2])
+            row[0].write(survey_id)
+            row[1].write(title)
+            if row[2].button("回答", key=f"answer_{survey_id}"):
+                st.session_state["answer_survey_id"] = survey_id
+                st.session_state["answer_mode"] = AnswerMode.NEW
+                st.switch_page("pages/user/survey_answer.py")
+    else:
+        st.write("未回答のアンケートはありません")
+
 
 # 一時保存中アンケート一覧
-st.subheader("一時保存中のアンケート")
-draft_surveys = [
-    s
-    for s in all_surveys
-    if (s.survey_id if hasattr(s, "survey_id") else s[0]) in draft_ids
-]
-if draft_surveys:
-    cols = st.columns([2, 8, 2])
-    cols[0].write("###### ID")
-    cols[1].write("###### アンケート名")
-    cols[2].write("###### ")
-    for survey in draft_surveys:
-        survey_id = survey.survey_id if hasattr(survey, "survey_id") else survey[0]
-        title = survey.title if hasattr(survey, "title") else survey[1]
-        row = st.columns([2, 8, 2])
-        row[0].write(survey_id)
-        row[1].write(title)
-        if row[2].button("再開", key=f"resume_{survey_id}"):
-            st.session_state["answer_survey_id"] = survey_id
-            st.session_state["answer_mode"] = AnswerMode.RESUME
-            st.switch_page("pages/user/survey_answer.py")
-else:
-    st.write("一時保存中のアンケートはありません")
+@st.fragment
+@query_stats.fragment
+def show_draft_surveys(draft_surveys):
+    st.subheader("一時保存中のアンケート")
+    if draft_surveys:
+        cols = st.columns([2, 6, 2, 2])
+        cols[0].write("###### ID")
+        cols[1].write("###### アンケート名")
+        cols[2].write("###### 最終回答日時")
+        cols[3].write("###### ")
+        for survey in draft_surveys:
+            survey_id = survey["survey_id"]
+            title = survey["title"]
+            last_activity = survey["last_activity"]
+            row = st.columns([2, 6, 2, 2])
+            row[0].write(survey_id)
+            row[1].write(title)
+            row[2].write(
+                last_activity.strftime("%Y/%m/%d %H:%M") if last_activity else "--"
+            )
+            if row[3].button("再開", key=f"resume_{survey_id}"):
+                st.session_state["answer_survey_id"] = survey_id
+                st.session_state["answer_mode"] = AnswerMode.RESUME
+                st.switch_page("pages/user/survey_answer.py")
+    else:
+        st.write("一時保存中のアンケートはありません")
+
 
 # 回答済みかつ公開中アンケート一覧
-st.subheader("回答済みのアンケート（公開中）")
-if answered_open_surveys:
-    cols = st.columns([2, 8, 2])
-    cols[0].write("###### ID")
-    cols[1].write("###### アンケート名")
-    cols[2].write("###### ")
-    for survey in answered_open_surveys:
-        survey_id = survey.survey_id if hasattr(survey, "survey_id") else survey[0]
-        title = survey.title if hasattr(survey, "title") else survey[1]
-        row = st.columns([2, 8, 2])
-        row[0].write(survey_id)
-        row[1].write(title)
-        if row[2].button("再回答", key=f"reanswer_{survey_id}"):
-            st.session_state["answer_survey_id"] = survey_id
-            st.session_state["answer_mode"] = AnswerMode.REANSWER
-            st.switch_page("pages/user/survey_answer.py")
-else:
-    st.write("回答済みのアンケート（公開中）はありません")
+@st.fragment
+@query_stats.fragment
+def show_answered_surveys(answered_open_surveys):
+    st.subheader("回答済みのアンケート（公開中）")
+    if answered_open_surveys:
+        cols = st.columns([2, 6, 2, 2])
+        cols[0].write("###### ID")
+        cols[1].write("###### アンケート名")
+        cols[2].write("###### 最終回答日時")
+        cols[3].write("###### ")
+        for survey in answered_open_surveys:
+            survey_id = survey["survey_id"]
+            title = survey["title"]
+            last_activity = survey["last_activity"]
+            row = st.columns([2, 6, 2, 2])
+            row[0].write(survey_id)
+            row[1].write(title)
+            row[2].write(
+                last_activity.strftime("%Y/%m/%d %H:%M") if last_activity else "--"
+            )
+            if row[3].button("再回答", key=f"reanswer_{survey_id}"):
+                st.session_state["answer_survey_id"] = survey_id
+                st.session_state["answer_mode"] = AnswerMode.REANSWER
+                st.switch_page("pages/user/survey_answer.py")
+    else:
+        st.write("回答済みのアンケート（公開中）はありません")
+
+
+show_open_surveys(open_surveys)
+show_draft_surveys(draft_surveys)
+show_answered_surveys(answered_open_surveys)
@@ -0,0 +1,187 @@
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# SQLiteプロファイルごとの同時書き込み・読み取りの比較
+# 回答の保存（書き込み）とダッシュボードの表示（読み取り）を多数のスレッドから
+# database.runner 経由で同時に実行し、スループットとロックエラーの件数を数える
+#
+# 使い方:
+#   python bench/bench_concurrency.py [--writers 20] [--readers 40] [--seconds 10]
+#   python bench/bench_concurrency.py --profile wal   # 1プロファイルだけ実行
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+N_SURVEYS = 10
+N_QUESTIONS = 20
+N_USERS = 200
+
+
+def seed():
+    from database import models
+    from database.sqlite_profile import register_sqlite_profile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    register_sqlite_profile(engine)
+    models.Base.metadata.create_all(bind=engine)
+    now = datetime.datetime.now()
+    with Session(engine) as session:
+        for i in range(N_SURVEYS):
+            survey = models.Survey(
+                title=f"アンケート{i}",
+                created_at=now,
+                end_date=now + datetime.timedelta(days=7),
+            )
+            session.add(survey)
+            session.flush()
+            for j in range(N_QUESTIONS):
+                session.add(
+                    models.Question(
+                        survey_id=survey.survey_id,
+                        question_text=f"質問{j}",
+                        question_type="radio",
+                        options=json.dumps(["A", "B", "C"]),
+                        order_number=j + 1,
+                        page_number=1,
+                    )
+                )
+        session.commit()
+    engine.dispose()
+
+
+# 1プロファイル分の計測（子プロセスで実行する）
+def run_profile(args):
+    os.environ["SURVEY_DB_PROFILE"] = args.profile
+    sys.path.insert(0, str(APP_DIR))
+    tmpdir = tempfile.TemporaryDirectory()
+    os.chdir(tmpdir.name)
+    seed()
+
+    from database import models
+    from database.database import AsyncSessionLocal, engine
+    from database.runner import run
+
+    engine.echo = False
+
+    # 回答の保存（survey_answer.pyの保存処理と同じUPSERT）
+    async def write(survey_id, username, value):
+        async with AsyncSessionLocal() as session:
+            answers = {f"Q1_{j + 1}": value for j in range(N_QUESTIONS)}
+            await models.save_answers(session, survey_id, username, answers, False)
+            await session.commit()
+
+    # ダッシュボードの表示
+    async def read(username):
+        async with AsyncSessionLocal() as session:
+            return await models.get_open_surveys_with_status(
+                session, username, datetime.datetime.now()
+            )
+
+    counts = {"write": [], "read": []}
+    errors = {"locked": 0, "other": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(kind, seed_):
+        rnd = random.Random(seed_)
+        while time.perf_counter() < deadline:
+            username = f"user{rnd.randrange(N_USERS)}"
+            start = time.perf_counter()
+            try:
+                if kind == "write":
+                    run(write(rnd.randint(1, N_SURVEYS), username, rnd.choice("ABC")))
+                else:
+                    run(read(username))
+            except Exception as e:
+                with lock:
+                    errors["locked" if "locked" in str(e) else "other"] += 1
+                continue
+            with lock:
+                counts[kind].append(time.perf_counter() - start)
+
+    threads = [
+        threading.Thread(target=worker, args=("write", i)) for i in range(args.writers)
+    ] + [
+        threading.Thread(target=worker, args=("read", 1000 + i))
+        for i in range(args.readers)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    run(engine.dispose())
+
+    result = {"profile": args.profile, "errors": errors}
+    for kind, samples in counts.items():
+        samples.sort()
+        result[kind] = {
+            "ops": len(samples),
+            "ops_per_sec": len(samples) / args.seconds,
+            "p50_ms": samples[len(samples) // 2] * 1000 if samples else None,
+            "p95_ms": samples[int(len(samples) * 0.95) - 1] * 1000 if samples else None,
+            "mean_ms": statistics.fmean(samples) * 1000 if samples else None,
+        }
+    print(json.dumps(result))
+    tmpdir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLiteプロファイルごとの同時実行性能")
+    parser.add_argument("--profile", help="計測するプロファイル（省略時はdefaultとwal）")
+    parser.add_argument("--writers", type=int, default=20, help="書き込みスレッド数")
+    parser.add_argument("--readers", type=int, default=40, help="読み取りスレッド数")
+    parser.add_argument("--seconds", type=float, default=10, help="計測時間（秒）")
+    parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    if args.profile:
+        run_profile(args)
+        return
+
+    results = []
+    for profile in ("default", "wal"):
+        out = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--profile",
+                profile,
+                "--writers",
+                str(args.writers),
+                "--readers",
+                str(args.readers),
+                "--seconds",
+                str(args.seconds),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(
+        f"{'profile':8} {'writes/s':>9} {'w p95ms':>8} {'reads/s':>9} {'r p95ms':>8}"
+        f" {'locked':>7} {'other':>6}"
+    )
+    for r in results:
+        print(
+            f"{r['profile']:8} {r['write']['ops_per_sec']:9.1f} {r['write']['p95_ms'] or 0:8.1f}"
+            f" {r['read']['ops_per_sec']:9.1f} {r['read']['p95_ms'] or 0:8.1f}"
+            f" {r['errors']['locked']:7} {r['errors']['other']:6}"
+        )
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+# ページ全体の再実行とフラグメントだけの再実行の比較
+# 回答ページ（カレントページの設問）、ダッシュボード（各一覧）、アンケート管理（一覧の各行）を
+# Streamlitのスクリプトランナーで実行し、ページ全体の再実行とフラグメント1つの再実行にかかる時間を計る
+# （AppTestはフラグメントだけの再実行に対応していないので、同じ部品を直接使って実行する）
+#
+# 使い方:
+#   python bench/bench_fragments.py [--reruns 50] [--questions 20] [--surveys 100] [--json result.json]
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+PAGES = {
+    "survey_answer": ("pages/user/survey_answer.py", "render_current_page"),
+    "user_dashboard": ("pages/user/user_dashboard.py", "show_open_surveys"),
+    "survey_admin": ("pages/admin/survey_admin.py", "show_survey_row"),
+}
+USERNAME = "user0"
+
+
+def seed(n_surveys, n_questions, n_users=50):
+    from database import models
+    from database.sqlite_profile import register_sqlite_profile
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    register_sqlite_profile(engine)
+    models.Base.metadata.create_all(bind=engine)
+    now = datetime.datetime.now()
+    with Session(engine) as session:
+        for i in range(n_surveys):
+            survey = models.Survey(
+                title=f"アンケート{i}",
+                description="ベンチマーク用",
+                created_at=now,
+                end_date=now + datetime.timedelta(days=7),
+            )
+            session.add(survey)
+            session.flush()
+            status = (
+                models.SurveyStatus.DRAFT if i % 2 == 0 else models.SurveyStatus.SUBMITTED
+            )
+            responses = [
+                models.Response(
+                    survey_id=survey.survey_id,
+                    username=f"user{u}",
+                    status=status.value,
+                    revision=0 if i % 2 == 0 else 1,
+                )
+                for u in range(n_users)
+            ]
+            for j in range(n_questions):
+                question = models.Question(
+                    survey_id=survey.survey_id,
+                    question_text=f"質問{j}",
+                    question_type="radio",
+                    options=json.dumps(["A", "B", "C"]),
+                    order_number=j + 1,
+                    page_number=1,
+                )
+                session.add(question)
+                session.flush()
+                # 1件目のアンケート以外は回答者がいる（ダッシュボードの各一覧に行が出る）
+                if i == 0:
+                    continue
+                for u in range(n_users):
+                    session.add(
+                        models.Answer(
+                            username=f"user{u}",
+                            question_id=question.question_id,
+                            response=responses[u],
+                            answer_text="A",
+                            is_draft=i % 2 == 0,
+                        )
+                    )
+        session.commit()
+    engine.dispose()
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[int(len(samples) * 0.95) - 1] * 1000,
+    }
+
+
+# AppTestと同じ部品でページを実行する。フラグメントの保存先をスクリプトの実行をまたいで
+# 使い回すことで、ブラウザからの操作と同じくフラグメントだけを再実行できる
+class PageRunner:
+    def __init__(self, script_path, session_values):
+        from streamlit.runtime.fragment import MemoryFragmentStorage
+        from streamlit.runtime.state import SafeSessionState, SessionState
+
+        self.script_path = script_path
+        self.session_state = SafeSessionState(SessionState(), lambda: None)
+        for key, value in session_values.items():
+            self.session_state[key] = value
+        self.fragment_storage = MemoryFragmentStorage()
+
+    def rerun(self, fragment_ids=()):
+        from streamlit.runtime import Runtime
+        from streamlit.runtime.pages_manager import PagesManager
+        from streamlit.runtime.scriptrunner import RerunData
+        from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+        from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+        from streamlit.testing.v1.util import patch_config_options
+        from unittest.mock import MagicMock
+
+        Runtime._instance = MagicMock(spec=Runtime)
+        pages_manager = PagesManager(self.script_path, ScriptCache(), setup_watcher=False)
+        script_runner = LocalScriptRunner(
+            self.script_path, self.session_state, pages_manager
+        )
+        script_runner._fragment_storage = self.fragment_storage
+        with patch_config_options({"global.appTest": True}):
+            script_runner.request_rerun(
+                RerunData(
+                    fragment_id_queue=list(fragment_ids),
+                    is_fragment_scoped_rerun=bool(fragment_ids),
+                )
+            )
+            start = time.perf_counter()
+            script_runner.start()
+            script_runner.join()
+            elapsed = time.perf_counter() - start
+        Runtime._instance = None
+        return elapsed
+
+    # 関数名がnameのフラグメントのID（実行したページで登録されたもの）
+    def fragment_ids(self, name):
+        ids = []
+        for fragment_id, wrapped in self.fragment_storage._fragments.items():
+            cells = [c.cell_contents for c in wrapped.__closure__ or ()]
+            if any(getattr(c, "__name__", None) == name for c in cells):
+                ids.append(fragment_id)
+        return ids
+
+
+def measure(page_runner, fragment_name, reruns):
+    # 1回目はモジュールの読み込みやキャッシュの作成を含むので計測しない
+    page_runner.rerun()
+    fragment_id = page_runner.fragment_ids(fragment_name)[0]
+    full = [page_runner.rerun() for _ in range(reruns)]
+    fragment = [page_runner.rerun([fragment_id]) for _ in range(reruns)]
+    return {"full_rerun": summarize(full), "fragment_rerun": summarize(fragment)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ページ全体とフラグメントの再実行時間の比較")
+    parser.add_argument("--reruns", type=int, default=50, help="再実行の回数")
+    parser.add_argument("--questions", type=int, default=20, help="アンケート1件の設問数")
+    parser.add_argument("--surveys", type=int, default=100, help="アンケート数")
+    parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    json_path = pathlib.Path(args.json).resolve() if args.json else None
+    sys.path.insert(0, str(APP_DIR))
+    tmpdir = tempfile.TemporaryDirectory()
+    os.chdir(tmpdir.name)
+    seed(args.surveys, args.questions)
+
+    import streamlit as st
+    from database.database import engine
+    from database.runner import run, runner
+    from pages.user.answer_mode import AnswerMode
+
+    # SQLのログ出力は計測の邪魔になるので止める
+    engine.echo = False
+
+    # ログインしたユーザーの代わり
+    class _User(dict):
+        __getattr__ = dict.get
+
+    st.user = _User(name=USERNAME, is_logged_in=True)
+
+    session_values = {
+        "survey_answer": {"answer_survey_id": 1, "answer_mode": AnswerMode.NEW},
+        "user_dashboard": {},
+        "survey_admin": {},
+    }
+    result = {"reruns": args.reruns, "questions": args.questions, "surveys": args.surveys}
+    for name, (script, fragment_name) in PAGES.items():
+        page_runner = PageRunner(str(APP_DIR / script), session_values[name])
+        result[name] = measure(page_runner, fragment_name, args.reruns)
+
+    print(f"{'':28} {'mean':>9} {'p50':>9} {'p95':>9}  (ms / rerun)")
+    for name in PAGES:
+        for kind in ("full_rerun", "fragment_rerun"):
+            r = result[name][kind]
+            label = f"{name} {kind}"
+            print(f"{label:28} {r['mean_ms']:9.2f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f}")
+    if json_path:
+        json_path.write_text(json.dumps(result, indent=2))
+    run(engine.dispose())
+    runner.stop()
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from datagen import (
+    BASE_DATE,
+    generate_database,
+    survey_answers,
+    survey_definition,
+    username,
+)
+
+# models.py の主なクエリと回答の保存の実行時間を、データ量を変えて計るベンチマーク
+# データは datagen.py で規模ごとに作る（同じseedなら同じデータ）。結果はJSONに書き出し、
+# --baseline に以前の結果を指定すると関数ごとの変化（平均の比）を表示する
+#
+# 使い方:
+#   python bench/bench_models.py [--scales small medium] [--iterations 50] [--json result.json]
+#   python bench/bench_models.py --json after.json --baseline before.json
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+SCALES = {
+    "small": {"n_surveys": 20, "questions_per_type": 2, "n_users": 100},
+    "medium": {"n_surveys": 100, "questions_per_type": 3, "n_users": 300},
+    "large": {"n_surveys": 200, "questions_per_type": 3, "n_users": 1000},
+}
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[max(int(len(samples) * 0.95) - 1, 0)] * 1000,
+        "min_ms": samples[0] * 1000,
+    }
+
+
+# 計測する処理（targetは計測1回分のアンケートID・ユーザー名・保存する回答）
+# 保存はデータを書き換えるので最後に行う
+def benchmarks(models):
+    now = datetime.datetime.now()
+
+    async def save(session, target, is_draft):
+        await models.save_answers(
+            session, target["survey_id"], target["username"], target["answers"], is_draft
+        )
+        await session.commit()
+
+    return {
+        "get_open_surveys": lambda s, t: models.get_open_surveys(s, now),
+        "get_open_surveys_with_status": lambda s, t: (
+            models.get_open_surveys_with_status(s, t["username"], now)
+        ),
+        "get_answered_survey_ids": lambda s, t: (
+            models.get_answered_survey_ids(s, t["username"])
+        ),
+        "get_draft_survey_ids": lambda s, t: models.get_draft_survey_ids(s, t["username"]),
+        "get_streamlit_survey_format_json": lambda s, t: (
+            models.get_streamlit_survey_format_json(s, t["survey_id"])
+        ),
+        "get_answers_for_survey_and_user": lambda s, t: (
+            models.get_answers_for_survey_and_user(s, t["survey_id"], t["username"])
+        ),
+        # 管理画面のアンケート一覧1ページ分（100件）の回答状況
+        "get_survey_response_summaries": lambda s, t: (
+            models.get_survey_response_summaries(
+                s, list(range(t["survey_id"], t["survey_id"] + 100))
+            )
+        ),
+        "save_answers_draft": lambda s, t: save(s, t, True),
+        "save_answers_submit": lambda s, t: save(s, t, False),
+    }
+
+
+def run_scale(name, params, iterations, seed):
+    from database import models
+    from database.runner import run
+    from database.sqlite_profile import register_sqlite_profile
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    start = time.perf_counter()
+    counts = generate_database("./survey_app.db", seed=seed, **params)
+    generate_s = time.perf_counter() - start
+    # アプリのエンジン（database.database）はファイルのパスを作成時のカレントディレクトリで
+    # 決めてしまうので、規模ごとのDBには同じ設定のエンジンを作って接続する
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{os.path.abspath('survey_app.db')}"
+    )
+    register_sqlite_profile(engine.sync_engine)
+    AsyncSessionLocal = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+    # 計測ごとのアンケート・ユーザー・回答も決まった順に選ぶ（アンケートIDは1から順に振られる）
+    rng = random.Random(f"{seed}-{name}")
+    targets = []
+    for _ in range(iterations):
+        index = rng.randrange(params["n_surveys"])
+        survey = survey_definition(index, params["questions_per_type"], seed)
+        targets.append(
+            {
+                "survey_id": index + 1,
+                "username": username(rng.randrange(params["n_users"])),
+                "answers": survey_answers(rng, survey),
+            }
+        )
+
+    async def call(benchmark, target):
+        async with AsyncSessionLocal() as session:
+            return await benchmark(session, target)
+
+    results = {}
+    for bench_name, benchmark in benchmarks(models).items():
+        # 接続の作成が計測に含まれないよう1回実行しておく
+        run(call(benchmark, targets[0]))
+        samples = []
+        for target in targets:
+            t = time.perf_counter()
+            run(call(benchmark, target))
+            samples.append(time.perf_counter() - t)
+        results[bench_name] = summarize(samples)
+    run(engine.dispose())
+    return {
+        "params": params,
+        "counts": counts,
+        "db_bytes": os.path.getsize("./survey_app.db"),
+        "generate_s": generate_s,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="models.py のクエリと回答保存のベンチマーク")
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        choices=list(SCALES),
+        default=["small", "medium"],
+        help="データの規模（largeは回答約230万件）",
+    )
+    parser.add_argument("--iterations", type=int, default=50, help="関数ごとの実行回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較する以前の結果（JSON）")
+    args = parser.parse_args()
+
+    json_path = pathlib.Path(args.json).resolve() if args.json else None
+    baseline = json.loads(pathlib.Path(args.baseline).read_text()) if args.baseline else None
+    sys.path.insert(0, str(APP_DIR))
+    from database.runner import runner
+
+    result = {
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "seed": args.seed,
+        "iterations": args.iterations,
+        "data_base_date": BASE_DATE.isoformat(),
+        "scales": {},
+    }
+    cwd = os.getcwd()
+    for name in args.scales:
+        # 規模ごとに新しいDBを作る
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.chdir(tmpdir)
+            try:
+                result["scales"][name] = run_scale(
+                    name, SCALES[name], args.iterations, args.seed
+                )
+            finally:
+                os.chdir(cwd)
+
+        scale = result["scales"][name]
+        counts = scale["counts"]
+        print(
+            f"[{name}] アンケート{counts['surveys']}件、設問{counts['questions']}件、"
+            f"回答{counts['answers']}件（生成{scale['generate_s']:.1f}秒）"
+        )
+        print(f"{'':34} {'mean':>9} {'p50':>9} {'p95':>9}  (ms)")
+        before_results = (baseline or {}).get("scales", {}).get(name, {}).get("results", {})
+        for bench_name, r in scale["results"].items():
+            line = f"{bench_name:34} {r['mean_ms']:9.2f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f}"
+            before = before_results.get(bench_name)
+            if before:
+                line += f"  ({r['mean_ms'] / before['mean_ms']:.2f}x)"
+            print(line)
+
+    runner.stop()
+    if json_path:
+        json_path.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+# リラン1回あたりのDBアクセスのオーバーヘッドを比較するベンチマーク
+#   before: DB呼び出しごとに asyncio.run() でイベントループを作って破棄する（従来の実装）
+#   after : database.runner の常駐イベントループにコルーチンを投げる
+#
+# 使い方:
+#   python bench/bench_runner.py [--reruns 200] [--calls 3] [--json result.json]
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+
+
+def seed(n_surveys=20, n_questions=10, n_users=50):
+    from database import models
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    engine = create_engine("sqlite:///./survey_app.db")
+    models.Base.metadata.create_all(bind=engine)
+    now = datetime.datetime.now()
+    with Session(engine) as session:
+        for i in range(n_surveys):
+            survey = models.Survey(
+                title=f"アンケート{i}",
+                created_at=now,
+                end_date=now + datetime.timedelta(days=7),
+            )
+            session.add(survey)
+            session.flush()
+            responses = [
+                models.Response(
+                    survey_id=survey.survey_id,
+                    username=f"user{u}",
+                    status=models.SurveyStatus.SUBMITTED.value,
+                    revision=1,
+                )
+                for u in range(n_users)
+            ]
+            for j in range(n_questions):
+                question = models.Question(
+                    survey_id=survey.survey_id,
+                    question_text=f"質問{j}",
+                    question_type="radio",
+                    options=json.dumps(["A", "B", "C"]),
+                    order_number=j + 1,
+                    page_number=1,
+                )
+                session.add(question)
+                session.flush()
+                for u in range(n_users):
+                    session.add(
+                        models.Answer(
+                            username=f"user{u}",
+                            question_id=question.question_id,
+                            response=responses[u],
+                            answer_text="A",
+                            is_draft=False,
+                        )
+                    )
+        session.commit()
+    engine.dispose()
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[int(len(samples) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="asyncio.run と常駐ランナーの比較")
+    parser.add_argument("--reruns", type=int, default=200, help="リラン回数")
+    parser.add_argument("--calls", type=int, default=3, help="リラン1回あたりのDB呼び出し数")
+    parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    json_path = pathlib.Path(args.json).resolve() if args.json else None
+    sys.path.insert(0, str(APP_DIR))
+    tmpdir = tempfile.TemporaryDirectory()
+    os.chdir(tmpdir.name)
+    seed()
+
+    from database import models
+    from database.database import AsyncSessionLocal, engine
+    from database.runner import pool_stats, run, runner
+
+    # SQLのログ出力は計測の邪魔になるので止める
+    engine.echo = False
+
+    # ダッシュボード相当のクエリ
+    async def query():
+        async with AsyncSessionLocal() as session:
+            return await models.get_open_surveys_with_status(
+                session, "user1", datetime.datetime.now()
+            )
+
+    def measure(call):
+        samples = []
+        for _ in range(args.reruns):
+            start = time.perf_counter()
+            for _ in range(args.calls):
+                call(query())
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    # 接続の作成がそれぞれの計測に含まれないよう、1回ずつ実行しておく
+    asyncio.run(query())
+    before = summarize(measure(asyncio.run))
+    asyncio.run(engine.dispose())
+    run(query())
+    after = summarize(measure(run))
+    stats = pool_stats()
+    run(engine.dispose())
+    runner.stop()
+
+    result = {
+        "reruns": args.reruns,
+        "calls_per_rerun": args.calls,
+        "asyncio_run": before,
+        "runner": after,
+        "pool": stats,
+    }
+    print(f"{'':12} {'mean':>9} {'p50':>9} {'p95':>9}  (ms / rerun, {args.calls} calls)")
+    for name in ("asyncio_run", "runner"):
+        r = result[name]
+        print(f"{name:12} {r['mean_ms']:9.2f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f}")
+    print(f"pool: {stats['status']}")
+    if json_path:
+        json_path.write_text(json.dumps(result, indent=2))
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import datetime
+import functools
+import io
+import json
+import pathlib
+import random
+import sys
+import time
+
+# ベンチマーク用のテストデータ生成（同じ引数・seedなら毎回同じデータになる）
+#
+# アンケートN件、各アンケートに設問形式ごとにM問、ユーザーU人の回答を作る。
+# ユーザーはアンケートごとに提出済み（submitted_ratio）、一時保存中（draft_ratio）、未回答に分かれ、
+# 一時保存中のユーザーは先頭の設問の一部だけ回答している。自由記述は提出済みでも未回答がある。
+# 書き込みは一括取り込み（database/bulk_import.py の load_surveys）と同じ処理で行う。
+#
+# 使い方:
+#   python bench/datagen.py [--surveys 100] [--questions 3] [--users 500] [--seed 0]
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+# 作成日・回答日時の基準（実行日によってデータが変わらないよう固定する）
+BASE_DATE = datetime.datetime(2025, 4, 1, 9, 0)
+# 公開中のアンケートの公開期限
+OPEN_END_DATE = datetime.datetime(2099, 12, 31, 23, 59)
+# 公開中のアンケートの割合（残りは公開期限切れ）
+OPEN_RATIO = 0.8
+QUESTIONS_PER_PAGE = 5
+TEXT_ANSWER_RATIO = 0.7
+# 設問形式ごとの選択肢
+QUESTION_OPTIONS = {
+    "text": None,
+    "radio": ["とても満足", "満足", "普通", "不満", "とても不満"],
+    "select": ["営業", "開発", "企画", "総務", "経理", "人事"],
+    "multiselect": ["メール", "チャット", "電話", "対面", "ビデオ会議"],
+    "slider": [0, 10],
+    "select_slider": ["1", "2", "3", "4", "5"],
+}
+
+
+def _rng(seed, *keys):
+    return random.Random("-".join(str(k) for k in (seed,) + keys))
+
+
+# アンケート定義（bulk_import._parse_definitionの結果と同じ形式）
+def survey_definition(index, questions_per_type, seed):
+    rng = _rng(seed, "survey", index)
+    created_at = BASE_DATE + datetime.timedelta(days=index % 365, minutes=index)
+    if rng.random() < OPEN_RATIO:
+        end_date = OPEN_END_DATE
+    else:
+        end_date = created_at + datetime.timedelta(days=14)
+    questions = []
+    for n in range(questions_per_type):
+        for qtype, options in QUESTION_OPTIONS.items():
+            order_number = len(questions) + 1
+            questions.append(
+                {
+                    "question_text": f"{qtype}の設問{n + 1}",
+                    "question_type": qtype,
+                    "options": json.dumps(options, ensure_ascii=False) if options else None,
+                    "order_number": order_number,
+                    "page_number": (order_number - 1) // QUESTIONS_PER_PAGE + 1,
+                }
+            )
+    return {
+        "name": f"bench_{index}",
+        "title": f"ベンチマーク用アンケート{index}",
+        "description": f"設問{len(questions)}問",
+        "created_at": created_at,
+        "end_date": end_date,
+        "questions": questions,
+        "responses": None,
+    }
+
+
+def _answer_value(rng, qtype):
+    options = QUESTION_OPTIONS[qtype]
+    if qtype == "text":
+        return f"自由記述の回答{rng.randrange(1000)}" if rng.random() < TEXT_ANSWER_RATIO else ""
+    if qtype == "multiselect":
+        return rng.sample(options, rng.randint(1, 3))
+    if qtype == "slider":
+        return rng.randint(options[0], options[-1])
+    return rng.choice(options)
+
+
+# 先頭からanswered問（省略時は全部）に回答した {"Q{page}_{order}": 値}
+def survey_answers(rng, survey, answered=None):
+    answers = {}
+    for q in survey["questions"][:answered]:
+        key = f"Q{q['page_number']}_{q['order_number']}"
+        answers[key] = _answer_value(rng, q["question_type"])
+    return answers
+
+
+def username(u):
+    return f"user{u:05d}"
+
+
+# アンケート1件分の回答（エクスポートと同じ列のJSONL）
+def survey_responses(index, survey, n_users, draft_ratio, submitted_ratio, seed):
+    rng = _rng(seed, "responses", index)
+    n_questions = len(survey["questions"])
+    lines = []
+    for u in range(n_users):
+        r = rng.random()
+        if r < submitted_ratio:
+            status, answered = "submitted", n_questions
+        elif r < submitted_ratio + draft_ratio:
+            status, answered = "draft", rng.randint(1, n_questions)
+        else:
+            continue
+        submitted_at = survey["created_at"] + datetime.timedelta(
+            minutes=rng.randrange(14 * 24 * 60)
+        )
+        row = {
+            "username": username(u),
+            "status": status,
+            "submitted_at": submitted_at.isoformat(sep=" "),
+        }
+        row.update(survey_answers(rng, survey, answered))
+        lines.append(json.dumps(row, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# テストデータを書き込み、件数（surveys, questions, answers）を返す（connは同期のConnection）
+# 回答は書き込む時にアンケートごとに作るので、件数が多くてもまとめてメモリに載せない
+def generate(
+    conn,
+    n_surveys,
+    questions_per_type,
+    n_users,
+    draft_ratio=0.1,
+    submitted_ratio=0.6,
+    seed=0,
+):
+    from database.bulk_import import load_surveys
+
+    surveys = []
+    for index in range(n_surveys):
+        survey = survey_definition(index, questions_per_type, seed)
+        responses = functools.partial(
+            survey_responses, index, survey, n_users, draft_ratio, submitted_ratio, seed
+        )
+        survey["responses"] = (
+            f"{survey['name']}.jsonl",
+            lambda responses=responses: io.BytesIO(responses()),
+        )
+        surveys.append(survey)
+    return load_surveys(conn, surveys, now=BASE_DATE)
+
+
+# db_pathにテーブルを作り、テストデータを書き込む
+def generate_database(db_path, **params):
+    from database import models
+    from database.sqlite_profile import register_sqlite_profile
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    register_sqlite_profile(engine)
+    models.Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        counts = generate(conn, **params)
+    engine.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用のテストデータ生成")
+    parser.add_argument("--surveys", type=int, default=100, help="アンケート数")
+    parser.add_argument("--questions", type=int, default=3, help="設問形式ごとの設問数")
+    parser.add_argument("--users", type=int, default=500, help="ユーザー数")
+    parser.add_argument("--draft-ratio", type=float, default=0.1, help="一時保存中のユーザーの割合")
+    parser.add_argument("--submitted-ratio", type=float, default=0.6, help="提出済みのユーザーの割合")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", default="./survey_app.db", help="書き込むDBファイル")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(APP_DIR))
+    start = time.perf_counter()
+    counts = generate_database(
+        args.db,
+        n_surveys=args.surveys,
+        questions_per_type=args.questions,
+        n_users=args.users,
+        draft_ratio=args.draft_ratio,
+        submitted_ratio=args.submitted_ratio,
+        seed=args.seed,
+    )
+    print(
+        f"アンケート{counts['surveys']}件、設問{counts['questions']}件、"
+        f"回答{counts['answers']}件（{time.perf_counter() - start:.1f}秒）"
+    )
+
+
+if __name__ == "__main__":
+    main()
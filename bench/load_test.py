@@ -0,0 +1,367 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from datagen import generate_database
+
+# 多数のユーザーが同時にアンケートに回答する負荷試験（ブラウザなし）
+#
+# ユーザーごとのスレッドが streamlit.testing.v1.AppTest でページのスクリプトを実行し、
+#   ダッシュボード → 回答ボタン → 回答ページ → 各ページの回答・次へ → 一時保存 → 提出
+# の順に操作する。ログインはKeycloakの代わりにsession_stateのユーザー名を返すst.userで置き換える。
+# AppTestはst.navigation・st.switch_pageによるページ移動をたどれないので、ページ移動は
+# main.py が表示するページのスクリプト（app/pages/...）をボタンが設定するsession_stateで開き直して行う。
+# DBは一時ディレクトリのSQLiteファイル（datagen.pyのデータ入り）を使う。
+#
+# リラン（ボタン・入力1回の再実行）ごとの時間のp50/p95/p99、DBのロックエラー、
+# 提出数・リラン数のスループットを表示する。
+#
+# 使い方:
+#   python bench/load_test.py [--users 50] [--ramp-seconds 0] [--json result.json]
+#   SURVEY_DB_PROFILE=default python bench/load_test.py --users 100
+
+APP_DIR = pathlib.Path(__file__).resolve().parent.parent / "app"
+DASHBOARD = APP_DIR / "pages/user/user_dashboard.py"
+SURVEY_ANSWER = APP_DIR / "pages/user/survey_answer.py"
+USER_KEY = "_load_test_user"
+
+
+# 実行中のページのsession_stateにあるユーザー名を返すst.user（ユーザーごとに別の値になる）
+class SessionUser:
+    def _info(self):
+        import streamlit as st
+
+        try:
+            return {"name": st.session_state[USER_KEY], "is_logged_in": True}
+        except KeyError:
+            return {"is_logged_in": False}
+
+    def __getattr__(self, name):
+        return self._info().get(name)
+
+    def __contains__(self, key):
+        return key in self._info()
+
+    def __bool__(self):
+        return True
+
+
+# AppTestはスクリプトを実行するたびにRuntimeのインスタンスと設定（global.appTest）を差し替えて
+# 元に戻すので、複数のスレッドで同時に実行すると他のスレッドの実行中に消してしまう。
+# プロセス全体で1回だけ設定し、AppTestが差し替える先を本物のRuntime・設定から切り離す
+def share_app_test_runtime():
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import (
+        MemoryCacheStorageManager,
+    )
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import build_mock_config_get_option
+    from unittest.mock import MagicMock
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    # 設定を読み込んだ時にログの出力レベルも設定し直されるので、ここで指定する
+    config.get_option = build_mock_config_get_option(
+        {"global.appTest": True, "logger.level": "critical"}
+    )
+    app_test.Runtime = type("Runtime", (), {})
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+
+
+# 提出後などにページ（app/pages）が待つtime.sleepを省く
+# AppTest自身もtime.sleepで実行の終了を待つので、それ以外の呼び出しはそのまま待つ
+def skip_page_sleep():
+    sleep = time.sleep
+    pages_dir = str(APP_DIR / "pages")
+
+    def page_sleep(seconds):
+        if not sys._getframe(1).f_code.co_filename.startswith(pages_dir):
+            sleep(seconds)
+
+    time.sleep = page_sleep
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def rank(p):
+        return samples[min(len(samples) - 1, max(0, int(len(samples) * p + 0.5) - 1))]
+
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": rank(0.50) * 1000,
+        "p95_ms": rank(0.95) * 1000,
+        "p99_ms": rank(0.99) * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+class VirtualUser:
+    def __init__(self, name, survey_id, stats, args):
+        self.username = name
+        self.survey_id = survey_id
+        self.stats = stats
+        self.args = args
+        self.rng = random.Random(f"{args.seed}-{name}")
+
+    # リラン1回（AppTestまたは操作したウィジェットのrun()）を実行して時間を記録する
+    def rerun(self, step, element):
+        start = time.perf_counter()
+        at = element.run()
+        self.stats.add(step, time.perf_counter() - start, at.exception)
+        return at
+
+    def think(self):
+        if self.args.think_seconds:
+            self.stats.sleep(self.rng.uniform(0, self.args.think_seconds))
+
+    def answer_widgets(self, at):
+        for radio in at.radio:
+            radio.set_value(self.rng.choice(radio.options))
+        for select in at.selectbox:
+            select.set_value(self.rng.choice(select.options))
+        for multiselect in at.multiselect:
+            multiselect.set_value(self.rng.sample(multiselect.options, 2))
+        for text in at.text_input:
+            text.set_value(f"{self.username}の回答")
+        for slider in at.slider:
+            slider.set_value(self.rng.randint(int(slider.min), int(slider.max)))
+        for select_slider in at.select_slider:
+            select_slider.set_value(self.rng.choice(select_slider.options))
+
+    def button(self, at, label):
+        return next((b for b in at.button if b.label == label), None)
+
+    def session(self):
+        from streamlit.testing.v1 import AppTest
+
+        timeout = self.args.timeout
+
+        # ダッシュボードを開き、未回答のアンケートの回答ボタンを押す
+        at = AppTest.from_file(str(DASHBOARD), default_timeout=timeout)
+        at.session_state[USER_KEY] = self.username
+        at = self.rerun("dashboard", at)
+        self.think()
+        at = self.rerun("dashboard_click", at.button(key=f"answer_{self.survey_id}").click())
+
+        # 回答ボタンが設定したsession_stateで回答ページを開く
+        answer = AppTest.from_file(str(SURVEY_ANSWER), default_timeout=timeout)
+        answer.session_state[USER_KEY] = self.username
+        answer.session_state["answer_survey_id"] = at.session_state["answer_survey_id"]
+        answer.session_state["answer_mode"] = at.session_state["answer_mode"]
+        if self.args.autosave:
+            answer.session_state["autosave_draft"] = True
+        answer = self.rerun("answer_open", answer)
+
+        page = 0
+        while True:
+            self.think()
+            self.answer_widgets(answer)
+            answer = self.rerun("answer_input", answer)
+            if page == 0:
+                answer = self.rerun("draft", self.button(answer, "一時保存").click())
+            # 最後のページには次へボタンがなく、提出ボタンが出る
+            next_button = self.button(answer, "次へ")
+            if next_button is None or next_button.disabled:
+                break
+            answer = self.rerun("next_page", next_button.click())
+            page += 1
+        answer = self.rerun("submit", self.button(answer, "Submit").click())
+        if any("回答を保存しました" in s.value for s in answer.success):
+            self.stats.submitted()
+
+    def run(self):
+        try:
+            self.session()
+        except Exception as e:
+            self.stats.failed(e)
+
+
+class LoadStats:
+    def __init__(self):
+        self.samples = {}
+        self.locked = 0
+        self.errors = []
+        self.submissions = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def add(self, step, elapsed, exceptions):
+        with self._lock:
+            self.samples.setdefault(step, []).append(elapsed)
+            for e in exceptions:
+                # 回答ボタン・提出後のst.switch_pageはAppTestではページが見つからず例外になる
+                if "Could not find page" in e.message:
+                    continue
+                if "locked" in e.message:
+                    self.locked += 1
+                else:
+                    self.errors.append(f"{step}: {e.message}")
+
+    def submitted(self):
+        with self._lock:
+            self.submissions += 1
+
+    def failed(self, e):
+        with self._lock:
+            if "locked" in str(e):
+                self.locked += 1
+            else:
+                self.errors.append(f"{type(e).__name__}: {e}")
+
+    def sleep(self, seconds):
+        self._stop.wait(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同時回答の負荷試験（AppTest）")
+    parser.add_argument("--users", type=int, default=50, help="同時に回答するユーザー数")
+    parser.add_argument(
+        "--ramp-seconds", type=float, default=0, help="全ユーザーが開始するまでの時間（0なら一斉）"
+    )
+    parser.add_argument("--think-seconds", type=float, default=0, help="操作の間の最大待ち時間")
+    parser.add_argument("--questions", type=int, default=2, help="設問形式ごとの設問数（5問で1ページ）")
+    parser.add_argument("--existing-users", type=int, default=200, help="回答済みなどの既存ユーザー数")
+    parser.add_argument("--autosave", action="store_true", help="ページ移動時の自動一時保存をオンにする")
+    parser.add_argument(
+        "--page-sleep", action="store_true", help="ページ内のtime.sleep（提出後の待ちなど）をそのまま行う"
+    )
+    parser.add_argument("--timeout", type=float, default=60, help="リラン1回のタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    args = parser.parse_args()
+
+    json_path = pathlib.Path(args.json).resolve() if args.json else None
+    sys.path.insert(0, str(APP_DIR))
+    tmpdir = tempfile.TemporaryDirectory()
+    os.chdir(tmpdir.name)
+    counts = generate_database(
+        "./survey_app.db",
+        n_surveys=10,
+        questions_per_type=args.questions,
+        n_users=args.existing_users,
+        seed=args.seed,
+    )
+
+    import streamlit as st
+    from database import models
+    from database.database import AsyncSessionLocal, engine
+    from database.draft_queue import draft_queue
+    from database.query_stats import query_stats, slow_query_logger
+    from database.runner import run, runner
+    from database.sqlite_profile import profile_name
+
+    # SQLのログ出力は計測の邪魔になるので止める
+    engine.echo = False
+    # 遅いクエリは件数だけ結果に含める。AppTestで起きるページ移動の例外のログは
+    # share_app_test_runtime() の設定で出さない
+    slow_query_logger.setLevel(logging.ERROR)
+    st.user = SessionUser()
+    share_app_test_runtime()
+    if not args.page_sleep:
+        skip_page_sleep()
+
+    async def first_open_survey():
+        async with AsyncSessionLocal() as session:
+            surveys = await models.get_open_surveys(session, datetime.datetime.now())
+            return min(s.survey_id for s in surveys)
+
+    survey_id = run(first_open_survey())
+    # ページのスクリプト・モジュールの初回の読み込みが計測に含まれないよう、1人分を先に実行する
+    warmup = LoadStats()
+    VirtualUser("warmup", survey_id, warmup, args).run()
+    if warmup.errors:
+        sys.exit(f"ウォームアップに失敗しました: {warmup.errors[0]}")
+    query_stats.reset()
+
+    stats = LoadStats()
+    users = [
+        VirtualUser(f"loadtest{i:04d}", survey_id, stats, args) for i in range(args.users)
+    ]
+    threads = [threading.Thread(target=u.run, name=u.username) for u in users]
+
+    start = time.perf_counter()
+    for i, thread in enumerate(threads):
+        thread.start()
+        if args.ramp_seconds and i < len(threads) - 1:
+            stats.sleep(args.ramp_seconds / len(threads))
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    draft_queue.flush()
+
+    # 提出済みとしてDBに保存されたユーザー数
+    async def saved_submissions():
+        async with AsyncSessionLocal() as session:
+            count = 0
+            for user in users:
+                if survey_id in await models.get_answered_survey_ids(session, user.username):
+                    count += 1
+            return count
+
+    all_samples = [s for samples in stats.samples.values() for s in samples]
+    result = {
+        "users": args.users,
+        "profile": profile_name(),
+        "survey_id": survey_id,
+        "data": counts,
+        "elapsed_s": elapsed,
+        "submissions": stats.submissions,
+        "submissions_per_sec": stats.submissions / elapsed,
+        "reruns": len(all_samples),
+        "reruns_per_sec": len(all_samples) / elapsed,
+        "lock_errors": stats.locked,
+        "slow_queries": len(query_stats.slow_queries()),
+        "other_errors": len(stats.errors),
+        "error_samples": stats.errors[:20],
+        "rerun_latency": percentiles(all_samples),
+        "steps": {step: percentiles(samples) for step, samples in stats.samples.items()},
+        "saved_submissions": run(saved_submissions()),
+    }
+
+    print(
+        f"ユーザー{args.users}人（プロファイル: {result['profile']}）: {elapsed:.1f}秒、"
+        f"提出{stats.submissions}件（{result['submissions_per_sec']:.1f}件/秒）、"
+        f"リラン{len(all_samples)}回（{result['reruns_per_sec']:.1f}回/秒）、"
+        f"DBに保存された提出{result['saved_submissions']}件"
+    )
+    print(
+        f"ロックエラー {stats.locked}件、その他のエラー {len(stats.errors)}件、"
+        f"{query_stats.slow_query_ms:g}ms以上のクエリ {result['slow_queries']}件"
+    )
+    for error in stats.errors[:5]:
+        print(f"  {error}")
+    print(f"{'':16} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+    for step, r in [("all", result["rerun_latency"])] + list(result["steps"].items()):
+        if r:
+            print(
+                f"{step:16} {r['count']:6} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f}"
+                f" {r['p99_ms']:9.1f} {r['max_ms']:9.1f}"
+            )
+    if json_path:
+        json_path.write_text(json.dumps(result, indent=2, ensure_ascii=False, default=str))
+    run(engine.dispose())
+    runner.stop()
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()